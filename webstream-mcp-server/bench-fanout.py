@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Fan-out benchmark with a simulated subscriber farm.
+
+Starts webstream_server.py as a subprocess (stdio MCP + HTTP), spins up N
+stand-in webhook receivers with configurable latency, error rate and timeouts,
+registers them, then drives /api/push and/or the push_webhook MCP tool at a
+target rate. Reports throughput, end-to-end delivery latency percentiles and
+server memory. The farm shares this process's event loop, so on small machines
+run it with the same settings before and after a change and compare.
+
+Examples:
+    python bench-fanout.py --receivers 500 --rate 50 --duration 10
+    python bench-fanout.py --receivers 100 --latency-ms 20 --error-rate 0.01 --target both
+    python bench-fanout.py --receivers 1000 --mode async --max-p99-ms 500 --json results.json
+
+Exits non-zero when --max-p99-ms or --min-deliveries-per-sec is given and missed,
+so it can gate CI runs.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webstream_server.py")
+
+
+# === SUBSCRIBER FARM ===
+
+class SubscriberFarm:
+    """N webhook receivers spread over a few listening sockets.
+
+    Receivers record when each message arrived; the pushed message carries the
+    time it was sent, so arrival minus send time is the end-to-end latency.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.runners = []
+        self.latencies = []  # seconds from push to receipt, one per delivered webhook request
+        self.received = 0
+        self.errors_returned = 0
+        self.timeouts_simulated = 0
+
+    def urls(self) -> list:
+        ports = self.args.farm_sockets
+        return [
+            f"http://127.0.0.1:{self.args.farm_port + i % ports}/hook/{i}"
+            for i in range(self.args.receivers)
+        ]
+
+    async def handle(self, request):
+        body = await request.json()
+        now = time.time()
+        roll = random.random()
+        if roll < self.args.timeout_rate:
+            self.timeouts_simulated += 1
+            await asyncio.sleep(self.args.webhook_timeout + 1)
+            return web.json_response({"status": "late"})
+        delay = self.args.latency_ms + random.uniform(-self.args.jitter_ms, self.args.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if roll < self.args.timeout_rate + self.args.error_rate:
+            self.errors_returned += 1
+            return web.json_response({"status": "error"}, status=500)
+
+        messages = body["messages"] if "messages" in body else [body]
+        for payload in messages:
+            try:
+                sent = json.loads(payload["message"])["sent"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.latencies.append(now - sent)
+            self.received += 1
+        return web.json_response({"status": "ok"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/hook/{index}", self.handle)
+        for i in range(self.args.farm_sockets):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", self.args.farm_port + i).start()
+            self.runners.append(runner)
+
+    async def stop(self):
+        for runner in self.runners:
+            await runner.cleanup()
+
+
+# === SERVER PROCESS ===
+
+class ServerProcess:
+    """webstream_server.py under test, with its stdio MCP session kept open."""
+
+    def __init__(self, args, data_dir: str):
+        self.args = args
+        self.data_dir = data_dir
+        self.process = None
+        self.next_id = 1
+        self.pending = {}  # JSON-RPC id -> future
+        self.reader_task = None
+        self.exited = None  # Set once the server's stdout closes
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.args.server_port}"
+
+    async def start(self, timeout: float = 30):
+        env = dict(
+            os.environ,
+            WEBHOOK_PORT=str(self.args.server_port),
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_DATA_DIR=self.data_dir,
+            WEBHOOK_TIMEOUT=str(self.args.webhook_timeout),
+            PYTHONUNBUFFERED="1"
+        )
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, SERVER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=open(os.path.join(self.data_dir, "server.log"), "w"),
+            env=env,
+            limit=2 ** 24
+        )
+        self.reader_task = asyncio.create_task(self._read_responses())
+        try:
+            await asyncio.wait_for(self.call("initialize", {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "bench-fanout", "version": "1"}
+            }), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Server did not answer initialize, see {self.data_dir}/server.log") from None
+        self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    async def wait_ready(self, session, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{self.base_url}/api/stats") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"Server did not come up, see {self.data_dir}/server.log")
+
+    def _send(self, message: dict):
+        self.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    async def _read_responses(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                try:
+                    await asyncio.wait_for(self.process.wait(), 1)  # For the exit code
+                except asyncio.TimeoutError:
+                    pass
+                self._fail_pending()
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            future = self.pending.pop(message.get("id"), None)
+            if future and not future.done():
+                future.set_result(message)
+
+    def _fail_pending(self):
+        """Fail every outstanding call once the server is gone, instead of leaving it waiting forever."""
+        self.exited = RuntimeError(f"Server exited (code {self.process.returncode}), see {self.data_dir}/server.log")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(self.exited)
+        self.pending.clear()
+
+    async def call(self, method: str, params: dict) -> dict:
+        if self.exited:
+            raise self.exited
+        request_id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self._send({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+        await self.process.stdin.drain()
+        return await future
+
+    def memory(self) -> dict:
+        """Resident and peak memory of the server and its shard workers in MiB (Linux only)."""
+        totals = {}
+        for pid in [self.process.pid] + self._children():
+            try:
+                with open(f"/proc/{pid}/status") as status:
+                    fields = dict(line.split(":", 1) for line in status)
+            except OSError:
+                continue
+            for key, field in (("rss_mib", "VmRSS"), ("peak_rss_mib", "VmHWM")):
+                if field in fields:
+                    totals[key] = totals.get(key, 0) + int(fields[field].split()[0]) / 1024
+        return {key: round(value, 1) for key, value in totals.items()}
+
+    def _children(self) -> list:
+        try:
+            with open(f"/proc/{self.process.pid}/task/{self.process.pid}/children") as children:
+                return [int(pid) for pid in children.read().split()]
+        except OSError:
+            return []
+
+    async def stop(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        self.reader_task.cancel()
+
+
+# === LOAD DRIVER ===
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+def latency_summary(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else float("nan")
+    }
+
+def make_message(padding: str) -> str:
+    return json.dumps({"sent": time.time(), "pad": padding})
+
+async def drive(name: str, push, rate: float, duration: float) -> dict:
+    """Call ``push()`` open-loop at ``rate`` per second; returns request latencies and failures."""
+    latencies = []
+    failures = 0
+    tasks = []
+
+    async def one():
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            ok = await push()
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        if not ok:
+            failures += 1
+
+    total = int(rate * duration)
+    started = time.perf_counter()
+    for i in range(total):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return {
+        "target": name,
+        "pushes": total,
+        "failed_pushes": failures,
+        "elapsed_s": round(elapsed, 3),
+        "pushes_per_sec": round(total / elapsed, 1) if elapsed else 0,
+        "request_latency": latency_summary(latencies)
+    }
+
+async def wait_for_deliveries(farm: SubscriberFarm, expected: int, timeout: float):
+    """Wait until the farm saw ``expected`` deliveries or nothing arrived for a while."""
+    deadline = time.monotonic() + timeout
+    last_count, last_change = farm.received, time.monotonic()
+    while farm.received < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        if farm.received != last_count:
+            last_count, last_change = farm.received, time.monotonic()
+        elif time.monotonic() - last_change > 2:
+            break
+
+
+async def run(args) -> dict:
+    farm = SubscriberFarm(args)
+    await farm.start()
+    data_dir = tempfile.mkdtemp(prefix="bench-fanout-")
+    server = ServerProcess(args, data_dir)
+    keep_data = args.keep_data
+    padding = "x" * args.message_bytes
+    results = {"config": vars(args).copy(), "runs": []}
+    for option in ("json", "keep_data"):
+        results["config"].pop(option, None)
+
+    connector = aiohttp.TCPConnector(limit=args.client_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            await server.start()
+            await server.wait_ready(session)
+            urls = farm.urls()
+            for start in range(0, len(urls), 1000):
+                body = {"webhooks": urls[start:start + 1000]}
+                async with session.post(f"{server.base_url}/api/register/bulk", json=body) as response:
+                    response.raise_for_status()
+            print(f"📡 Registered {len(urls)} receivers on {args.farm_sockets} sockets")
+            results["memory_idle"] = server.memory()
+
+            async def http_push():
+                body = {"message": make_message(padding), "mode": args.mode}
+                async with session.post(f"{server.base_url}/api/push", json=body) as response:
+                    await response.read()
+                    return response.status in (200, 202)
+
+            async def mcp_push():
+                reply = await server.call("tools/call", {
+                    "name": "push_webhook",
+                    "arguments": {"message": make_message(padding), "port": str(args.server_port), "mode": args.mode}
+                })
+                return "error" not in reply and not reply.get("result", {}).get("isError")
+
+            targets = {"http": http_push, "mcp": mcp_push}
+            for name in (["http", "mcp"] if args.target == "both" else [args.target]):
+                farm.latencies.clear()
+                farm.received = 0
+                print(f"🚀 Driving {name} at {args.rate}/s for {args.duration}s ({args.mode})...")
+                summary = await drive(name, targets[name], args.rate, args.duration)
+                expected = (summary["pushes"] - summary["failed_pushes"]) * len(urls)
+                await wait_for_deliveries(farm, expected, args.drain_timeout)
+                delivered_elapsed = summary["elapsed_s"]
+                summary.update({
+                    "deliveries_expected": expected,
+                    "deliveries_received": farm.received,
+                    "deliveries_per_sec": round(farm.received / delivered_elapsed, 1) if delivered_elapsed else 0,
+                    "end_to_end_latency": latency_summary(farm.latencies),
+                    "memory": server.memory()
+                })
+                async with session.get(f"{server.base_url}/api/stats") as response:
+                    summary["server_stats"] = (await response.json()).get("dispatcher")
+                results["runs"].append(summary)
+        except RuntimeError:
+            keep_data = True  # The server's log explains what went wrong
+            raise
+        finally:
+            results["farm"] = {
+                "errors_returned": farm.errors_returned,
+                "timeouts_simulated": farm.timeouts_simulated
+            }
+            await server.stop()
+            await farm.stop()
+            if keep_data:
+                print(f"🗂️  Server data and log kept in {data_dir}")
+            else:
+                shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def report(results: dict):
+    for run_result in results["runs"]:
+        e2e = run_result["end_to_end_latency"]
+        request = run_result["request_latency"]
+        memory = run_result["memory"]
+        print()
+        print(f"📊 {run_result['target']}:")
+        print(f"   pushes:           {run_result['pushes']} ({run_result['failed_pushes']} failed) "
+              f"at {run_result['pushes_per_sec']}/s")
+        print(f"   deliveries:       {run_result['deliveries_received']}/{run_result['deliveries_expected']} "
+              f"({run_result['deliveries_per_sec']}/s)")
+        print(f"   end-to-end:       p50 {e2e['p50_ms']} ms, p99 {e2e['p99_ms']} ms, max {e2e['max_ms']} ms")
+        print(f"   push request:     p50 {request['p50_ms']} ms, p99 {request['p99_ms']} ms")
+        print(f"   server memory:    {memory.get('rss_mib', '?')} MiB RSS, {memory.get('peak_rss_mib', '?')} MiB peak "
+              f"(idle {results.get('memory_idle', {}).get('rss_mib', '?')} MiB)")
+    print()
+    print(f"🧪 Farm injected {results['farm']['errors_returned']} errors and "
+          f"{results['farm']['timeouts_simulated']} timeouts")
+
+
+def check_thresholds(results: dict, args) -> list:
+    failures = []
+    for run_result in results["runs"]:
+        p99 = run_result["end_to_end_latency"]["p99_ms"]
+        if args.max_p99_ms is not None and not p99 <= args.max_p99_ms:
+            failures.append(f"{run_result['target']}: p99 {p99} ms exceeds {args.max_p99_ms} ms")
+        rate = run_result["deliveries_per_sec"]
+        if args.min_deliveries_per_sec is not None and rate < args.min_deliveries_per_sec:
+            failures.append(f"{run_result['target']}: {rate} deliveries/s below {args.min_deliveries_per_sec}")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark webhook fan-out against a simulated subscriber farm")
+    parser.add_argument("--receivers", type=int, default=100, help="Number of webhook receivers")
+    parser.add_argument("--farm-sockets", type=int, default=10, help="Listening sockets the receivers are spread over")
+    parser.add_argument("--farm-port", type=int, default=19000, help="First receiver port")
+    parser.add_argument("--server-port", type=int, default=18080, help="Port for the server under test")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Receiver response delay")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random +/- added to the response delay")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="Fraction of requests held past the webhook timeout")
+    parser.add_argument("--webhook-timeout", type=float, default=2, help="WEBHOOK_TIMEOUT for the server under test")
+    parser.add_argument("--rate", type=float, default=20, help="Pushes per second")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to drive load for")
+    parser.add_argument("--message-bytes", type=int, default=256, help="Padding added to every message")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="Push mode")
+    parser.add_argument("--target", choices=("http", "mcp", "both"), default="http", help="What to drive")
+    parser.add_argument("--client-connections", type=int, default=100, help="Connections used by the HTTP driver")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="Seconds to wait for outstanding deliveries")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the server's data directory and log")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail if end-to-end p99 exceeds this")
+    parser.add_argument("--min-deliveries-per-sec", type=float, help="Fail if delivery throughput is below this")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.farm_sockets > args.receivers:
+        args.farm_sockets = max(1, args.receivers)
+    try:
+        results = asyncio.run(run(args))
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"💾 Results written to {args.json}")
+    failures = check_thresholds(results, args)
+    for failure in failures:
+        print(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
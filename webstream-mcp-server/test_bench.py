@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the fan-out benchmark's building blocks: the simulated
+receivers, the open-loop driver and the latency summary and thresholds.
+Run with `python -m unittest test_bench`.
+"""
+import importlib.util
+import json
+import os
+import time
+import unittest
+from types import SimpleNamespace
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+spec = importlib.util.spec_from_file_location(
+    'bench_fanout', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench-fanout.py')
+)
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+
+
+def farm_args(**overrides) -> SimpleNamespace:
+    args = dict(receivers=4, farm_sockets=2, farm_port=19000, latency_ms=0, jitter_ms=0, error_rate=0,
+                timeout_rate=0, webhook_timeout=2)
+    return SimpleNamespace(**dict(args, **overrides))
+
+
+class SubscriberFarmTest(unittest.IsolatedAsyncioTestCase):
+    async def post(self, farm, body: dict):
+        app = web.Application()
+        app.router.add_post('/hook/{index}', farm.handle)
+        async with TestClient(TestServer(app)) as client:
+            return (await client.post('/hook/0', json=body)).status
+
+    def message(self) -> str:
+        return json.dumps({'sent': time.time() - 0.05})
+
+    def test_receivers_are_spread_over_the_sockets(self):
+        urls = bench.SubscriberFarm(farm_args()).urls()
+        self.assertEqual(len(urls), 4)
+        self.assertEqual({url.split('/')[2] for url in urls}, {'127.0.0.1:19000', '127.0.0.1:19001'})
+
+    async def test_single_and_batched_deliveries_are_timed(self):
+        farm = bench.SubscriberFarm(farm_args())
+        self.assertEqual(await self.post(farm, {'message': self.message()}), 200)
+        self.assertEqual(await self.post(farm, {'messages': [{'message': self.message()}] * 2}), 200)
+        self.assertEqual(farm.received, 3)
+        self.assertTrue(all(0.05 <= latency < 5 for latency in farm.latencies))
+
+    async def test_injected_errors_are_answered_and_not_counted(self):
+        farm = bench.SubscriberFarm(farm_args(error_rate=1))
+        self.assertEqual(await self.post(farm, {'message': self.message()}), 500)
+        self.assertEqual((farm.received, farm.errors_returned), (0, 1))
+
+
+class DriveTest(unittest.IsolatedAsyncioTestCase):
+    async def test_pushes_at_the_target_rate_and_counts_failures(self):
+        calls = []
+
+        async def push():
+            calls.append(time.perf_counter())
+            if len(calls) % 5 == 0:
+                raise ConnectionError('refused')
+            return len(calls) % 4 != 0
+
+        result = await bench.drive('http', push, rate=100, duration=0.2)
+        self.assertEqual((result['pushes'], len(calls)), (20, 20))
+        self.assertEqual(result['failed_pushes'], 8)  # Every 5th raised, the rest of every 4th returned False
+        self.assertGreaterEqual(calls[-1] - calls[0], 0.18)
+        self.assertEqual(result['request_latency']['count'], 20)
+
+
+class SummaryTest(unittest.TestCase):
+    def test_percentiles_use_the_nearest_rank(self):
+        summary = bench.latency_summary([i / 1000 for i in range(100, 0, -1)])
+        self.assertEqual((summary['count'], summary['p50_ms'], summary['p99_ms'], summary['max_ms']), (100, 50, 99, 100))
+        self.assertEqual(bench.latency_summary([])['count'], 0)
+
+    def test_thresholds_report_each_miss(self):
+        results = {'runs': [{'target': 'http', 'end_to_end_latency': {'p99_ms': 120}, 'deliveries_per_sec': 900}]}
+        met = SimpleNamespace(max_p99_ms=200, min_deliveries_per_sec=500)
+        missed = SimpleNamespace(max_p99_ms=100, min_deliveries_per_sec=1000)
+        self.assertEqual(bench.check_thresholds(results, met), [])
+        self.assertEqual(len(bench.check_thresholds(results, missed)), 2)
+        no_data = {'runs': [{'target': 'mcp', 'end_to_end_latency': {'p99_ms': float('nan')}, 'deliveries_per_sec': 0}]}
+        self.assertEqual(len(bench.check_thresholds(no_data, SimpleNamespace(max_p99_ms=100, min_deliveries_per_sec=None))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
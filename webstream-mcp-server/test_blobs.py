@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Unit tests for raw pushes and claim-check delivery. Run with
+`python -m unittest test_blobs`.
+"""
+import base64
+import json
+import os
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+def push_request(path: str = '/api/push', **headers):
+    return make_mocked_request('POST', path, headers=headers)
+
+
+class RawMessageTest(unittest.TestCase):
+    def test_json_is_parsed_whatever_the_content_type(self):
+        for content_type in ('application/json', 'text/plain', 'text/plain;charset=UTF-8',
+                             'application/x-www-form-urlencoded', 'application/pdf'):
+            self.assertFalse(ws.is_raw_message(push_request(**{'Content-Type': content_type})), content_type)
+        self.assertFalse(ws.is_raw_message(push_request()))
+
+    def test_octet_stream_or_raw_query_opts_in(self):
+        self.assertTrue(ws.is_raw_message(push_request(**{'Content-Type': 'application/octet-stream'})))
+        self.assertTrue(ws.is_raw_message(push_request('/api/push?raw=1', **{'Content-Type': 'application/pdf'})))
+        self.assertTrue(ws.is_raw_message(push_request('/api/push?raw=true')))
+
+
+class RawPushHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_oversized_json_push_points_to_the_raw_upload(self):
+        app = web.Application()
+        app.router.add_post('/api/push', ws.api_push_handler)
+        app.router.add_post('/api/push/batch', ws.api_push_batch_handler)
+        async with TestClient(TestServer(app)) as client:
+            for path, body in (('/api/push', {'message': 'x' * (2 << 20)}),
+                               ('/api/push/batch', {'messages': ['x' * (2 << 20)]})):
+                response = await client.post(path, json=body)
+                self.assertEqual(response.status, 413, path)
+                self.assertIn('application/octet-stream', (await response.json())['error'])
+
+    async def test_empty_raw_body_is_rejected(self):
+        request = push_request(**{'Content-Type': 'application/octet-stream', 'Content-Length': '0'})
+        response = await ws.api_push_handler(request)
+        self.assertEqual(response.status, 400)
+        self.assertEqual(json.loads(response.body), {'error': 'Message is required'})
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+class BlobStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ws.BlobStore(directory.name, max_bytes=100, ttl=3600)
+        self.store.open()
+
+    async def test_stores_by_content_and_keeps_the_content_type(self):
+        blob = await self.store.write(chunks(b'%PDF', b'-1.7'), 'application/pdf', 1000)
+        self.assertEqual(blob['size'], 8)
+        self.assertEqual(self.store.read(blob['hash']), b'%PDF-1.7')
+        self.assertEqual(self.store.content_type(blob['hash']), 'application/pdf')
+        again = await self.store.store(b'%PDF-1.7', 'application/x-pdf')
+        self.assertEqual(again['hash'], blob['hash'])
+        self.assertEqual(self.store.deduplicated, 1)
+        self.assertEqual(self.store.content_type(blob['hash']), 'application/x-pdf')
+
+    async def test_unknown_type_is_octet_stream(self):
+        self.assertEqual(self.store.content_type('0' * 64), 'application/octet-stream')
+
+    async def test_too_large_body_is_refused_without_leftovers(self):
+        with self.assertRaises(ValueError):
+            await self.store.write(chunks(b'x' * 600, b'x' * 600), 'text/plain', 1000)
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+    async def test_eviction_removes_the_type_too(self):
+        first = await self.store.store(b'a' * 60, 'text/plain')
+        await self.store.store(b'b' * 60, 'text/plain')
+        self.assertEqual(self.store.evicted, 1)
+        self.assertFalse(os.path.exists(self.store.path(first['hash'])))
+        self.assertFalse(os.path.exists(self.store.type_path(first['hash'])))
+
+    async def test_eviction_runs_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        removed_in = []
+        remove = self.store._remove
+        with mock.patch.object(self.store, '_remove', lambda digest: (removed_in.append(threading.get_ident()),
+                                                                       remove(digest))):
+            await self.store.store(b'a' * 60, 'text/plain')
+            await self.store.store(b'b' * 60, 'text/plain')
+        self.assertEqual(len(removed_in), 1)
+        self.assertNotEqual(removed_in[0], loop_thread)
+
+    async def test_storing_does_not_rescan_the_directory(self):
+        with mock.patch.object(self.store, '_scan', side_effect=AssertionError('scanned')):
+            for i in range(5):
+                await self.store.store(bytes([i]) * 30, 'text/plain')
+        self.assertLessEqual(self.store.bytes, 100)
+
+    async def test_sweep_bounds_a_directory_shared_by_workers(self):
+        other = ws.BlobStore(self.store.directory, max_bytes=100, ttl=3600)
+        other.open()
+        for i in range(6):
+            await (self.store, other)[i % 2].store(bytes([i]) * 30, 'text/plain')
+        await self.store.sweep()
+        sizes = [entry.stat().st_size for entry in os.scandir(self.store.directory)
+                 if not entry.name.startswith('.')]
+        self.assertLessEqual(sum(sizes), 100)
+        self.assertEqual(self.store.bytes, sum(sizes))
+
+
+class BlobHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_stored_blobs_with_their_type(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = ws.BlobStore(directory.name, max_bytes=1000, ttl=3600)
+        store.open()
+        blob = await store.store(b'%PDF-1.7', 'application/pdf')
+        app = web.Application()
+        app.router.add_get('/api/blobs/{digest}', ws.blob_handler)
+        with mock.patch.object(ws, 'blob_store', store):
+            async with TestClient(TestServer(app)) as client:
+                response = await client.get(f"/api/blobs/{blob['hash']}")
+                self.assertEqual((response.status, response.content_type), (200, 'application/pdf'))
+                self.assertEqual(await response.read(), b'%PDF-1.7')
+                for digest in ('b' * 64, 'not-a-digest'):
+                    self.assertEqual((await client.get(f'/api/blobs/{digest}')).status, 404)
+
+
+class BlobUrlTest(unittest.TestCase):
+    def setUp(self):
+        start_patches(self, mock.patch.object(ws, 'relative_blob_urls_reported', False))
+
+    def test_relative_url_is_reported_once_by_shard_zero(self):
+        with mock.patch.object(ws, 'PUBLIC_URL', ''), mock.patch.object(ws, 'cluster', ws.ShardCluster(2, 0)):
+            with self.assertLogs(ws.logger, 'WARNING') as logs:
+                self.assertEqual(ws.blob_url('a' * 64), f"/api/blobs/{'a' * 64}")
+                ws.blob_url('b' * 64)
+        self.assertEqual(len(logs.output), 1)
+
+    def test_other_shards_and_public_urls_stay_quiet(self):
+        with mock.patch.object(ws, 'PUBLIC_URL', ''), mock.patch.object(ws, 'cluster', ws.ShardCluster(2, 1)):
+            with self.assertNoLogs(ws.logger, 'WARNING'):
+                ws.blob_url('a' * 64)
+        with mock.patch.object(ws, 'relative_blob_urls_reported', False), \
+                mock.patch.object(ws, 'PUBLIC_URL', 'https://hooks.example.com'):
+            with self.assertNoLogs(ws.logger, 'WARNING'):
+                self.assertEqual(ws.blob_url('a' * 64), f"https://hooks.example.com/api/blobs/{'a' * 64}")
+
+
+class ClaimCheckTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ws.BlobStore(directory.name, max_bytes=10000, ttl=3600)
+        self.store.open()
+        start_patches(self, mock.patch.object(ws, 'blob_store', self.store))
+
+    def claim_check(self, blob: dict) -> ws.EncodedPayload:
+        payload = ws.EncodedPayload({'message': None, 'seq': 1, 'message_id': 'm', 'blob': dict(blob, url='/x')})
+        payload.blob = blob
+        return payload
+
+    async def test_text_is_inlined_as_a_string(self):
+        blob = await self.store.store('héllo'.encode(), 'text/plain; charset=utf-8')
+        inlined = await ws.inline_blob({'message': None, 'seq': 1, 'blob': blob})
+        self.assertEqual(inlined, {'message': 'héllo', 'seq': 1})
+
+    async def test_binary_and_invalid_text_are_inlined_as_base64(self):
+        for content, content_type in ((bytes(range(256)), 'image/png'), (b'\xff\xfe', 'text/plain')):
+            blob = await self.store.store(content, content_type)
+            inlined = await ws.inline_blob({'message': None, 'blob': blob})
+            self.assertEqual(inlined['message_encoding'], 'base64')
+            self.assertEqual(inlined['content_type'], content_type)
+            self.assertEqual(base64.b64decode(inlined['message']), content)
+
+    async def test_claim_check_subscribers_keep_the_reference(self):
+        payload = self.claim_check(await self.store.store(b'data', 'text/plain'))
+        self.assertIs(await payload.for_subscriber(SimpleNamespace(claim_check=True)), payload)
+        expanded = await payload.for_subscriber(SimpleNamespace(claim_check=False))
+        self.assertEqual(json.loads(expanded.body)['message'], 'data')
+        self.assertIs(await payload.for_subscriber(SimpleNamespace(claim_check=False)), expanded)
+
+    async def test_failed_read_is_retried_by_the_next_delivery(self):
+        blob = {'hash': 'a' * 64, 'size': 4, 'content_type': 'text/plain'}
+        payload = self.claim_check(blob)
+        subscriber = SimpleNamespace(claim_check=False)
+        with self.assertRaises(OSError):
+            await payload.for_subscriber(subscriber)
+        with open(self.store.path(blob['hash']), 'wb') as f:
+            f.write(b'back')
+        self.assertEqual(json.loads((await payload.for_subscriber(subscriber)).body)['message'], 'back')
+
+    async def test_replay_keeps_evicted_blobs_as_references(self):
+        blob = await self.store.store(b'kept', 'text/plain')
+        gone = {'hash': 'b' * 64, 'size': 4, 'content_type': 'text/plain'}
+        replayed = await ws.inline_blobs([{'message': 'plain', 'message_id': '1'},
+                                          {'message': None, 'message_id': '2', 'blob': blob},
+                                          {'message': None, 'message_id': '3', 'blob': gone}])
+        self.assertEqual([payload['message'] for payload in replayed], ['plain', 'kept', None])
+        self.assertEqual(replayed[2]['blob'], gone)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Unit tests for per-subscriber message coalescing and /api/push/batch. Run
+with `python -m unittest test_coalescing`.
+"""
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import Outcomes, start_patches
+
+URL = 'http://example.invalid/hook'
+HIGH, NORMAL, LOW = range(3)
+
+
+class CoalescingLaneTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bodies = []
+
+        async def deliver_one(webhook_url, payload, compression):
+            self.bodies.append(json.loads(payload.body))
+            return 'delivered'
+
+        self.dispatcher = SimpleNamespace(ready_lanes=ws.LaneScheduler(), deliver_one=deliver_one)
+        start_patches(self, mock.patch.object(ws, 'dispatcher', self.dispatcher), mock.patch.dict(ws.lanes, clear=True))
+        self.lane = ws.DeliveryLane(ws.Subscriber(URL, batch_max_messages=3, batch_max_delay_ms=50))
+        self.addCleanup(self.lane.close)
+        self.outcomes = Outcomes()
+
+    def submit(self, name: str, level: int = NORMAL):
+        payload = ws.EncodedPayload({'message': name})
+        payload.priority = level
+        self.lane.submit((payload, self.outcomes, name))
+
+    async def test_waits_for_the_window_below_the_batch_size(self):
+        self.submit('m0')
+        self.submit('m1')
+        self.assertFalse(self.lane.scheduled)
+        self.assertIsNotNone(self.lane.timer)
+        self.assertIs(await asyncio.wait_for(self.dispatcher.ready_lanes.get(), 1), self.lane)
+        self.assertIsNone(self.lane.timer)
+
+    async def test_full_batch_is_sent_without_waiting(self):
+        for i in range(3):
+            self.submit(f'm{i}')
+        self.assertTrue(self.lane.scheduled)
+        self.assertIsNone(self.lane.timer)
+
+    async def test_urgent_message_does_not_wait_for_the_window(self):
+        self.submit('urgent', HIGH)
+        self.assertTrue(self.lane.scheduled)
+
+    async def test_batch_is_one_request_and_the_rest_follows_at_once(self):
+        for i in range(4):
+            self.submit(f'm{i}')
+        await self.lane.serve()
+        self.assertEqual(len(self.bodies), 1)
+        self.assertEqual(self.bodies[0]['count'], 3)
+        self.assertEqual([message['message'] for message in self.bodies[0]['messages']], ['m0', 'm1', 'm2'])
+        self.assertEqual(self.outcomes.statuses, {'m0': 'delivered', 'm1': 'delivered', 'm2': 'delivered'})
+        # The leftover message is a backlog, so it doesn't open another window
+        self.assertTrue(self.lane.scheduled)
+        self.assertIsNone(self.lane.timer)
+
+
+class BatchMessagesTest(unittest.TestCase):
+    def test_top_level_options_apply_unless_an_item_sets_its_own(self):
+        specs = ws.parse_batch_messages({
+            'topic': 'orders', 'priority': 'low',
+            'messages': ['a', {'message': 'b', 'topic': 'refunds', 'attributes': {'region': 'eu'}}]
+        })
+        self.assertEqual(specs, [
+            {'message': 'a', 'topic': 'orders', 'priority': 'low'},
+            {'message': 'b', 'topic': 'refunds', 'priority': 'low', 'attributes': {'region': 'eu'}}
+        ])
+
+    def test_rejects_empty_oversized_and_invalid_batches(self):
+        for data in ({}, {'messages': []}, {'messages': 'a'}, {'messages': ['a', '']}, {'messages': [1]}):
+            with self.subTest(data), self.assertRaises(ValueError):
+                ws.parse_batch_messages(data)
+        with mock.patch.object(ws, 'PUSH_BATCH_MAX_MESSAGES', 2), self.assertRaises(ValueError):
+            ws.parse_batch_messages({'messages': ['a', 'b', 'c']})
+
+
+class BatchPushHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.published = []
+
+        async def publish(specs, mode, wait=False, deadline_ms=None, quorum=None):
+            self.published.append((specs, mode))
+            return 200, {
+                'results': [{'message_id': f'm{i}', 'timestamp': 'now', 'topic': spec.get('topic'),
+                             'matched_webhooks': 1, 'webhooks_notified': None} for i, spec in enumerate(specs)],
+                'total_webhooks': 1
+            }
+
+        start_patches(self, mock.patch.object(ws, 'publish', publish))
+        app = web.Application()
+        app.router.add_post('/api/push/batch', ws.api_push_batch_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_accepts_every_message_in_one_publish(self):
+        response = await self.client.post('/api/push/batch', json={'messages': ['a', 'b', 'c'], 'mode': 'async'})
+        self.assertEqual(response.status, 202)
+        body = await response.json()
+        self.assertEqual((body['count'], body['message_ids']), (3, ['m0', 'm1', 'm2']))
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual([spec['message'] for spec in self.published[0][0]], ['a', 'b', 'c'])
+
+    async def test_invalid_batch_is_refused_before_publishing(self):
+        response = await self.client.post('/api/push/batch', json={'messages': ['a', {'topic': 'x'}]})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(self.published, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the live dashboard: the change log, the SSE feed's resume and
+reload behaviour, and the cached page. Run with `python -m unittest test_dashboard`.
+"""
+import asyncio
+import gzip
+import json
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import make_mocked_request
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+def events(viewer) -> list:
+    """Drain a viewer queue into (event, data) pairs."""
+    found = []
+    while not viewer.empty():
+        event, data = viewer.get_nowait().decode().strip().split('\n')
+        found.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return found
+
+
+class ChangeLogTest(unittest.TestCase):
+    def test_changes_after_a_cursor(self):
+        log = ws.ChangeLog(10)
+        log.record('registered', 'http://a/hook')
+        log.record('registered', 'http://b/hook')
+        log.record('unregistered', 'http://a/hook')
+        self.assertEqual(log.since(1), ([['registered', 'http://b/hook'], ['unregistered', 'http://a/hook']], True))
+        self.assertEqual(log.since(0)[1], True)
+        self.assertEqual(log.since(3), ([], True))
+
+    def test_cursor_older_than_the_window_is_incomplete(self):
+        log = ws.ChangeLog(2)
+        for name in 'abcd':
+            log.record('registered', f'http://{name}/hook')
+        changes, complete = log.since(1)
+        self.assertFalse(complete)
+        self.assertEqual(changes, [['registered', 'http://c/hook'], ['registered', 'http://d/hook']])
+        self.assertTrue(log.since(2)[1])
+
+
+class DashboardFeedTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.changes = ws.ChangeLog(3)
+        start_patches(self, mock.patch.object(ws, 'registry_changes', self.changes),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)))
+        self.feed = ws.DashboardFeed()
+        self.viewer = asyncio.Queue(ws.DASHBOARD_VIEWER_QUEUE)
+        self.feed.viewers.add(self.viewer)
+
+    async def test_fresh_feed_starts_from_now_then_sends_each_change_once(self):
+        self.changes.record('registered', 'http://old/hook')
+        await self.feed.tick()
+        self.assertEqual([event for event, _ in events(self.viewer)], ['stats'])
+        self.changes.record('registered', 'http://a/hook')
+        self.changes.record('circuit_open', 'http://a/hook')
+        await self.feed.tick()
+        await self.feed.tick()
+        sent = [data for event, data in events(self.viewer) if event == 'changes']
+        self.assertEqual(sent, [{'changes': [['registered', 'http://a/hook'], ['circuit_open', 'http://a/hook']]}])
+
+    async def test_missed_changes_ask_for_a_reload(self):
+        await self.feed.tick()
+        for name in 'abcde':
+            self.changes.record('registered', f'http://{name}/hook')
+        events(self.viewer)
+        await self.feed.tick()
+        self.assertIn(('changes', {'reload': True}), events(self.viewer))
+
+    async def test_stats_carry_rates_from_the_second_tick(self):
+        await self.feed.tick()
+        self.assertNotIn('pushes_per_second', events(self.viewer)[-1][1])
+        await self.feed.tick()
+        stats = events(self.viewer)[-1][1]
+        self.assertEqual(stats['pushes_per_second'], 0)
+        self.assertIn('total_webhooks', stats)
+
+    async def test_viewer_that_falls_behind_is_told_to_reload(self):
+        slow = asyncio.Queue(2)
+        self.feed.viewers.add(slow)
+        for _ in range(3):
+            self.feed.broadcast('stats', {})
+        self.assertEqual(events(slow), [('changes', {'reload': True})])
+
+
+class DashboardPageTest(unittest.IsolatedAsyncioTestCase):
+    async def test_page_is_gzipped_for_clients_that_accept_it(self):
+        response = await ws.index_handler(make_mocked_request('GET', '/', headers={'Accept-Encoding': 'gzip, br'}))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.body), ws.DASHBOARD_BODY)
+        plain = await ws.index_handler(make_mocked_request('GET', '/'))
+        self.assertEqual(plain.body, ws.DASHBOARD_BODY)
+        self.assertEqual(plain.headers['ETag'], response.headers['ETag'])
+
+    async def test_matching_etag_is_not_modified(self):
+        request = make_mocked_request('GET', '/', headers={'If-None-Match': ws.DASHBOARD_ETAG})
+        response = await ws.index_handler(request)
+        self.assertEqual(response.status, 304)
+        self.assertIsNone(response.body)
+        stale = await ws.index_handler(make_mocked_request('GET', '/', headers={'If-None-Match': '"other"'}))
+        self.assertEqual(stale.status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Unit tests for sync pushes with a deadline or quorum: returning early, and
+following up on the rest through /api/messages/{id}. Run with
+`python -m unittest test_deadlines`.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+FAST = [f'http://fast-{i}.example.invalid/hook' for i in range(3)]
+SLOW = 'http://slow.example.invalid/hook'
+
+
+class DeadlinePushTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.release = asyncio.Event()  # Lets the slow subscriber answer
+
+        async def dispatch(subscribers, payload, on_result=None):
+            fanout = ws.Fanout([subscriber.url for subscriber in subscribers], on_result)
+            for index, subscriber in enumerate(subscribers):
+                asyncio.create_task(self.answer(fanout, index, subscriber.url))
+            return fanout
+
+        start_patches(self, *(mock.patch.dict(registry, clear=True)
+                              for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks)),
+                      mock.patch.object(ws, 'outbox', None),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)),
+                      mock.patch.object(ws.dispatcher, 'dispatch', dispatch))
+        for url in FAST + [SLOW]:
+            subscriber = ws.Subscriber(url)
+            ws.registered_webhooks[url] = subscriber
+            ws.index_subscriber(subscriber)
+        app = web.Application()
+        app.router.add_post('/api/push', ws.api_push_handler)
+        app.router.add_get('/api/messages/{message_id}', ws.message_status_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def answer(self, fanout: ws.Fanout, index: int, url: str):
+        if url == SLOW:
+            await self.release.wait()
+        fanout.complete(index, 'delivered')
+
+    async def push(self, **wait) -> dict:
+        response = await asyncio.wait_for(self.client.post('/api/push', json=dict(message='hello', mode='sync', **wait)), 5)
+        self.assertEqual(response.status, 200)
+        return await response.json()
+
+    async def status(self, message_id: str) -> dict:
+        return await (await self.client.get(f'/api/messages/{message_id}')).json()
+
+    async def test_quorum_returns_once_enough_subscribers_confirmed(self):
+        body = await self.push(quorum=0.75)
+        self.assertEqual(sorted(body['confirmed_webhooks']), FAST)
+        self.assertEqual((body['webhooks_notified'], body['matched_webhooks'], body['complete']), (3, 4, False))
+        self.assertEqual(body['status_url'], f"/api/messages/{body['message_id']}")
+
+    async def test_deadline_returns_incomplete_and_the_rest_is_delivered_after(self):
+        body = await self.push(deadline_ms=50)
+        self.assertFalse(body['complete'])
+        self.assertEqual(sorted(body['confirmed_webhooks']), FAST)
+        status = await self.status(body['message_id'])
+        self.assertEqual((status['state'], status['deliveries'][SLOW]), ('in_progress', 'pending'))
+
+        self.release.set()
+        await asyncio.wait_for(ws.message_records[body['message_id']].wait(), 5)
+        status = await self.status(body['message_id'])
+        self.assertEqual(status['state'], 'completed')
+        self.assertEqual(set(status['deliveries'].values()), {'delivered'})
+
+    async def test_push_that_finishes_before_the_deadline_is_complete(self):
+        self.release.set()
+        body = await self.push(deadline_ms=5000, quorum=1)
+        self.assertTrue(body['complete'])
+        self.assertEqual(sorted(body['confirmed_webhooks']), sorted(FAST + [SLOW]))
+
+    async def test_deadline_and_quorum_are_refused_for_async_pushes(self):
+        response = await self.client.post('/api/push', json={'message': 'hello', 'mode': 'async', 'quorum': 0.5})
+        self.assertEqual(response.status, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
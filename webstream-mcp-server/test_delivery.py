@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Unit tests for delivery retries and circuit breakers. Run with
+`python -m unittest test_delivery`.
+"""
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+URL = 'http://example.invalid/hook'
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_repeated_failures(self):
+        breaker = ws.CircuitBreaker()
+        for _ in range(ws.BREAKER_FAILURE_THRESHOLD):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        self.assertAlmostEqual(breaker.retry_in_seconds(), ws.BREAKER_COOLDOWN, delta=1)
+
+    def test_retry_in_is_zero_unless_open(self):
+        breaker = ws.CircuitBreaker()
+        self.assertEqual(breaker.retry_in_seconds(), 0.0)
+        self.assertIsNone(breaker.to_dict()['retry_in_seconds'])
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = ws.CircuitBreaker()
+        breaker._open()
+        breaker.opened_at -= breaker.cooldown
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+class DeliveryOutcomeTest(unittest.TestCase):
+    def setUp(self):
+        start_patches(self, mock.patch.dict(ws.registered_webhooks, clear=True),
+                      mock.patch.dict(ws.circuit_breakers, clear=True),
+                      mock.patch.object(ws, 'registry_changes', ws.ChangeLog(10)))
+
+    def test_outcomes_feed_the_subscriber_and_its_breaker(self):
+        ws.registered_webhooks[URL] = ws.Subscriber(URL)
+        for _ in range(ws.BREAKER_FAILURE_THRESHOLD):
+            ws.record_delivery_outcome(URL, False)
+        self.assertEqual(ws.circuit_breakers[URL].state, 'open')
+        self.assertEqual(ws.registered_webhooks[URL].failed, ws.BREAKER_FAILURE_THRESHOLD)
+        self.assertEqual(ws.registry_changes.since(0)[0], [['circuit_open', URL]])
+
+    def test_late_outcome_after_removal_leaves_no_breaker_behind(self):
+        for ok in (True, False):
+            ws.record_delivery_outcome(URL, ok)
+        self.assertEqual(ws.circuit_breakers, {})
+        self.assertEqual(ws.registry_changes.seq, 0)
+
+
+class RetryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        start_patches(
+            self,
+            mock.patch.object(ws, 'outbox', None),
+            mock.patch.object(ws, 'WEBHOOK_RETRY_BASE_DELAY', 0.01),
+            mock.patch.object(ws, 'WEBHOOK_MAX_RETRIES', 3),
+            mock.patch.dict(ws.registered_webhooks, {URL: ws.Subscriber(URL)}),
+            mock.patch.dict(ws.circuit_breakers, clear=True)
+        )
+        self.record = ws.MessageRecord('hello')
+        self.record.set_delivery(URL, 'pending')
+        self.record.start_fanout()
+
+    def deliver(self, *statuses):
+        """Patch delivery to answer with ``statuses`` in turn, returning the mock."""
+        return mock.patch.object(ws, 'deliver_to_subscriber', mock.AsyncMock(side_effect=statuses))
+
+    async def settle(self):
+        await asyncio.wait_for(self.record.wait(), 5)
+
+    async def test_failed_delivery_is_retried_until_delivered(self):
+        with self.deliver('failed', 'delivered') as deliver:
+            self.assertTrue(ws.schedule_retry(URL, self.record.encoded(), self.record, 1))
+            self.assertEqual(self.record.deliveries[URL], 'retrying')
+            self.assertEqual(self.record.state, 'in_progress')
+            await self.settle()
+        self.assertEqual(deliver.await_count, 2)
+        self.assertEqual(self.record.deliveries[URL], 'delivered')
+        self.assertEqual(self.record.delivered, 1)
+
+    async def test_retry_skipped_by_an_open_breaker_is_rescheduled_after_the_cooldown(self):
+        breaker = ws.get_breaker(URL)
+        breaker._open()
+        breaker.cooldown = 0.2
+        with self.deliver('circuit_open', 'delivered') as deliver:
+            started = time.monotonic()
+            ws.schedule_retry(URL, self.record.encoded(), self.record, 1)
+            await asyncio.sleep(0.05)
+            self.assertEqual(deliver.await_count, 0)  # Still waiting out the cooldown
+            await self.settle()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(deliver.await_count, 2)
+        self.assertEqual(self.record.deliveries[URL], 'delivered')
+
+    async def test_open_breaker_is_final_after_the_last_retry(self):
+        with self.deliver(*['circuit_open'] * ws.WEBHOOK_MAX_RETRIES) as deliver:
+            ws.schedule_retry(URL, self.record.encoded(), self.record, 1)
+            await self.settle()
+        self.assertEqual(deliver.await_count, ws.WEBHOOK_MAX_RETRIES)
+        self.assertEqual(self.record.deliveries[URL], 'circuit_open')
+        self.assertEqual(self.record.state, 'completed')
+
+    async def test_unregistered_webhook_is_not_retried(self):
+        with self.deliver() as deliver:
+            ws.schedule_retry(URL, self.record.encoded(), self.record, 1)
+            del ws.registered_webhooks[URL]
+            await self.settle()
+        deliver.assert_not_awaited()
+        self.assertEqual(self.record.deliveries[URL], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the fan-out dispatcher: the concurrency cap, the pooled
+connector's limits and delivery through per-subscriber lanes. Run with
+`python -m unittest test_dispatcher`.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+URLS = [f'http://receiver-{i}.example.invalid/hook' for i in range(20)]
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dispatcher = ws.WebhookDispatcher(max_concurrency=3, max_connections=10, max_connections_per_host=2,
+                                               keepalive_timeout=5)
+        self.in_flight = 0
+        self.peak = 0
+        self.sent = []
+
+        async def send_webhook(session, webhook_url, body, content_encoding=None, trace=None):
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            self.sent.append((webhook_url, body))
+            return True
+
+        start_patches(self, mock.patch.object(ws, 'dispatcher', self.dispatcher),
+                      mock.patch.object(ws, 'send_webhook', send_webhook),
+                      mock.patch.object(ws, 'PRIORITY_RESERVED_WORKERS', 0),
+                      mock.patch.dict(ws.lanes, clear=True),
+                      mock.patch.dict(ws.circuit_breakers, clear=True),
+                      mock.patch.dict(ws.registered_webhooks, {url: ws.Subscriber(url) for url in URLS}, clear=True))
+        self.addAsyncCleanup(self.dispatcher.close)
+
+    def payload(self, message: str) -> ws.EncodedPayload:
+        payload = ws.EncodedPayload({'message': message})
+        payload.priority = ws.PRIORITIES.index(ws.DEFAULT_PRIORITY)
+        return payload
+
+    async def test_deliveries_never_exceed_the_concurrency_cap(self):
+        fanout = await self.dispatcher.dispatch(list(ws.registered_webhooks.values()), self.payload('hello'))
+        results = await asyncio.wait_for(fanout.done, 5)
+        self.assertEqual(results, ['delivered'] * len(URLS))
+        self.assertEqual(self.peak, 3)
+        self.assertEqual(len(self.dispatcher.workers), 3)
+        stats = self.dispatcher.stats()
+        self.assertEqual((stats['deliveries_total'], stats['in_flight'], stats['pushes_total']), (len(URLS), 0, 1))
+
+    async def test_deliveries_reuse_one_pooled_session(self):
+        session = await self.dispatcher.get_session()
+        fanout = await self.dispatcher.dispatch(list(ws.registered_webhooks.values()), self.payload('hello'))
+        await asyncio.wait_for(fanout.done, 5)
+        self.assertIs(await self.dispatcher.get_session(), session)
+        self.assertEqual((session.connector.limit, session.connector.limit_per_host), (10, 2))
+
+    async def test_each_subscriber_receives_pushes_in_order(self):
+        subscribers = list(ws.registered_webhooks.values())[:2]
+        payloads = [self.payload(f'm{i}') for i in range(5)]
+        fanouts = [await self.dispatcher.dispatch(subscribers, payload) for payload in payloads]
+        await asyncio.wait_for(asyncio.gather(*(fanout.done for fanout in fanouts)), 5)
+        for subscriber in subscribers:
+            self.assertEqual([body for url, body in self.sent if url == subscriber.url],
+                             [payload.body for payload in payloads])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Unit tests for payload encoding: one serialization per push, one compression
+per codec and the per-subscriber compression option. Run with
+`python -m unittest test_encoding`.
+"""
+import gzip
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+
+LARGE = {'message': 'x' * 4096, 'seq': 1}
+
+
+class EncodedPayloadTest(unittest.TestCase):
+    def test_body_is_serialized_once(self):
+        payload = ws.EncodedPayload(LARGE)
+        with mock.patch.object(ws, 'encode_json', wraps=ws.encode_json) as encode:
+            bodies = [payload.body for _ in range(3)]
+        self.assertEqual(encode.call_count, 1)
+        self.assertTrue(all(body is bodies[0] for body in bodies))
+
+    def test_each_codec_compresses_once_and_is_shared(self):
+        payload = ws.EncodedPayload(LARGE)
+        compress = mock.Mock(wraps=ws.COMPRESSORS['gzip'])
+        with mock.patch.dict(ws.COMPRESSORS, gzip=compress):
+            first, encoding = payload.for_encoding('gzip')
+            again, _ = payload.for_encoding('gzip')
+        self.assertEqual(compress.call_count, 1)
+        self.assertIs(again, first)
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(first), payload.body)
+
+    def test_small_bodies_and_identity_are_sent_as_is(self):
+        small = ws.EncodedPayload({'message': 'hi'})
+        self.assertEqual(small.for_encoding('gzip'), (small.body, None))
+        large = ws.EncodedPayload(LARGE)
+        self.assertEqual(large.for_encoding(None), (large.body, None))
+
+    @unittest.skipIf(ws.zstandard is None, "zstandard is not installed")
+    def test_zstd_round_trips(self):
+        payload = ws.EncodedPayload(LARGE)
+        body, encoding = payload.for_encoding('zstd')
+        self.assertEqual(encoding, 'zstd')
+        self.assertEqual(ws.zstandard.ZstdDecompressor().decompress(body), payload.body)
+
+
+class CompressionOptionTest(unittest.TestCase):
+    def test_known_codecs_are_accepted_and_identity_means_none(self):
+        self.assertEqual(ws.parse_subscriber_options({'compression': 'gzip'}), {'compression': 'gzip'})
+        self.assertNotIn('compression', ws.parse_subscriber_options({'compression': 'identity'}))
+
+    def test_unknown_codec_and_missing_zstandard_are_refused(self):
+        with self.assertRaises(ValueError):
+            ws.parse_subscriber_options({'compression': 'br'})
+        with mock.patch.object(ws, 'zstandard', None), self.assertRaises(ValueError):
+            ws.parse_subscriber_options({'compression': 'zstd'})
+
+
+class CompressedDeliveryTest(unittest.IsolatedAsyncioTestCase):
+    async def test_subscribers_get_their_codec_from_one_shared_payload(self):
+        dispatcher = ws.WebhookDispatcher(max_concurrency=2, max_connections=10, max_connections_per_host=2,
+                                          keepalive_timeout=5)
+        self.addAsyncCleanup(dispatcher.close)
+        sent = {}
+
+        async def send_webhook(session, webhook_url, body, content_encoding=None, trace=None):
+            sent[webhook_url] = (body, content_encoding)
+            return True
+
+        payload = ws.EncodedPayload(LARGE)
+        with mock.patch.object(ws, 'send_webhook', send_webhook), mock.patch.dict(ws.circuit_breakers, clear=True):
+            for url, codec in (('http://a/hook', 'gzip'), ('http://b/hook', 'gzip'), ('http://c/hook', None)):
+                self.assertEqual(await dispatcher.deliver_one(url, payload, codec), 'delivered')
+        self.assertEqual(sent['http://a/hook'][1], 'gzip')
+        self.assertIs(sent['http://a/hook'][0], sent['http://b/hook'][0])
+        self.assertEqual(sent['http://c/hook'], (payload.body, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
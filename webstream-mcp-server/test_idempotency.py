@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Unit tests for Idempotency-Key deduplication: replaying a remembered push,
+refusing a reused key, expiry and the LRU bound. Run with
+`python -m unittest test_idempotency`.
+"""
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class Producer:
+    """Stands in for a push, counting how often it actually runs."""
+
+    def __init__(self, status: int = 200):
+        self.status = status
+        self.calls = 0
+
+    async def __call__(self) -> tuple:
+        self.calls += 1
+        return self.status, {'results': [{'message_id': f'm{self.calls}'}]}
+
+
+class IdempotencyCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = ws.IdempotencyCache(max_keys=3, max_bytes=1 << 20, ttl=60)
+        self.produce = Producer()
+
+    async def test_repeated_key_replays_the_first_result(self):
+        first = await self.cache.run('k', 'body', self.produce)
+        again = await self.cache.run('k', 'body', self.produce)
+        self.assertEqual(first, (200, {'results': [{'message_id': 'm1'}]}, False))
+        self.assertEqual(again, (200, {'results': [{'message_id': 'm1'}]}, True))
+        self.assertEqual(self.produce.calls, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    async def test_reused_key_with_a_different_request_is_refused(self):
+        await self.cache.run('k', 'body', self.produce)
+        status, body, replayed = await self.cache.run('k', 'other body', self.produce)
+        self.assertEqual((status, replayed), (422, False))
+        self.assertIn('different request', body['error'])
+        self.assertEqual((self.produce.calls, self.cache.conflicts), (1, 1))
+
+    async def test_expired_key_runs_again(self):
+        now = time.monotonic()
+        with mock.patch.object(ws.time, 'monotonic', return_value=now):
+            await self.cache.run('k', 'body', self.produce)
+        with mock.patch.object(ws.time, 'monotonic', return_value=now + 61):
+            status, body, replayed = await self.cache.run('k', 'other body', self.produce)
+        self.assertEqual((status, replayed), (200, False))
+        self.assertEqual(self.produce.calls, 2)
+
+    async def test_least_recently_used_key_is_evicted(self):
+        for key in ('a', 'b', 'c'):
+            await self.cache.run(key, key, self.produce)
+        await self.cache.run('a', 'a', self.produce)  # Now the most recently used
+        await self.cache.run('d', 'd', self.produce)
+        self.assertEqual(list(self.cache.entries), ['c', 'a', 'd'])
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertFalse((await self.cache.run('b', 'b', self.produce))[2])
+
+    async def test_results_are_bounded_by_size(self):
+        cache = ws.IdempotencyCache(max_keys=100, max_bytes=100, ttl=60)
+        for key in 'abcdef':
+            await cache.run(key, key, self.produce)
+            self.assertLessEqual(cache.bytes, 100)
+        self.assertLess(len(cache.entries), 6)
+        self.assertIn('f', cache.entries)
+
+    async def test_failed_push_is_not_remembered(self):
+        failing = Producer(503)
+        self.assertEqual((await self.cache.run('k', 'body', failing))[0], 503)
+        status, _, replayed = await self.cache.run('k', 'body', self.produce)
+        self.assertEqual((status, replayed), (200, False))
+        self.assertEqual((failing.calls, self.produce.calls), (1, 1))
+
+    async def test_retry_during_the_first_push_waits_for_it(self):
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return await self.produce()
+
+        first = asyncio.create_task(self.cache.run('k', 'body', slow))
+        await asyncio.sleep(0)
+        retry = asyncio.create_task(self.cache.run('k', 'body', slow))
+        await asyncio.sleep(0)
+        self.assertFalse(retry.done())
+        release.set()
+        self.assertEqual((await first)[2], False)
+        self.assertEqual((await retry)[2], True)
+        self.assertEqual(self.produce.calls, 1)
+
+
+class IdempotentPushTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.published = []
+
+        async def publish(specs, mode, wait=False, deadline_ms=None, quorum=None):
+            self.published.append(specs)
+            return 200, {
+                'results': [{'message_id': f'm{len(self.published)}', 'timestamp': 'now', 'topic': None,
+                             'matched_webhooks': 0, 'webhooks_notified': 0}],
+                'total_webhooks': 0
+            }
+
+        start_patches(self, mock.patch.object(ws, 'publish', publish),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)),
+                      mock.patch.object(ws, 'idempotency_cache', ws.IdempotencyCache(10, 1 << 20, 60)))
+        app = web.Application()
+        app.router.add_post('/api/push', ws.api_push_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def push(self, message: str, key: str = 'order-1'):
+        return await self.client.post('/api/push', json={'message': message, 'mode': 'sync'},
+                                      headers={'Idempotency-Key': key})
+
+    async def test_retry_is_replayed_with_the_header(self):
+        first = await self.push('hello')
+        retry = await self.push('hello')
+        self.assertEqual((first.status, retry.status), (200, 200))
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual((await retry.json())['message_id'], (await first.json())['message_id'])
+        self.assertEqual(len(self.published), 1)
+
+    async def test_reused_key_with_another_message_is_unprocessable(self):
+        await self.push('hello')
+        response = await self.push('goodbye')
+        self.assertEqual(response.status, 422)
+        self.assertEqual(len(self.published), 1)
+
+    async def test_other_key_delivers_again(self):
+        await self.push('hello')
+        await self.push('hello', key='order-2')
+        self.assertEqual(len(self.published), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Unit tests for streaming ingest: batching, flow control and per-line error
+reporting of IngestStream and /api/stream. Run with `python -m unittest test_ingest`.
+"""
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class IngestTestCase(unittest.IsolatedAsyncioTestCase):
+    status = 200
+
+    async def asyncSetUp(self):
+        self.batches = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+        async def publish(specs, mode, wait=False, deadline_ms=None, quorum=None):
+            await self.release.wait()
+            self.batches.append([spec['message'] for spec in specs])
+            if self.status != 200:
+                return self.status, {'error': 'Push queue is full, retry later'}
+            return 200, {'results': [{'message_id': spec['message']} for spec in specs], 'total_webhooks': 1}
+
+        start_patches(self, mock.patch.object(ws, 'publish', publish))
+
+
+class IngestStreamTest(IngestTestCase):
+    async def test_bad_lines_are_reported_by_line_and_the_rest_published(self):
+        events = []
+
+        async def on_event(event):
+            events.append(event)
+
+        stream = ws.IngestStream('async', {'topic': 'orders'}, on_event)
+        for line in (b'"a"', b'', b'{"message": "b", "priority": "high"}', b'not json', b'{"topic": "x"}', b'"c"'):
+            self.assertTrue(await stream.feed(line))
+        summary = await stream.close()
+        self.assertEqual((summary['status'], summary['received'], summary['accepted'], summary['rejected']),
+                         ('success', 5, 3, 2))
+        self.assertEqual([error['line'] for error in summary['errors']], [3, 4])
+        self.assertEqual([event['line'] for event in events if event['type'] == 'error'], [3, 4])
+        self.assertEqual(sum(self.batches, []), ['a', 'b', 'c'])
+        acks = [event for event in events if event['type'] == 'ack']
+        self.assertEqual(acks[-1]['accepted'], 3)
+
+    async def test_messages_are_published_in_order_in_batches(self):
+        with mock.patch.object(ws, 'STREAM_BATCH_SIZE', 2):
+            stream = ws.IngestStream('async', {})
+            self.release.clear()  # Let the buffer fill up first
+            for i in range(5):
+                await stream.feed(f'"m{i}"')
+            self.release.set()
+            await stream.close()
+        self.assertEqual(sum(self.batches, []), [f'm{i}' for i in range(5)])
+        self.assertLessEqual(max(len(batch) for batch in self.batches), 2)
+
+    async def test_full_buffer_pauses_reading(self):
+        with mock.patch.object(ws, 'STREAM_BUFFER_SIZE', 2), mock.patch.object(ws, 'STREAM_BATCH_SIZE', 1):
+            self.release.clear()
+            stream = ws.IngestStream('async', {})
+            for i in range(3):  # One taken by the stalled publisher, two buffered
+                await asyncio.wait_for(stream.feed(f'"m{i}"'), 1)
+                await asyncio.sleep(0)
+            blocked = asyncio.create_task(stream.feed('"m3"'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked.done())
+            self.release.set()
+            self.assertTrue(await asyncio.wait_for(blocked, 1))
+            summary = await stream.close()
+        self.assertEqual(summary['accepted'], 4)
+
+    async def test_many_errors_are_counted_but_only_the_first_reported(self):
+        stream = ws.IngestStream('async', {})
+        for _ in range(ws.STREAM_MAX_ERRORS + 5):
+            await stream.feed('{}')
+        summary = await stream.close()
+        self.assertEqual(summary['rejected'], ws.STREAM_MAX_ERRORS + 5)
+        self.assertEqual(len(summary['errors']), ws.STREAM_MAX_ERRORS)
+
+
+class FailingIngestStreamTest(IngestTestCase):
+    status = 503
+
+    async def test_failed_publish_stops_the_stream(self):
+        stream = ws.IngestStream('async', {})
+        await stream.feed('"a"')
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertFalse(await stream.feed('"b"'))
+        summary = await stream.close()
+        self.assertEqual((summary['status'], summary['accepted']), ('error', 0))
+        self.assertIn('full', summary['error'])
+
+
+class StreamHandlerTest(IngestTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        app = web.Application()
+        app.router.add_post('/api/stream', ws.api_stream_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_ndjson_body_is_ingested_line_by_line(self):
+        async def body():
+            yield b'"a"\n{"message": "b"}\n"'
+            yield b'c"\n[1]\n"d"'  # A line split across chunks, and a last line without a newline
+
+        response = await self.client.post('/api/stream?mode=async', data=body())
+        summary = await response.json()
+        self.assertEqual(response.status, 200)
+        self.assertEqual((summary['accepted'], summary['rejected']), (4, 1))
+        self.assertEqual(summary['errors'][0]['line'], 4)
+        self.assertEqual(sum(self.batches, []), ['a', 'b', 'c', 'd'])
+
+    async def test_overlong_line_ends_the_stream(self):
+        with mock.patch.object(ws, 'STREAM_MAX_LINE_BYTES', 16):
+            response = await self.client.post('/api/stream?mode=async', data=b'"a"\n"' + b'x' * 64)
+        summary = await response.json()
+        self.assertEqual(response.status, 413)
+        self.assertEqual(summary['accepted'], 1)
+        self.assertIn('Line 2', summary['error'])
+
+    async def test_disconnect_still_publishes_what_was_read(self):
+        async def iter_any():
+            yield b'"a"\n"b"\n'
+            raise asyncio.CancelledError  # The producer went away mid-stream
+
+        request = SimpleNamespace(query={}, content=SimpleNamespace(iter_any=iter_any))
+        with self.assertRaises(asyncio.CancelledError):
+            await ws.api_stream_handler(request)
+        self.assertEqual(sum(self.batches, []), ['a', 'b'])
+        self.assertFalse(ws.active_streams)
+
+    async def test_invalid_options_are_refused(self):
+        response = await self.client.post('/api/stream?priority=urgent', data=b'"a"\n')
+        self.assertEqual(response.status, 400)
+        self.assertEqual(self.batches, [])
+
+
+class WebSocketStreamTest(IngestTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        app = web.Application()
+        app.router.add_get('/api/stream', ws.api_stream_ws_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_only_newlines_separate_messages(self):
+        async with self.client.ws_connect('/api/stream?mode=async') as socket:
+            # Other line breaks are valid inside JSON strings and between tokens
+            await socket.send_str('"a\u2028b\x85c"\n{"message": "d",\r"topic": "t"}\n\n')
+            await socket.send_bytes(b'{"message":\r"e"}\n"f"')
+            await socket.close()
+        self.assertEqual(sum(self.batches, []), ['a\u2028b\x85c', 'd', 'e', 'f'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
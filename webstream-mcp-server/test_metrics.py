@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Prometheus exposition: counters, histograms, label
+escaping, the per-subscriber series cap and merging shards. Run with
+`python -m unittest test_metrics`.
+"""
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+
+
+class MetricTest(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = ws.HistogramMetric('latency_seconds', 'Latency', (0.1, 1.0), ('webhook_url',))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, ('http://a/hook',))
+        samples = dict(histogram.samples())
+        self.assertEqual(samples['latency_seconds_bucket{webhook_url="http://a/hook",le="0.1"}'], 1)
+        self.assertEqual(samples['latency_seconds_bucket{webhook_url="http://a/hook",le="1.0"}'], 3)
+        self.assertEqual(samples['latency_seconds_bucket{webhook_url="http://a/hook",le="+Inf"}'], 4)
+        self.assertEqual(samples['latency_seconds_count{webhook_url="http://a/hook"}'], 4)
+        self.assertAlmostEqual(samples['latency_seconds_sum{webhook_url="http://a/hook"}'], 6.05)
+
+    def test_label_values_are_escaped(self):
+        counter = ws.CounterMetric('responses_total', 'Responses', ('webhook_url', 'code'))
+        counter.inc(('http://a/"quoted"\\path\n', 200))
+        counter.inc(('http://a/"quoted"\\path\n', 200))
+        self.assertEqual(list(counter.samples()),
+                         [('responses_total{webhook_url="http://a/\\"quoted\\"\\\\path\\n",code="200"}', 2)])
+
+    def test_subscriber_series_are_capped(self):
+        with mock.patch.object(ws, 'subscriber_series', set()), mock.patch.object(ws, 'METRICS_MAX_SUBSCRIBER_SERIES', 2):
+            labels = [ws.subscriber_label(f'http://{name}/hook') for name in 'abca']
+        self.assertEqual(labels, ['http://a/hook', 'http://b/hook', 'other', 'http://a/hook'])
+
+
+class RenderMetricsTest(unittest.TestCase):
+    def test_single_shard_has_no_shard_label(self):
+        text = ws.render_metrics([[['pushes_total', 'Pushes', 'counter', [['pushes_total', 3]]]]])
+        self.assertEqual(text, '# HELP pushes_total Pushes\n# TYPE pushes_total counter\npushes_total 3\n')
+
+    def test_shards_are_labelled(self):
+        def families(value):
+            return [['responses_total', 'Responses', 'counter', [['responses_total{code="200"}', value]]]]
+
+        lines = ws.render_metrics([families(1), families(2)]).splitlines()
+        self.assertEqual(lines[2:], ['responses_total{shard="0",code="200"} 1', 'responses_total{shard="1",code="200"} 2'])
+
+
+class MetricsHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_every_family_is_exposed_as_text(self):
+        app = web.Application()
+        app.router.add_get('/metrics', ws.metrics_handler)
+        with mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)):
+            async with TestClient(TestServer(app)) as client:
+                response = await client.get('/metrics')
+                text = await response.text()
+        self.assertEqual(response.content_type, 'text/plain')
+        for metric in ws.METRICS:
+            self.assertIn(f'# TYPE {metric.name} {metric.type}\n', text)
+        self.assertIn('webhook_registered_subscribers ', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
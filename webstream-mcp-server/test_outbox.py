@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the SQLite outbox and resuming unfinished messages after a
+restart. Run with `python -m unittest test_outbox`.
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'outbox.sqlite3')
+
+    async def reopen(self, outbox: ws.Outbox = None) -> tuple:
+        """Close ``outbox`` like a shutdown would and open the file again."""
+        if outbox is not None:
+            await outbox.close()
+        outbox = ws.Outbox(self.path)
+        unfinished = outbox.open()
+        self.addAsyncCleanup(outbox.close)
+        return outbox, unfinished
+
+    def record(self, message: str, seq: int, **deliveries) -> ws.MessageRecord:
+        record = ws.MessageRecord(message, seq=seq, topic='orders', attributes={'region': 'eu'}, priority='high')
+        record.deliveries = {f'http://{name}/hook': state for name, state in deliveries.items()}
+        return record
+
+    async def test_resumes_messages_with_pending_deliveries(self):
+        outbox, unfinished = await self.reopen()
+        self.assertEqual(unfinished, [])
+        done = self.record('done', 1, a='pending')
+        partial = self.record('partial', 2, a='pending', b='pending')
+        await outbox.store([done, partial])
+        outbox.record_delivery(done.id, 'http://a/hook', 'delivered')
+        outbox.record_delivery(partial.id, 'http://a/hook', 'delivered')
+        outbox, unfinished = await self.reopen(outbox)
+        self.assertEqual([record.id for record in unfinished], [partial.id])
+        resumed = unfinished[0]
+        self.assertEqual(resumed.deliveries, {'http://a/hook': 'delivered', 'http://b/hook': 'pending'})
+        self.assertEqual((resumed.message, resumed.seq, resumed.topic, resumed.attributes, resumed.priority),
+                         ('partial', 2, 'orders', {'region': 'eu'}, 'high'))
+        self.assertEqual(outbox.last_seq(), 2)
+
+    async def test_resumes_in_sequence_order(self):
+        outbox, _ = await self.reopen()
+        records = [self.record(f'm{seq}', seq, a='pending') for seq in (3, 1, 2)]
+        await outbox.store(records)
+        _, unfinished = await self.reopen(outbox)
+        self.assertEqual([record.seq for record in unfinished], [1, 2, 3])
+
+    async def test_blob_message_resumes_with_its_reference(self):
+        outbox, _ = await self.reopen()
+        record = self.record(None, 1, a='pending')
+        record.blob = {'hash': 'a' * 64, 'size': 4, 'content_type': 'application/pdf'}
+        await outbox.store([record])
+        _, unfinished = await self.reopen(outbox)
+        self.assertIsNone(unfinished[0].message)
+        self.assertEqual(unfinished[0].blob, record.blob)
+
+    async def test_prune_keeps_unfinished_messages(self):
+        outbox, _ = await self.reopen()
+        done = self.record('done', 1, a='pending')
+        pending = self.record('pending', 2, a='pending')
+        await outbox.store([done, pending])
+        outbox.record_delivery(done.id, 'http://a/hook', 'failed')
+        await outbox.prune(time.time() + 1)
+        self.assertEqual([record.id for record in outbox.recent_messages(10)], [pending.id])
+
+    async def test_resumed_messages_are_queued_for_delivery(self):
+        outbox, _ = await self.reopen()
+        await outbox.store([self.record('m1', 1, a='pending'), self.record('m2', 2, a='pending')])
+        _, unfinished = await self.reopen(outbox)
+        queue = ws.PushQueue()
+        with mock.patch.object(ws, 'push_queue', queue), mock.patch.dict(ws.message_records, clear=True):
+            await ws.resume_outbox(unfinished)
+            self.assertEqual([queue.get_nowait().message for _ in range(queue.qsize())], ['m1', 'm2'])
+            self.assertEqual(set(ws.message_records), {record.id for record in unfinished})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Unit tests for async push acceptance: answering before delivery, background
+push workers and the per-subscriber state at /api/messages/{id}. Run with
+`python -m unittest test_push`.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+FAST = 'http://fast.example.invalid/hook'
+SLOW = 'http://slow.example.invalid/hook'
+
+
+class AsyncPushTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.release = asyncio.Event()  # Lets the slow subscriber answer
+
+        async def dispatch(subscribers, payload, on_result=None):
+            fanout = ws.Fanout([subscriber.url for subscriber in subscribers], on_result)
+            for index, subscriber in enumerate(subscribers):
+                asyncio.create_task(self.answer(fanout, index, subscriber.url))
+            return fanout
+
+        start_patches(self, *(mock.patch.dict(registry, clear=True)
+                              for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks)),
+                      mock.patch.object(ws, 'outbox', None),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)),
+                      mock.patch.object(ws.dispatcher, 'dispatch', dispatch),
+                      mock.patch.object(ws, 'push_queue', None),
+                      mock.patch.object(ws, 'push_worker_tasks', []),
+                      mock.patch.object(ws, 'PUSH_WORKERS', 2))
+        for url in (FAST, SLOW):
+            subscriber = ws.Subscriber(url)
+            ws.registered_webhooks[url] = subscriber
+            ws.index_subscriber(subscriber)
+        ws.start_push_workers()
+        self.addAsyncCleanup(self.stop_push_workers)
+        app = web.Application()
+        app.router.add_post('/api/push', ws.api_push_handler)
+        app.router.add_get('/api/messages/{message_id}', ws.message_status_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def stop_push_workers(self):
+        for task in ws.push_worker_tasks:
+            task.cancel()
+        await asyncio.gather(*ws.push_worker_tasks, return_exceptions=True)
+
+    async def answer(self, fanout: ws.Fanout, index: int, url: str):
+        if url == SLOW:
+            await self.release.wait()
+        fanout.complete(index, 'delivered')
+
+    async def status(self, message_id: str) -> dict:
+        return await (await self.client.get(f'/api/messages/{message_id}')).json()
+
+    async def test_push_is_accepted_before_the_slow_subscriber_answers(self):
+        response = await asyncio.wait_for(self.client.post('/api/push', json={'message': 'hello', 'mode': 'async'}), 5)
+        self.assertEqual(response.status, 202)
+        body = await response.json()
+        self.assertEqual((body['status'], body['matched_webhooks']), ('accepted', 2))
+        self.assertEqual(body['status_url'], f"/api/messages/{body['message_id']}")
+
+        record = ws.message_records[body['message_id']]
+        while record.deliveries[FAST] != 'delivered':
+            await asyncio.sleep(0.01)
+        status = await self.status(body['message_id'])
+        self.assertEqual(status['state'], 'in_progress')
+        self.assertEqual(status['deliveries'], {FAST: 'delivered', SLOW: 'pending'})
+
+        self.release.set()
+        await asyncio.wait_for(record.wait(), 5)
+        status = await self.status(body['message_id'])
+        self.assertEqual(status['state'], 'completed')
+        self.assertEqual((status['summary']['delivered'], status['summary']['pending']), (2, 0))
+
+    async def test_unknown_message_is_not_found(self):
+        response = await self.client.get('/api/messages/does-not-exist')
+        self.assertEqual(response.status, 404)
+
+    async def test_full_push_queue_is_refused(self):
+        with mock.patch.object(ws, 'PUSH_QUEUE_SIZE', 0):
+            response = await self.client.post('/api/push', json={'message': 'hello', 'mode': 'async'})
+        self.assertEqual(response.status, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the subscriber registry: log replay, compaction, recovery from
+a crash mid-write and cursor paging. Run with `python -m unittest test_registry`.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class SubscriberStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def reopen(self, store: ws.SubscriberStore = None) -> tuple:
+        """Close ``store`` like a shutdown would and load the directory again."""
+        if store is not None:
+            store.close()
+        store = ws.SubscriberStore(self.directory)
+        entries = store.load()
+        store.open()
+        self.addCleanup(store.close)
+        return store, entries
+
+    async def test_log_replays_registrations_and_removals(self):
+        store, entries = self.reopen()
+        self.assertEqual(entries, {})
+        store.append('add', 'http://a/hook')
+        store.append('add', 'http://b/hook', {'topics': ['orders']})
+        store.append('remove', 'http://a/hook')
+        store.append('add', 'http://c/hook')
+        store, entries = self.reopen(store)
+        self.assertEqual(entries, {'http://b/hook': {'topics': ['orders']}, 'http://c/hook': None})
+        self.assertEqual(store.log_entries, 4)
+
+    async def test_compaction_folds_the_log_into_a_snapshot(self):
+        store, _ = self.reopen()
+        for name in ('a', 'b', 'c'):
+            store.append('add', f'http://{name}/hook')
+        store.append('remove', 'http://b/hook')
+        subscribers = {
+            'http://a/hook': ws.Subscriber('http://a/hook'),
+            'http://c/hook': ws.Subscriber('http://c/hook', topics=('orders',))
+        }
+        await store.compact(subscribers)
+        self.assertEqual(store.log_entries, 0)
+        self.assertEqual(os.path.getsize(store.log_path), 0)
+        self.assertFalse(os.path.exists(store.rotated_log_path))
+        store.append('remove', 'http://a/hook')
+        store, entries = self.reopen(store)
+        self.assertEqual(entries, {'http://c/hook': {'topics': ['orders']}})
+        self.assertEqual(store.log_entries, 1)
+
+    async def test_compaction_does_its_file_work_off_the_event_loop(self):
+        store, _ = self.reopen()
+        store.append('add', 'http://a/hook')
+        subscribers = {'http://a/hook': ws.Subscriber('http://a/hook')}
+        threads = []
+        rotating = threading.Event()
+        rotate = store._rotate
+
+        def slow_rotate():
+            threads.append(threading.get_ident())
+            log = rotate()
+            rotating.wait(1)  # Hold the rotation open until the loop has appended
+            return log
+
+        with mock.patch.object(store, '_rotate', slow_rotate), \
+                mock.patch.object(store, '_write_snapshot', lambda data: (threads.append(threading.get_ident()),
+                                                                          ws.SubscriberStore._write_snapshot(store, data))):
+            compaction = asyncio.create_task(store.compact(subscribers))
+            while not os.path.exists(store.rotated_log_path):
+                await asyncio.sleep(0.001)
+            # A registration while the log is being rotated
+            subscribers['http://b/hook'] = ws.Subscriber('http://b/hook')
+            store.append('add', 'http://b/hook')
+            rotating.set()
+            await compaction
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+        store.append('add', 'http://c/hook')
+        _, entries = self.reopen(store)
+        self.assertEqual(set(entries), {'http://a/hook', 'http://b/hook', 'http://c/hook'})
+
+    async def test_interrupted_compaction_is_replayed(self):
+        store, _ = self.reopen()
+        store.append('add', 'http://a/hook')
+        store.close()
+        # Rotated aside but no snapshot written yet, then one more change
+        os.replace(store.log_path, store.rotated_log_path)
+        store, _ = self.reopen()
+        store.append('add', 'http://b/hook')
+        store, entries = self.reopen(store)
+        self.assertEqual(set(entries), {'http://a/hook', 'http://b/hook'})
+        await store.compact({url: ws.Subscriber(url) for url in entries})
+        _, entries = self.reopen(store)
+        self.assertEqual(set(entries), {'http://a/hook', 'http://b/hook'})
+
+    async def test_torn_last_line_is_skipped_and_later_entries_survive(self):
+        store, _ = self.reopen()
+        store.append('add', 'http://a/hook')
+        store.close()
+        with open(store.log_path, 'a', encoding='utf-8') as log:
+            log.write('["add", "http://torn')
+        with self.assertLogs(ws.logger, 'WARNING'):
+            store, entries = self.reopen()
+        self.assertEqual(entries, {'http://a/hook': None})
+        store.append('add', 'http://b/hook')
+        with self.assertLogs(ws.logger, 'WARNING'):
+            _, entries = self.reopen(store)
+        self.assertEqual(entries, {'http://a/hook': None, 'http://b/hook': None})
+
+
+class WebhookPageTest(unittest.TestCase):
+    def setUp(self):
+        start_patches(self, *(mock.patch.dict(registry, clear=True)
+                              for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks)),
+                      mock.patch.object(ws, 'webhook_order', None),
+                      mock.patch.object(ws, 'subscriber_store', None),
+                      mock.patch.object(ws, 'registry_changes', ws.ChangeLog(100)))
+        for i in range(0, 20, 2):
+            ws.add_subscriber(ws.Subscriber(f'http://hook-{i:02}.example'))
+
+    def walk(self, limit: int, between_pages=None) -> list:
+        seen, cursor = [], None
+        while True:
+            page, cursor = ws.webhook_page(cursor, limit)
+            seen += page
+            if cursor is None:
+                return seen
+            if between_pages:
+                between_pages(cursor)
+
+    def test_pages_cover_the_registry_in_order(self):
+        seen = self.walk(3)
+        self.assertEqual(seen, sorted(ws.registered_webhooks))
+        self.assertEqual(self.walk(100), seen)
+
+    def test_cursor_stays_valid_while_webhooks_come_and_go(self):
+        changed = []
+
+        def churn(cursor):
+            if changed:
+                return
+            changed.append(cursor)
+            ws.remove_subscriber('http://hook-00.example')  # Already returned
+            ws.remove_subscriber('http://hook-10.example')  # Not reached yet
+            ws.remove_subscriber(cursor)  # The cursor itself
+            ws.add_subscriber(ws.Subscriber('http://hook-01.example'))  # Sorts before the cursor
+            ws.add_subscriber(ws.Subscriber('http://hook-15.example'))  # Sorts after it
+
+        seen = self.walk(3, churn)
+        self.assertEqual(changed, ['http://hook-04.example'])
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(seen, ['http://hook-00.example', 'http://hook-02.example', 'http://hook-04.example',
+                                'http://hook-06.example', 'http://hook-08.example', 'http://hook-12.example',
+                                'http://hook-14.example', 'http://hook-15.example', 'http://hook-16.example',
+                                'http://hook-18.example'])
+
+
+if __name__ == '__main__':
+    unittest.main()
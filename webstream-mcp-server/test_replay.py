@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the replay buffer and catch-up: its count and byte caps,
+paging with ``since`` and catching up on registration. Run with
+`python -m unittest test_replay`.
+"""
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+def payload(seq: int, topic: str = None) -> dict:
+    return {'message': f'm{seq}', 'seq': seq, 'topic': topic}
+
+
+class ReplayBufferTest(unittest.TestCase):
+    def test_byte_cap_evicts_the_oldest_messages(self):
+        buffer = ws.ReplayBuffer(100, 250)
+        for seq in range(1, 6):
+            buffer.append(seq, payload(seq), 100)
+        self.assertEqual((buffer.oldest_seq, buffer.bytes), (4, 200))
+        self.assertEqual([entry['seq'] for entry in buffer.since(0, 10)], [4, 5])
+
+    def test_limit_bounds_a_page(self):
+        buffer = ws.ReplayBuffer(100, 1 << 20)
+        for seq in range(1, 6):
+            buffer.append(seq, payload(seq))
+        self.assertEqual([entry['seq'] for entry in buffer.since(1, 2)], [2, 3])
+
+
+class CatchUpTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        start_patches(self, mock.patch.object(ws, 'replay_buffer', ws.ReplayBuffer(3, 1 << 20)),
+                      mock.patch.object(ws, 'last_seq', 0),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)),
+                      mock.patch.object(ws, 'webhook_order', None),
+                      mock.patch.object(ws, 'subscriber_store', None),
+                      mock.patch.object(ws, 'registry_changes', ws.ChangeLog(10)),
+                      *(mock.patch.dict(registry, clear=True)
+                        for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks)))
+        for seq in range(1, 6):
+            ws.replay_buffer.append(ws.next_seq(), payload(seq, 'orders' if seq % 2 else 'alerts'))
+        app = web.Application()
+        app.router.add_get('/api/messages', ws.list_messages_handler)
+        app.router.add_post('/api/register', ws.register_webhook_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def get(self, query: str) -> tuple:
+        response = await self.client.get(f'/api/messages?{query}')
+        return response.status, await response.json()
+
+    async def test_pages_follow_next_since_until_the_latest_message(self):
+        status, page = await self.get('since=3&limit=1')
+        self.assertEqual((status, [entry['seq'] for entry in page['messages']]), (200, [4]))
+        self.assertEqual((page['next_since'], page['has_more'], page['truncated']), (4, True, False))
+        _, page = await self.get(f"since={page['next_since']}&limit=1")
+        self.assertEqual(([entry['seq'] for entry in page['messages']], page['has_more']), ([5], False))
+
+    async def test_cursor_older_than_the_buffer_is_reported_as_truncated(self):
+        _, page = await self.get('since=0')
+        self.assertEqual([entry['seq'] for entry in page['messages']], [3, 4, 5])
+        self.assertTrue(page['truncated'])
+        self.assertEqual((page['oldest_seq'], page['latest_seq']), (3, 5))
+
+    async def test_topic_filter_and_invalid_cursor(self):
+        _, page = await self.get('since=0&topic=orders')
+        self.assertEqual([entry['seq'] for entry in page['messages']], [3, 5])
+        status, _ = await self.get('since=-1')
+        self.assertEqual(status, 400)
+
+    async def test_registration_with_since_returns_what_the_subscriber_missed(self):
+        response = await self.client.post('/api/register', json={'webhook_url': 'http://a.example/hook',
+                                                                  'topics': ['alerts'], 'since': 3})
+        body = await response.json()
+        self.assertEqual(body['latest_seq'], 5)
+        self.assertEqual([entry['seq'] for entry in body['missed']['messages']], [4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Unit tests for topic and attribute routing. Run with `python -m unittest test_routing`.
+"""
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class RoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        start_patches(self, *(mock.patch.dict(registry, clear=True)
+                              for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks)))
+
+    def register(self, url: str, **options) -> ws.Subscriber:
+        subscriber = ws.Subscriber(url, **options)
+        ws.registered_webhooks[url] = subscriber
+        ws.index_subscriber(subscriber)
+        return subscriber
+
+
+class RouteMessageTest(RoutingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.register('all')
+        self.register('orders', topics=('orders',))
+        self.register('both', topics=('alerts', 'orders'))
+        self.register('eu', filters={'region': ('eu',)})
+
+    def test_topic_message_reaches_its_subscribers_and_catch_alls(self):
+        self.assertCountEqual(ws.route_message('orders'), ['all', 'orders', 'both'])
+        self.assertCountEqual(ws.route_message('alerts', {'region': 'eu'}), ['all', 'both', 'eu'])
+
+    def test_message_without_a_topic_skips_topic_subscribers(self):
+        self.assertEqual(ws.route_message(), ['all'])
+        self.assertCountEqual(ws.route_message(None, {'region': 'eu'}), ['all', 'eu'])
+
+    def test_unindexed_subscriber_is_no_longer_routed_to(self):
+        ws.unindex_subscriber(ws.registered_webhooks['both'])
+        self.assertNotIn('alerts', ws.topic_index)
+        self.assertCountEqual(ws.route_message('orders'), ['all', 'orders'])
+
+
+class MatchesTest(unittest.TestCase):
+    def test_topics_exclude_messages_without_a_topic(self):
+        subscriber = ws.Subscriber('orders', topics=('orders',))
+        self.assertTrue(subscriber.matches('orders', None))
+        self.assertFalse(subscriber.matches('alerts', None))
+        self.assertFalse(subscriber.matches(None, None))
+        self.assertTrue(ws.Subscriber('all').matches(None, None))
+
+    def test_every_filter_must_match(self):
+        subscriber = ws.Subscriber('eu', filters={'region': ('eu',), 'tier': ('gold', 'silver')})
+        self.assertTrue(subscriber.matches(None, {'region': 'eu', 'tier': 'gold'}))
+        self.assertFalse(subscriber.matches(None, {'region': 'eu'}))
+        self.assertFalse(subscriber.matches(None, None))
+
+
+class ReplayRoutingTest(RoutingTestCase):
+    def test_replay_follows_the_same_routes_as_delivery(self):
+        buffer = ws.ReplayBuffer(100, 1 << 20)
+        messages = [(None, None), ('orders', None), ('alerts', None), ('orders', {'region': 'us'})]
+        for seq, (topic, attributes) in enumerate(messages, 1):
+            payload = {'message': str(seq), 'seq': seq}
+            if topic is not None:
+                payload['topic'] = topic
+            if attributes is not None:
+                payload['attributes'] = attributes
+            buffer.append(seq, payload)
+        for subscriber in (self.register('all'), self.register('orders', topics=('orders',)),
+                           self.register('us', filters={'region': ('us',)})):
+            routed = [seq for seq, (topic, attributes) in enumerate(messages, 1)
+                      if subscriber.url in ws.route_message(topic, attributes)]
+            replayed = [payload['seq'] for payload in buffer.since(0, 100, subscriber)]
+            self.assertEqual(replayed, routed, subscriber.url)
+
+
+if __name__ == '__main__':
+    unittest.main()
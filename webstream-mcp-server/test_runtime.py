@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the runtime: the web server and the MCP server sharing one
+event loop, handing work to the web server's loop in the threaded runtime,
+choosing a run mode and timing startup. Run with
+`python -m unittest test_runtime`.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class FakeMCP:
+    """Stands in for FastMCP, noting what was running when it was started."""
+
+    def __init__(self, events: list):
+        self.events = events
+
+    async def run_stdio_async(self):
+        self.events.append(('mcp', asyncio.get_running_loop(), ws.web_server_ready.is_set()))
+
+
+class SingleLoopTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.events = []
+
+        async def setup_web_server(port, host):
+            self.events.append(('web', asyncio.get_running_loop()))
+            ws.web_server_ready.set()
+            return self.started
+
+        async def shutdown_web_server():
+            self.events.append(('shutdown',))
+            ws.web_server_ready.clear()
+
+        self.started = True
+        start_patches(self, mock.patch.object(ws, 'setup_web_server', setup_web_server),
+                      mock.patch.object(ws, 'shutdown_web_server', shutdown_web_server),
+                      mock.patch.object(ws, 'create_mcp_server', lambda: FakeMCP(self.events)),
+                      mock.patch.dict(ws.startup_ms, clear=True))
+        self.addCleanup(ws.web_server_ready.clear)
+
+    async def test_both_servers_share_the_loop_and_shut_down_together(self):
+        await ws.run_single_loop()
+        loop = asyncio.get_running_loop()
+        self.assertEqual(self.events, [('web', loop), ('mcp', loop, True), ('shutdown',)])
+        self.assertIn('mcp', ws.startup_ms)
+
+    async def test_mcp_server_does_not_start_without_the_web_server(self):
+        self.started = False
+        with self.assertRaises(RuntimeError):
+            await ws.run_single_loop()
+        self.assertNotIn('mcp', [event[0] for event in self.events])
+
+
+class RunOnWebLoopTest(unittest.IsolatedAsyncioTestCase):
+    async def running_loop(self):
+        return asyncio.get_running_loop()
+
+    async def test_runs_in_place_on_the_web_loop(self):
+        loop = asyncio.get_running_loop()
+        for web_loop in (None, loop):
+            with mock.patch.object(ws, 'web_loop', web_loop):
+                self.assertIs(await ws.run_on_web_loop(self.running_loop()), loop)
+
+    async def test_hands_off_to_the_web_loop_in_another_thread(self):
+        web_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=web_loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(web_loop.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(web_loop.call_soon_threadsafe, web_loop.stop)
+        with mock.patch.object(ws, 'web_loop', web_loop):
+            self.assertIs(await ws.run_on_web_loop(self.running_loop()), web_loop)
+
+
+class RunModeTest(unittest.TestCase):
+    def test_mode_comes_from_the_flag_or_the_environment(self):
+        self.assertEqual(ws.parse_args(['--mode', 'http-only']).mode, 'http-only')
+        with mock.patch.object(ws, 'RUN_MODE', 'mcp-only'):
+            self.assertEqual(ws.parse_args([]).mode, 'mcp-only')
+
+    def test_unknown_modes_are_refused(self):
+        for argv, run_mode in ((['--mode', 'both'], 'combined'), ([], 'both')):
+            with self.subTest(argv=argv, run_mode=run_mode), mock.patch.object(ws, 'RUN_MODE', run_mode), \
+                    contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit):
+                ws.parse_args(argv)
+            self.assertIn("invalid mode 'both'", stderr.getvalue())
+
+    def test_mcp_is_only_imported_when_its_server_is_built(self):
+        check = ("import sys, webstream_server as ws; loaded = 'mcp' in sys.modules; ws.create_mcp_server(); "
+                 "print(loaded, 'mcp' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, timeout=60,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.split(), ['False', 'True'], result.stderr)
+
+
+class StartupTimeTest(unittest.TestCase):
+    def test_each_interface_is_recorded_once(self):
+        with mock.patch.dict(ws.startup_ms, clear=True):
+            ws.record_startup('http')
+            first = ws.startup_ms['http']
+            ws.record_startup('http')
+            self.assertEqual(ws.startup_ms, {'http': first})
+        self.assertGreater(first, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
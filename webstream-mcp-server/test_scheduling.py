@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Unit tests for priority scheduling: PriorityQueues, PushQueue, LaneScheduler
+and the overflow policies of DeliveryLane. Run with `python -m unittest test_scheduling`.
+"""
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import webstream_server as ws
+from test_support import Outcomes
+
+HIGH, NORMAL, LOW = range(3)
+
+
+def drain(queues: ws.PriorityQueues) -> list:
+    return [queues.popleft() for _ in range(len(queues))]
+
+
+class PriorityQueuesTest(unittest.TestCase):
+    def test_keeps_order_within_a_level(self):
+        queues = ws.PriorityQueues()
+        for i in range(5):
+            queues.append(('low', i), LOW)
+            queues.append(('high', i), HIGH)
+        popped = drain(queues)
+        self.assertEqual([i for level, i in popped if level == 'high'], list(range(5)))
+        self.assertEqual([i for level, i in popped if level == 'low'], list(range(5)))
+
+    def test_weighted_round_robin_follows_weights(self):
+        queues = ws.PriorityQueues()
+        per_round = sum(ws.PRIORITY_WEIGHTS)
+        for level in (HIGH, NORMAL, LOW):
+            for _ in range(per_round * 10):
+                queues.append(level, level)
+        served = [queues.popleft() for _ in range(per_round * 10)]
+        self.assertEqual([served.count(level) for level in (HIGH, NORMAL, LOW)],
+                         [weight * 10 for weight in ws.PRIORITY_WEIGHTS])
+
+    def test_urgent_item_waits_behind_a_few_lower_ones(self):
+        queues = ws.PriorityQueues()
+        for i in range(1000):
+            queues.append(i, LOW)
+        queues.popleft()
+        queues.append('urgent', HIGH)
+        self.assertLessEqual(drain(queues).index('urgent'), 1)
+
+    def test_levels_and_length(self):
+        queues = ws.PriorityQueues()
+        self.assertFalse(queues)
+        queues.append('a', NORMAL)
+        queues.append('b', LOW)
+        queues.append('c', LOW)
+        self.assertEqual(len(queues), 3)
+        self.assertEqual((queues.top_level(), queues.lowest_level()), (NORMAL, LOW))
+        self.assertEqual(queues.popleft(LOW), 'b')
+        self.assertEqual(queues.pop(LOW), 'c')
+        self.assertNotIn(LOW, queues.queues)
+        self.assertEqual(queues.lowest_level(), NORMAL)
+
+    def test_appendleft_goes_ahead_of_its_level(self):
+        queues = ws.PriorityQueues()
+        queues.append('b', LOW)
+        queues.appendleft('a', LOW)
+        self.assertEqual(drain(queues), ['a', 'b'])
+
+    def test_emptied_level_forgets_its_credit(self):
+        queues = ws.PriorityQueues()
+        queues.append('high', HIGH)
+        queues.append('low', LOW)
+        drain(queues)
+        self.assertEqual(queues.credits, [0] * len(ws.PRIORITIES))
+
+
+class PushQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_records_by_priority(self):
+        queue = ws.PushQueue(maxsize=10)
+        for name, priority in (('low', 'low'), ('normal', 'normal'), ('high', 'high')):
+            queue.put_nowait(SimpleNamespace(name=name, priority=priority))
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual((await queue.get()).name, 'high')
+        self.assertEqual(queue.get_nowait().name, 'normal')
+
+    async def test_respects_maxsize(self):
+        queue = ws.PushQueue(maxsize=1)
+        queue.put_nowait(SimpleNamespace(priority='low'))
+        with self.assertRaises(asyncio.QueueFull):
+            queue.put_nowait(SimpleNamespace(priority='high'))
+
+
+def fake_lane() -> SimpleNamespace:
+    return SimpleNamespace(ready_level=None)
+
+
+class LaneSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_serves_the_most_urgent_lane_first(self):
+        scheduler = ws.LaneScheduler()
+        low, high = fake_lane(), fake_lane()
+        scheduler.put(low, LOW)
+        scheduler.put(high, HIGH)
+        self.assertIs(await scheduler.get(), high)
+        self.assertIs(await scheduler.get(), low)
+        self.assertIsNone(high.ready_level)
+
+    async def test_moved_up_lane_is_served_once(self):
+        scheduler = ws.LaneScheduler()
+        lane, other = fake_lane(), fake_lane()
+        scheduler.put(lane, LOW)
+        scheduler.put(lane, HIGH)
+        scheduler.put(other, LOW)
+        self.assertEqual(scheduler.stats(), {'high': 1, 'normal': 0, 'low': 1})
+        self.assertIs(await scheduler.get(), lane)
+        # The stale low entry is skipped rather than serving the lane twice
+        self.assertIs(await scheduler.get(), other)
+        self.assertEqual(len(scheduler.ready), 0)
+
+    async def test_urgent_only_worker_ignores_lower_priorities(self):
+        scheduler = ws.LaneScheduler()
+        scheduler.put(fake_lane(), NORMAL)
+        waiting = asyncio.create_task(scheduler.get(urgent_only=True))
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        urgent = fake_lane()
+        scheduler.put(urgent, HIGH)
+        self.assertIs(await asyncio.wait_for(waiting, 1), urgent)
+        self.assertEqual(scheduler.stats()['normal'], 1)
+
+    async def test_put_wakes_an_idle_worker(self):
+        scheduler = ws.LaneScheduler()
+        waiting = asyncio.create_task(scheduler.get())
+        await asyncio.sleep(0)
+        lane = fake_lane()
+        scheduler.put(lane, LOW)
+        self.assertIs(await asyncio.wait_for(waiting, 1), lane)
+
+
+class LaneTestCase(unittest.TestCase):
+    overflow = 'buffer'
+
+    def setUp(self):
+        self.lane = ws.DeliveryLane(ws.Subscriber('http://example.invalid/hook', queue_size=3, overflow=self.overflow))
+        self.lane.scheduled = True  # Keep the dispatcher out of it
+        self.outcomes = Outcomes()
+
+    def submit(self, name: str, level: int = NORMAL):
+        self.lane.submit((SimpleNamespace(name=name, priority=level), self.outcomes, name))
+
+    def names(self, queues: ws.PriorityQueues) -> list:
+        return [item[0].name for level in sorted(queues.queues) for item in queues.queues[level]]
+
+
+class BufferingLaneTest(LaneTestCase):
+
+    def test_full_lane_holds_items_back(self):
+        for i in range(5):
+            self.submit(f'low{i}', LOW)
+        self.assertEqual(self.names(self.lane.items), ['low0', 'low1', 'low2'])
+        self.assertEqual(self.names(self.lane.held), ['low3', 'low4'])
+        self.assertEqual(self.lane.depth, 5)
+
+    def test_urgent_item_takes_the_place_of_the_newest_less_urgent_one(self):
+        for i in range(5):
+            self.submit(f'low{i}', LOW)
+        self.submit('high', HIGH)
+        self.assertEqual(self.names(self.lane.items), ['high', 'low0', 'low1'])
+        self.assertEqual(self.names(self.lane.held), ['low2', 'low3', 'low4'])
+
+    def test_item_no_more_urgent_than_the_queue_waits(self):
+        for name in ('high0', 'high1', 'high2', 'high3'):
+            self.submit(name, HIGH)
+        self.submit('high4', HIGH)
+        self.assertEqual(self.names(self.lane.held), ['high3', 'high4'])
+
+    def test_admits_held_back_items_most_urgent_first(self):
+        for i in range(4):
+            self.submit(f'low{i}', LOW)
+        self.submit('normal', NORMAL)
+        self.lane.items.popleft(LOW)
+        self.lane.items.popleft(LOW)
+        self.lane._admit_held()
+        self.assertEqual(self.names(self.lane.items), ['normal', 'low2', 'low3'])
+        self.assertEqual(len(self.lane.held), 0)
+
+    def test_held_back_items_are_bounded(self):
+        with mock.patch.object(ws, 'LANE_BUFFER_MAX', 4):
+            for i in range(30):
+                self.submit(f'low{i}', LOW)
+                self.assertLessEqual(self.lane.depth, self.lane.capacity + 4)
+        self.assertEqual(self.names(self.lane.held), ['low3', 'low4', 'low5', 'low6'])
+        self.assertEqual(self.outcomes.statuses, {f'low{i}': 'dropped' for i in range(7, 30)})
+
+    def test_urgent_item_past_the_bound_drops_the_least_urgent_held_back_one(self):
+        with mock.patch.object(ws, 'LANE_BUFFER_MAX', 2):
+            for i in range(5):
+                self.submit(f'low{i}', LOW)
+            self.submit('high', HIGH)
+        self.assertEqual(self.names(self.lane.items), ['high', 'low0', 'low1'])
+        self.assertEqual(self.names(self.lane.held), ['low2', 'low3'])
+        self.assertEqual(self.outcomes.statuses, {'low4': 'dropped'})
+
+    def test_drops_are_counted_by_reason(self):
+        label = (ws.subscriber_label(self.lane.subscriber.url), 'buffer_full')
+        before = ws.dropped_metric.values.get(label, 0)
+        with mock.patch.object(ws, 'LANE_BUFFER_MAX', 1):
+            for i in range(6):
+                self.submit(f'low{i}', LOW)
+        self.assertEqual(ws.dropped_metric.values[label] - before, 2)
+
+    def test_former_block_name_is_still_accepted(self):
+        options = ws.parse_subscriber_options({'queue': {'size': 10, 'overflow': 'block'}})
+        self.assertEqual(options['overflow'], 'buffer')
+
+    def test_close_finishes_queued_and_held_back_items(self):
+        for i in range(5):
+            self.submit(f'm{i}')
+        self.lane.close('pending')
+        self.assertEqual(self.outcomes.statuses, {f'm{i}': 'pending' for i in range(5)})
+        self.assertEqual(self.lane.depth, 0)
+        self.submit('late')
+        self.assertEqual(self.outcomes.statuses['late'], 'failed')
+
+
+class DropOldestLaneTest(LaneTestCase):
+    overflow = 'drop_oldest'
+
+    def test_drops_the_oldest_least_urgent_item(self):
+        self.submit('high', HIGH)
+        for i in range(3):
+            self.submit(f'low{i}', LOW)
+        self.assertEqual(self.names(self.lane.items), ['high', 'low1', 'low2'])
+        self.assertEqual(self.outcomes.statuses, {'low0': 'dropped'})
+
+
+class DropNewestLaneTest(LaneTestCase):
+    overflow = 'drop_newest'
+
+    def test_drops_the_incoming_item(self):
+        for i in range(4):
+            self.submit(f'm{i}')
+        self.assertEqual(self.names(self.lane.items), ['m0', 'm1', 'm2'])
+        self.assertEqual(self.outcomes.statuses, {'m3': 'dropped'})
+
+    def test_urgent_item_replaces_a_less_urgent_one(self):
+        for i in range(3):
+            self.submit(f'low{i}', LOW)
+        self.submit('high', HIGH)
+        self.assertEqual(self.names(self.lane.items), ['high', 'low1', 'low2'])
+        self.assertEqual(self.outcomes.statuses, {'low0': 'dropped'})
+
+
+class LatestLaneTest(LaneTestCase):
+    overflow = 'latest'
+
+    def test_keeps_only_the_newest_item(self):
+        for i in range(3):
+            self.submit(f'm{i}')
+        self.assertEqual(self.names(self.lane.items), ['m2'])
+        self.assertEqual(self.outcomes.statuses, {'m0': 'dropped', 'm1': 'dropped'})
+
+
+
+class LaneOverflowOutcomeTest(unittest.IsolatedAsyncioTestCase):
+    """Fills a lane past its capacity under each policy, then shuts it down, through real fan-outs."""
+
+    EXPECTED = {
+        'buffer': {},
+        'drop_oldest': {'m0': 'dropped', 'm1': 'dropped'},
+        'drop_newest': {'m3': 'dropped', 'm4': 'dropped'},
+        'latest': {'m0': 'dropped', 'm1': 'dropped', 'm2': 'dropped', 'm3': 'dropped'}
+    }
+
+    async def test_each_policy_drops_the_right_deliveries_and_leaves_the_rest_pending(self):
+        for policy, dropped in self.EXPECTED.items():
+            with self.subTest(policy):
+                self.fill_and_shut_down(policy, dropped)
+
+    async def test_buffer_drops_past_the_held_back_bound(self):
+        with mock.patch.object(ws, 'LANE_BUFFER_MAX', 1):
+            self.fill_and_shut_down('buffer', {'m4': 'dropped'})
+
+    def fill_and_shut_down(self, policy: str, dropped: dict):
+        url = 'http://example.invalid/hook'
+        lane = ws.DeliveryLane(ws.Subscriber(url, queue_size=3, overflow=policy))
+        lane.scheduled = True  # Keep the dispatcher out of it
+        records, fanouts = {}, {}
+        with mock.patch.object(ws, 'outbox', None):
+            for i in range(5):
+                record = records[f'm{i}'] = ws.MessageRecord(f'm{i}', seq=i)
+                record.deliveries = {url: 'pending'}
+                fanouts[f'm{i}'] = ws.Fanout([url], record.set_delivery)
+                lane.submit((SimpleNamespace(priority=NORMAL), fanouts[f'm{i}'], 0))
+            self.assertEqual({name: record.deliveries[url] for name, record in records.items()
+                              if record.deliveries[url] != 'pending'}, dropped)
+            self.assertEqual(lane.depth, 5 - len(dropped))
+            lane.close('pending')  # Shutdown: what is still queued or held back resumes on restart
+        expected = {f'm{i}': dropped.get(f'm{i}', 'pending') for i in range(5)}
+        self.assertTrue(all(fanout.done.done() for fanout in fanouts.values()))
+        self.assertEqual({name: fanout.results[0] for name, fanout in fanouts.items()}, expected)
+        self.assertEqual({name: record.deliveries[url] for name, record in records.items()}, expected)
+
+if __name__ == '__main__':
+    unittest.main()
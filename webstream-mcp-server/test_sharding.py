@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Unit tests for multi-worker sharding: the hash ring, shared sequence numbers
+and replay ordering. Run with `python -m unittest test_sharding`.
+"""
+import unittest
+from collections import Counter
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+URLS = [f'http://receiver-{i}.example/hook' for i in range(4000)]
+
+
+class HashRingTest(unittest.TestCase):
+    def test_owner_is_stable_and_spread_over_every_shard(self):
+        ring = ws.HashRing(range(4), ws.SHARD_VNODES)
+        owners = [ring.owner(url) for url in URLS]
+        self.assertEqual(owners, [ws.HashRing(range(4), ws.SHARD_VNODES).owner(url) for url in URLS])
+        counts = Counter(owners)
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertGreater(min(counts.values()), len(URLS) / 4 / 2)
+
+    def test_adding_a_shard_moves_few_subscribers(self):
+        before, after = ws.HashRing(range(4), ws.SHARD_VNODES), ws.HashRing(range(5), ws.SHARD_VNODES)
+        moved = [url for url in URLS if before.owner(url) != after.owner(url)]
+        # Only subscribers taken over by the new shard move, about a fifth of them
+        self.assertTrue(all(after.owner(url) == 4 for url in moved))
+        self.assertLess(len(moved), len(URLS) * 0.3)
+
+    def test_single_worker_owns_everything(self):
+        cluster = ws.ShardCluster(1, 0)
+        self.assertFalse(cluster.enabled)
+        self.assertEqual({cluster.owner(url) for url in URLS[:100]}, {0})
+
+
+class SequenceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        start_patches(self, mock.patch.object(ws, 'last_seq', 10))
+
+    async def test_reserved_numbers_are_consecutive_and_never_reused(self):
+        self.assertEqual(ws.reserve_seqs(3), 11)
+        self.assertEqual(await ws.shard_sequence({'count': 2}), (200, {'first': 14}))
+        self.assertEqual(ws.next_seq(), 16)
+
+    async def test_other_shards_number_messages_through_shard_zero(self):
+        cluster = ws.ShardCluster(3, 1)
+        calls = []
+
+        async def call(shard, operation, data=None):
+            calls.append((shard, operation, data))
+            return 200, {'first': 41}
+
+        async def call_all(operation, data=None):
+            # Each shard answers with its own result objects, since publish() merges into the first
+            return [(200, {'results': [{'matched_webhooks': 1, 'webhooks_notified': None} for _ in data['messages']],
+                           'total_webhooks': 2}) for _ in range(3)]
+
+        with mock.patch.object(ws, 'cluster', cluster), \
+                mock.patch.object(cluster, 'call', call), mock.patch.object(cluster, 'call_all', call_all):
+            specs = [{'message': 'a'}, {'message': 'b'}]
+            status, body = await ws.publish(specs, 'async')
+        self.assertEqual(calls, [(0, 'sequence', {'count': 2})])
+        self.assertEqual([spec['seq'] for spec in specs], [41, 42])
+        self.assertEqual(len({spec['message_id'] for spec in specs}), 2)
+        self.assertEqual(status, 200)
+        self.assertEqual([result['matched_webhooks'] for result in body['results']], [3, 3])
+        self.assertEqual(body['total_webhooks'], 6)
+
+
+class ClusterCountsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_single_registration_reports_cluster_wide_counts(self):
+        cluster = ws.ShardCluster(3, 1)
+
+        async def call_all(operation, data=None):
+            self.assertEqual(operation, 'counts')
+            return [(200, {'total_webhooks': 4, 'latest_seq': 30}),
+                    (200, {'total_webhooks': 1, 'latest_seq': 12}),
+                    (200, {'total_webhooks': 2, 'latest_seq': 25})]
+
+        with mock.patch.object(ws, 'cluster', cluster), mock.patch.object(cluster, 'call_all', call_all):
+            registered = await ws.with_cluster_counts(200, {'total_webhooks': 1, 'latest_seq': 12})
+            unregistered = await ws.with_cluster_counts(200, {'status': 'success', 'total_webhooks': 1})
+            rejected = await ws.with_cluster_counts(400, {'error': 'bad url'})
+        self.assertEqual(registered, (200, {'total_webhooks': 7, 'latest_seq': 30}))
+        self.assertEqual(unregistered, (200, {'status': 'success', 'total_webhooks': 7}))
+        self.assertEqual(rejected, (400, {'error': 'bad url'}))
+
+    async def test_unreachable_shard_is_left_out(self):
+        cluster = ws.ShardCluster(2, 1)
+
+        async def call_all(operation, data=None):
+            return [(503, {'error': 'Shard 0 is unavailable'}), (200, {'total_webhooks': 3, 'latest_seq': 8})]
+
+        with mock.patch.object(ws, 'cluster', cluster), mock.patch.object(cluster, 'call_all', call_all):
+            status, body = await ws.with_cluster_counts(200, {'total_webhooks': 3, 'latest_seq': 8})
+        self.assertEqual(body, {'total_webhooks': 3, 'latest_seq': 8})
+
+    async def test_single_worker_keeps_its_own_counts(self):
+        with mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)):
+            self.assertEqual(await ws.with_cluster_counts(200, {'total_webhooks': 2}), (200, {'total_webhooks': 2}))
+
+
+class ReplayOrderTest(unittest.TestCase):
+    def test_out_of_order_messages_are_replayed_in_sequence(self):
+        buffer = ws.ReplayBuffer(3, 1 << 20)
+        for seq in (1, 3, 2, 5, 4):
+            buffer.append(seq, {'seq': seq})
+        self.assertEqual([payload['seq'] for payload in buffer.since(0, 10)], [3, 4, 5])
+        self.assertEqual([payload['seq'] for payload in buffer.since(3, 10)], [4, 5])
+        self.assertEqual(buffer.oldest_seq, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Unit tests for streaming subscribers: registration while connected, removal
+on disconnect and, with several workers, replacing or unregistering a
+connection held by another worker. Run with `python -m unittest test_subscribe`.
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class SubscribeTestCase(unittest.IsolatedAsyncioTestCase):
+    cluster = ws.ShardCluster(1, 0)
+
+    async def asyncSetUp(self):
+        start_patches(self, *(mock.patch.dict(registry, clear=True)
+                              for registry in (ws.registered_webhooks, ws.topic_index, ws.catch_all_webhooks,
+                                               ws.stream_subscribers)),
+                      mock.patch.object(ws, 'webhook_order', None),
+                      mock.patch.object(ws, 'subscriber_store', None),
+                      mock.patch.object(ws, 'registry_changes', ws.ChangeLog(100)),
+                      mock.patch.object(ws, 'STREAM_KEEPALIVE', 0.05),
+                      mock.patch.object(ws, 'cluster', self.cluster))
+        app = web.Application()
+        app.router.add_get('/api/subscribe', ws.subscribe_handler)
+        app.router.add_post('/api/unregister', ws.unregister_webhook_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def until_removed(self, key: str):
+        for _ in range(200):
+            if key not in ws.registered_webhooks and key not in ws.stream_subscribers:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"{key} is still registered")
+
+
+class DisconnectTest(SubscribeTestCase):
+    async def test_sse_subscriber_is_removed_when_the_client_goes_away(self):
+        response = await self.client.get('/api/subscribe?id=phone-1')
+        self.assertEqual((await response.content.readline()).strip(), b'event: subscribed')
+        self.assertIn('sse:phone-1', ws.registered_webhooks)
+        response.close()
+        await self.until_removed('sse:phone-1')
+
+    async def test_websocket_subscriber_is_removed_when_the_client_closes(self):
+        socket = await self.client.ws_connect('/api/subscribe?id=tab-1')
+        self.assertEqual((await socket.receive_json())['subscriber'], 'ws:tab-1')
+        self.assertIs(ws.stream_subscribers['ws:tab-1'], ws.registered_webhooks['ws:tab-1'])
+        await socket.close()
+        await self.until_removed('ws:tab-1')
+
+    async def test_unregistering_closes_the_connection(self):
+        socket = await self.client.ws_connect('/api/subscribe?id=tab-1')
+        await socket.receive_json()
+        response = await self.client.post('/api/unregister', json={'webhook_url': 'ws:tab-1'})
+        self.assertEqual((await response.json())['status'], 'success')
+        self.assertEqual((await asyncio.wait_for(socket.receive(), 1)).type, web.WSMsgType.CLOSE)
+        await self.until_removed('ws:tab-1')
+
+
+class MultiWorkerSubscribeTest(SubscribeTestCase):
+    """Shard 0 of two, with shard 1 answering from ``remote`` instead of a real worker."""
+
+    cluster = ws.ShardCluster(2, 0)
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.remote = {'ws:elsewhere'}  # Keys whose connection shard 1 holds
+        self.remote_calls = []
+
+        async def call(shard, operation, data=None):
+            if shard == self.cluster.index:
+                return await ws.SHARD_OPERATIONS[operation](data or {})
+            self.remote_calls.append((operation, data))
+            if operation == 'counts':
+                return 200, {'total_webhooks': len(self.remote), 'latest_seq': 0}
+            status = 'success' if data['webhook_url'] in self.remote else 'not_found'
+            self.remote.discard(data['webhook_url'])
+            return 200, {'status': status, 'webhook_url': data['webhook_url'], 'total_webhooks': len(self.remote)}
+
+        start_patches(self, mock.patch.object(self.cluster, 'call', call))
+
+    async def test_connection_stays_local_and_is_removed_on_disconnect(self):
+        socket = await self.client.ws_connect('/api/subscribe?id=tab-1')
+        await socket.receive_json()
+        self.assertIn('ws:tab-1', ws.registered_webhooks)
+        await socket.close()
+        await self.until_removed('ws:tab-1')
+        self.assertEqual(self.remote_calls, [('unregister', {'webhook_url': 'ws:tab-1'})])
+
+    async def test_reconnecting_here_replaces_the_connection_another_worker_held(self):
+        socket = await self.client.ws_connect('/api/subscribe?id=elsewhere')
+        await socket.receive_json()
+        self.assertNotIn('ws:elsewhere', self.remote)
+        self.assertIn('ws:elsewhere', ws.registered_webhooks)
+        await socket.close()
+
+    async def test_unregister_reaches_the_worker_holding_the_connection(self):
+        response = await self.client.post('/api/unregister', json={'webhook_url': 'ws:elsewhere'})
+        body = await response.json()
+        self.assertEqual((body['status'], body['total_webhooks']), ('success', 0))
+        self.assertNotIn('ws:elsewhere', self.remote)
+        response = await self.client.post('/api/unregister', json={'webhook_url': 'ws:unknown'})
+        self.assertEqual((await response.json())['status'], 'not_found')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Fakes and fixtures shared by the unit tests. Holds no tests itself.
+"""
+
+
+class Outcomes:
+    """Stands in for a Fanout, remembering how each item finished."""
+
+    def __init__(self):
+        self.statuses = {}
+
+    def complete(self, name: str, status: str):
+        self.statuses[name] = status
+
+
+def start_patches(test, *patches):
+    """Start each patch for the length of ``test``, undoing it on cleanup."""
+    for patch in patches:
+        patch.start()
+        test.addCleanup(patch.stop)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the batch and reporting MCP tools: push_webhook_batch,
+delivery_report and how reports are summarized and waited for. Run with
+`python -m unittest test_tools`.
+"""
+import unittest
+from unittest import mock
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+def report(state: str, deliveries: dict, delivery_ms: dict = None) -> dict:
+    summary = {}
+    for status in deliveries.values():
+        summary[status] = summary.get(status, 0) + 1
+    return {'state': state, 'timestamp': '2026-01-01T00:00:00', 'topic': None, 'summary': summary,
+            'deliveries': deliveries, 'delivery_ms': delivery_ms or {}}
+
+
+class SummarizeReportTest(unittest.TestCase):
+    def test_problems_are_listed_first_and_the_list_is_capped(self):
+        deliveries = {'http://a/hook': 'delivered', 'http://b/hook': 'failed', 'http://c/hook': 'pending'}
+        summary = ws.summarize_report('m1', report('delivering', deliveries, {'http://a/hook': 12.5}), 2)
+        self.assertEqual(list(summary['subscribers']), ['http://b/hook', 'http://c/hook'])
+        self.assertTrue(summary['truncated'])
+        self.assertEqual((summary['slowest_ms'], summary['summary']), (12.5, {'delivered': 1, 'failed': 1, 'pending': 1}))
+
+    def test_unknown_message(self):
+        self.assertEqual(ws.summarize_report('m1', None, 10), {'message_id': 'm1', 'state': 'unknown'})
+
+
+class DeliveryReportsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_until_every_message_completes(self):
+        polls = []
+
+        async def status_of(message_id):
+            polls.append(message_id)
+            state = 'completed' if message_id == 'm1' or len(polls) > 4 else 'delivering'
+            return report(state, {})
+
+        with mock.patch.object(ws, 'REPORT_POLL_INTERVAL', 0.001):
+            reports = await ws.delivery_reports(['m1', 'm2'], 5, status_of)
+        self.assertEqual([entry['state'] for entry in reports], ['completed', 'completed'])
+        self.assertEqual(len(polls), 6)
+
+    async def test_gives_up_at_the_wait_and_returns_what_it_has(self):
+        async def status_of(message_id):
+            return report('delivering', {})
+
+        reports = await ws.delivery_reports(['m1'], 0, status_of)
+        self.assertEqual(reports[0]['state'], 'delivering')
+
+
+class BatchToolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.published = []
+
+        async def tool_publish(key, specs, mode, port, host, deadline_ms=None, quorum=None):
+            self.published.append((key, specs, mode))
+            results = [{'message_id': f'm{index}'} for index in range(len(specs))]
+            return 200, {'results': results, 'total_webhooks': 3}, 'http://localhost:8000'
+
+        start_patches(self, mock.patch.object(ws, 'tool_publish', tool_publish))
+
+    async def test_messages_are_published_in_one_call(self):
+        result = await ws.push_webhook_batch(['a', {'message': 'b', 'topic': 'alerts'}], mode='async',
+                                             topic='orders', idempotency_key=' k1 ')
+        self.assertEqual((result['status'], result['count'], result['total_webhooks']), ('accepted', 2, 3))
+        key, specs, mode = self.published[0]
+        self.assertEqual((key, mode), ('k1', 'async'))
+        self.assertEqual([(spec['message'], spec['topic']) for spec in specs], [('a', 'orders'), ('b', 'alerts')])
+
+    async def test_invalid_batches_are_reported_without_publishing(self):
+        for messages, mode in (([], ''), (['a'], 'later')):
+            with self.subTest(messages=messages, mode=mode):
+                result = await ws.push_webhook_batch(messages, mode=mode)
+                self.assertEqual(result['status'], 'error')
+        self.assertEqual(self.published, [])
+
+
+class DeliveryReportToolTest(unittest.IsolatedAsyncioTestCase):
+    async def test_reports_are_summarized_and_totalled(self):
+        reports = {'m1': report('completed', {'http://a/hook': 'delivered', 'http://b/hook': 'failed'}),
+                   'm2': report('completed', {'http://a/hook': 'delivered'})}
+
+        async def forward_message_status(message_id):
+            return reports.get(message_id)
+
+        with mock.patch.object(ws, 'RUN_MODE', 'mcp-only'), \
+                mock.patch.object(ws, 'forward_message_status', forward_message_status):
+            result = await ws.delivery_report(['m1', 'm2', 'm3'])
+        self.assertEqual(result['totals'], {'delivered': 2, 'failed': 1})
+        self.assertEqual([message['state'] for message in result['messages']], ['completed', 'completed', 'unknown'])
+        self.assertFalse(result['completed'])
+
+    async def test_message_id_count_is_bounded(self):
+        self.assertEqual((await ws.delivery_report([]))['status'], 'error')
+        too_many = [f'm{index}' for index in range(ws.PUSH_BATCH_MAX_MESSAGES + 1)]
+        self.assertEqual((await ws.delivery_report(too_many))['status'], 'error')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Unit tests for tracing and profiling: push and delivery timelines, the
+/api/traces endpoints and the token-gated event loop profiler. Run with
+`python -m unittest test_tracing`.
+"""
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import webstream_server as ws
+from test_support import start_patches
+
+
+class PushTraceTest(unittest.TestCase):
+    def test_deliveries_beyond_the_cap_are_only_counted(self):
+        trace = ws.PushTrace('m1', parse_ms=1.5)
+        with mock.patch.object(ws, 'TRACE_MAX_DELIVERIES', 2):
+            attempts = [trace.delivery(f'http://{name}/hook') for name in 'abc']
+            retry = trace.delivery('http://a/hook')
+        self.assertIsNone(attempts[2])
+        self.assertEqual(len(trace.deliveries['http://a/hook']), 2)
+        self.assertIsNot(retry, attempts[0])
+        self.assertEqual(trace.summary()['deliveries'], 3)
+        self.assertEqual(trace.to_dict()['untraced_deliveries'], 1)
+
+    def test_summary_reports_the_slowest_finished_delivery(self):
+        trace = ws.PushTrace('m1')
+        fast, slow, unfinished = (trace.delivery(f'http://{name}/hook') for name in 'abc')
+        fast.finish('delivered')
+        slow.mark('connect')
+        slow.finish('failed')
+        self.assertIsNone(trace.summary()['duration_ms'])
+        trace.mark('done')
+        summary = trace.summary()
+        self.assertEqual(summary['slowest'], {'webhook_url': 'http://b/hook', 'ms': slow.events[-1][1]})
+        self.assertEqual(summary['duration_ms'], trace.spans[-1][1])
+        self.assertEqual([event for event, _ in slow.events], ['start', 'connect', 'done'])
+        self.assertEqual(trace.to_dict()['deliveries']['http://c/hook'], [unfinished.to_dict()])
+
+
+class TracesEndpointTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        start_patches(self, mock.patch.object(ws, 'recent_traces', OrderedDict()),
+                      mock.patch.object(ws, 'TRACE_HISTORY', 2),
+                      mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)))
+        app = web.Application()
+        app.router.add_get('/api/traces', ws.traces_handler)
+        app.router.add_get('/api/traces/{message_id}', ws.trace_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_recent_traces_are_listed_newest_first_and_capped(self):
+        for message_id in ('m1', 'm2', 'm3'):
+            ws.start_trace(message_id, 0.5)
+        body = await (await self.client.get('/api/traces')).json()
+        self.assertEqual([summary['message_id'] for summary in body['traces']], ['m3', 'm2'])
+        response = await self.client.get('/api/traces?limit=x')
+        self.assertEqual(response.status, 400)
+
+    async def test_one_trace_has_its_timeline(self):
+        trace = ws.start_trace('m1', 0.5)
+        trace.delivery('http://a/hook').finish('delivered')
+        body = await (await self.client.get('/api/traces/m1')).json()
+        self.assertEqual([stage for stage, _ in body['spans']], ['received', 'parsed'])
+        self.assertEqual(body['deliveries']['http://a/hook'][0]['status'], 'delivered')
+        self.assertEqual((await self.client.get('/api/traces/unknown')).status, 404)
+
+    def test_producers_can_ask_for_a_trace(self):
+        request = mock.Mock(headers={'X-Trace': 'true'})
+        self.assertTrue(ws.wants_trace(request, {}))
+        self.assertTrue(ws.wants_trace(mock.Mock(headers={}), {'trace': True}))
+        with mock.patch.object(ws, 'TRACE_SAMPLE_RATE', 0):
+            self.assertFalse(ws.wants_trace(mock.Mock(headers={}), {}))
+
+
+class ProfileHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        start_patches(self, mock.patch.object(ws, 'cluster', ws.ShardCluster(1, 0)))
+        app = web.Application()
+        app.router.add_get('/debug/profile', ws.profile_handler)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def profile(self, token: str, query: str = 'seconds=0.05'):
+        return await self.client.get(f'/debug/profile?{query}', headers={'Authorization': f'Bearer {token}'})
+
+    async def test_disabled_without_a_token(self):
+        with mock.patch.object(ws, 'PROFILE_TOKEN', ''):
+            self.assertEqual((await self.profile('')).status, 404)
+
+    async def test_token_is_required_and_checked(self):
+        with mock.patch.object(ws, 'PROFILE_TOKEN', 'secret'):
+            self.assertEqual((await self.profile('wrong')).status, 403)
+            self.assertEqual((await self.profile('secret', 'seconds=0')).status, 400)
+            response = await self.profile('secret')
+            report = await response.json()
+            self.assertEqual(response.status, 200)
+            self.assertGreater(report['samples'], 0)
+            folded = await self.profile('secret', 'seconds=0.05&format=folded')
+            self.assertEqual(folded.content_type, 'text/plain')
+
+    async def test_one_profile_at_a_time(self):
+        with mock.patch.object(ws, 'PROFILE_TOKEN', 'secret'), ws.profile_lock:
+            self.assertEqual((await self.profile('secret')).status, 409)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,100 +2,3724 @@
 """
 Simple WebhookMCP Server - Provides a web server with webhook delivery capability
 """
+import time
+PROCESS_STARTED = time.perf_counter()  # Taken before any other import so startup_ms covers them too
+
+import argparse
 import os
 import sys
 import logging
 import asyncio
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import math
+import queue
+import random
+import signal
+import sqlite3
+import subprocess
 import threading
+import uuid
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timezone
-from aiohttp import web, ClientSession
-from mcp.server.fastmcp import FastMCP
+from typing import Any
+from urllib.parse import quote
+from aiohttp import web, ClientError, ClientSession, ClientTimeout, TCPConnector, TraceConfig, UnixConnector, WSMsgType
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for subscribers that ask for zstd
+    zstandard = None
+
+# Configure logging to stderr
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+logger = logging.getLogger("webhook-server")
+
+# Configuration
+DEFAULT_PORT = int(os.environ.get("WEBHOOK_PORT", "8000"))
+DEFAULT_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+
+RUN_MODE = os.environ.get("WEBHOOK_MODE", "combined")  # "combined", "http-only" or "mcp-only" (overridden by --mode)
+RUN_MODES = ("combined", "http-only", "mcp-only")
+SERVER_URL = os.environ.get("WEBHOOK_SERVER_URL", "")  # Web server the mcp-only tools talk to, default http://127.0.0.1:<port>
+SERVER_TIMEOUT = float(os.environ.get("WEBHOOK_SERVER_TIMEOUT", "120"))  # Seconds an mcp-only tool waits for the web server
+RUNTIME_MODE = os.environ.get("WEBHOOK_RUNTIME", "single")  # "single": one event loop, "threaded": web server in its own thread
+WEB_SERVER_READY_TIMEOUT = 10  # Seconds the threaded runtime waits for the web server
+
+# Fan-out tuning (override via environment variables)
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get("WEBHOOK_MAX_CONCURRENCY", "200"))  # Global cap on in-flight deliveries
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "200"))  # Total pooled sockets
+WEBHOOK_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS_PER_HOST", "20"))
+WEBHOOK_KEEPALIVE_TIMEOUT = float(os.environ.get("WEBHOOK_KEEPALIVE_TIMEOUT", "30"))  # Seconds an idle socket is kept
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", "10"))  # Seconds per webhook request
+STATS_RATE_WINDOW = 60  # Seconds used to compute pushes/sec
+METRICS_MAX_SUBSCRIBER_SERIES = int(os.environ.get("WEBHOOK_METRICS_MAX_SUBSCRIBER_SERIES", "100"))  # Per-webhook label values before folding into "other"
+
+# Push acceptance (override via environment variables)
+PUSH_MODE = os.environ.get("WEBHOOK_PUSH_MODE", "sync")  # Default mode: "sync" waits for delivery, "async" returns 202
+PUSH_WORKERS = int(os.environ.get("WEBHOOK_PUSH_WORKERS", "4"))  # Background delivery workers
+PUSH_QUEUE_SIZE = int(os.environ.get("WEBHOOK_PUSH_QUEUE_SIZE", "10000"))  # Accepted-but-undelivered messages
+MESSAGE_HISTORY_LIMIT = int(os.environ.get("WEBHOOK_MESSAGE_HISTORY", "1000"))  # Delivery records kept for status lookups
+PUSH_MODES = ("sync", "async")
+
+# Retries, circuit breakers and eviction (override via environment variables)
+WEBHOOK_MAX_RETRIES = int(os.environ.get("WEBHOOK_MAX_RETRIES", "3"))  # Retries after a failed first attempt
+WEBHOOK_RETRY_BASE_DELAY = float(os.environ.get("WEBHOOK_RETRY_BASE_DELAY", "0.5"))  # Seconds, doubled per attempt
+WEBHOOK_RETRY_MAX_DELAY = float(os.environ.get("WEBHOOK_RETRY_MAX_DELAY", "30"))
+WEBHOOK_MAX_PENDING_RETRIES = int(os.environ.get("WEBHOOK_MAX_PENDING_RETRIES", "10000"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("WEBHOOK_BREAKER_THRESHOLD", "5"))  # Consecutive failures that open a breaker
+BREAKER_COOLDOWN = float(os.environ.get("WEBHOOK_BREAKER_COOLDOWN", "30"))  # Seconds open before a half-open probe
+BREAKER_MAX_COOLDOWN = float(os.environ.get("WEBHOOK_BREAKER_MAX_COOLDOWN", "600"))
+WEBHOOK_EVICT_AFTER = int(os.environ.get("WEBHOOK_EVICT_AFTER", "20"))  # Consecutive failures before removal, 0 disables
+
+# Replay buffer for reconnecting subscribers (override via environment variables)
+REPLAY_MAX_MESSAGES = int(os.environ.get("WEBHOOK_REPLAY_MAX_MESSAGES", "10000"))
+REPLAY_MAX_BYTES = int(os.environ.get("WEBHOOK_REPLAY_MAX_BYTES", str(16 * 1024 * 1024)))
+REPLAY_PAGE_LIMIT = int(os.environ.get("WEBHOOK_REPLAY_PAGE_LIMIT", "1000"))  # Messages per catch-up response
+
+# Local persistence (override via environment variables)
+DATA_DIR = os.environ.get("WEBHOOK_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+REGISTRY_PERSIST = os.environ.get("WEBHOOK_PERSIST_REGISTRY", "true").lower() in ("1", "true", "yes")
+REGISTRY_FSYNC = os.environ.get("WEBHOOK_REGISTRY_FSYNC", "false").lower() in ("1", "true", "yes")  # fsync every log append
+REGISTRY_COMPACT_THRESHOLD = int(os.environ.get("WEBHOOK_REGISTRY_COMPACT_THRESHOLD", "10000"))  # Log entries before compaction
+REGISTRY_COMPACT_INTERVAL = float(os.environ.get("WEBHOOK_REGISTRY_COMPACT_INTERVAL", "300"))  # Seconds between compaction checks
+
+OUTBOX_ENABLED = os.environ.get("WEBHOOK_OUTBOX", "true").lower() in ("1", "true", "yes")
+OUTBOX_GROUP_COMMIT_MS = float(os.environ.get("WEBHOOK_OUTBOX_GROUP_COMMIT_MS", "2"))  # Linger before committing a write batch
+OUTBOX_MAX_BATCH = int(os.environ.get("WEBHOOK_OUTBOX_MAX_BATCH", "1000"))  # Writes per transaction
+OUTBOX_SYNCHRONOUS = os.environ.get("WEBHOOK_OUTBOX_SYNCHRONOUS", "NORMAL").upper()  # SQLite synchronous pragma: NORMAL or FULL
+OUTBOX_RETENTION = float(os.environ.get("WEBHOOK_OUTBOX_RETENTION", "3600"))  # Seconds finished messages are kept
+DELIVERY_TERMINAL_STATES = ('delivered', 'failed', 'circuit_open', 'dropped')
+RETRYABLE_STATES = ('failed', 'circuit_open')  # Outcomes retried while attempts remain; final only after the last
+
+# Multi-worker sharding (override via environment variables)
+WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "1"))  # Processes sharing the HTTP port; subscribers are sharded across them
+SHARD_INDEX = int(os.environ.get("WEBHOOK_SHARD_INDEX", "0"))  # Set on spawned workers; shard 0 also serves MCP
+SHARD_VNODES = 64  # Points per shard on the consistent-hash ring
+SHARD_SOCKET_DIR = os.environ.get("WEBHOOK_SHARD_SOCKET_DIR", os.path.join(DATA_DIR, "shards"))  # Unix sockets for shard IPC
+STATE_DIR = DATA_DIR if SHARD_INDEX == 0 else os.path.join(DATA_DIR, f"shard-{SHARD_INDEX}")  # This shard's registry and outbox
+
+# Claim-check delivery of large messages (override via environment variables)
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")  # Shared by all workers; files are named by the SHA-256 of their content
+BLOB_THRESHOLD = int(os.environ.get("WEBHOOK_BLOB_THRESHOLD", str(256 * 1024)))  # JSON messages of at least this many bytes are stored as blobs, 0 disables
+BLOB_MAX_SIZE = int(os.environ.get("WEBHOOK_BLOB_MAX_SIZE", str(64 * 1024 * 1024)))  # Largest raw message body /api/push accepts
+BLOB_MAX_BYTES = int(os.environ.get("WEBHOOK_BLOB_MAX_BYTES", str(1024 * 1024 * 1024)))  # Total blob size before the oldest are evicted
+BLOB_TTL = float(os.environ.get("WEBHOOK_BLOB_TTL", "86400"))  # Seconds a blob is kept after the last push that stored it
+BLOB_SWEEP_INTERVAL = 60  # Seconds between expiry and size sweeps of the blob directory
+BLOB_CHUNK_SIZE = 64 * 1024  # Bytes read from a streamed request body at a time
+PUBLIC_URL = os.environ.get("WEBHOOK_PUBLIC_URL", "").rstrip("/")  # Prefix of blob URLs in claim checks, e.g. https://hooks.example.com
+
+# Batching limits
+PUSH_BATCH_MAX_MESSAGES = int(os.environ.get("WEBHOOK_PUSH_BATCH_MAX", "1000"))  # Messages per /api/push/batch request
+COALESCE_MAX_MESSAGES = 1000  # Upper bound a subscriber may request for batch.max_messages
+COALESCE_MAX_DELAY_MS = 10000  # Upper bound a subscriber may request for batch.max_delay_ms
+
+# Per-subscriber delivery lanes (override via environment variables)
+LANE_QUEUE_SIZE = int(os.environ.get("WEBHOOK_LANE_QUEUE_SIZE", "1000"))  # Deliveries queued per subscriber
+LANE_POLICY_ALIASES = {'block': 'buffer'}  # Former policy names, still accepted from clients and saved registrations
+LANE_OVERFLOW = os.environ.get("WEBHOOK_LANE_OVERFLOW", "buffer")  # Policy when a subscriber's queue is full
+LANE_OVERFLOW = LANE_POLICY_ALIASES.get(LANE_OVERFLOW, LANE_OVERFLOW)
+LANE_BUFFER_MAX = int(os.environ.get("WEBHOOK_LANE_BUFFER_MAX",
+                                     os.environ.get("WEBHOOK_LANE_BLOCKED_MAX", "10000")))  # Deliveries a full "buffer" lane holds back before dropping
+LANE_POLICIES = ('buffer', 'drop_oldest', 'drop_newest', 'latest')
+MAX_LANE_QUEUE_SIZE = 100000  # Upper bound a subscriber may request for queue.size
+
+# Priority classes (override via environment variables)
+PRIORITIES = ("high", "normal", "low")  # Most urgent first; the index is the scheduling level
+DEFAULT_PRIORITY = "normal"
+PRIORITY_WEIGHTS = tuple(int(weight) for weight in os.environ.get("WEBHOOK_PRIORITY_WEIGHTS", "16,4,1").split(","))  # Delivery turns per class while all are backlogged
+PRIORITY_RESERVED_WORKERS = int(os.environ.get("WEBHOOK_PRIORITY_RESERVED_WORKERS", "8"))  # Extra lane workers that only serve high priority
+
+# Streaming ingest (override via environment variables)
+STREAM_BUFFER_SIZE = int(os.environ.get("WEBHOOK_STREAM_BUFFER", "1000"))  # Parsed messages held per stream before reading pauses
+STREAM_BATCH_SIZE = int(os.environ.get("WEBHOOK_STREAM_BATCH", "100"))  # Messages handed to the fan-out path at once
+STREAM_MAX_LINE_BYTES = 1024 * 1024  # Longest NDJSON line accepted on /api/stream
+STREAM_MAX_ERRORS = 10  # Rejected lines reported back per stream
+
+# Streaming subscribers (override via environment variables)
+STREAM_SUBSCRIBER_QUEUE = int(os.environ.get("WEBHOOK_STREAM_SUBSCRIBER_QUEUE", "1000"))  # Messages queued per connection before a slow client is dropped
+MAX_STREAM_SUBSCRIBERS = int(os.environ.get("WEBHOOK_MAX_STREAM_SUBSCRIBERS", "10000"))
+STREAM_KEEPALIVE = 15  # Seconds between SSE keepalive comments and WebSocket pings
+STREAM_TRANSPORTS = ('ws', 'sse')
+MAX_CLIENT_ID_LENGTH = 200
+
+# Live dashboard (override via environment variables)
+DASHBOARD_INTERVAL = float(os.environ.get("WEBHOOK_DASHBOARD_INTERVAL", "1"))  # Seconds between /api/events stats events
+DASHBOARD_CHANGE_HISTORY = 1000  # Registry changes remembered per shard for /api/events
+DASHBOARD_VIEWER_QUEUE = 50  # Events buffered per dashboard before it is told to reload instead
+MAX_DASHBOARD_VIEWERS = 100
+
+# Idempotent pushes (override via environment variables)
+IDEMPOTENCY_TTL = float(os.environ.get("WEBHOOK_IDEMPOTENCY_TTL", "600"))  # Seconds a push result is remembered under its key
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("WEBHOOK_IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_MAX_BYTES = int(os.environ.get("WEBHOOK_IDEMPOTENCY_MAX_BYTES", str(16 * 1024 * 1024)))  # Encoded size of remembered results
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# Tracing and profiling (override via environment variables)
+TRACE_SAMPLE_RATE = float(os.environ.get("WEBHOOK_TRACE_SAMPLE_RATE", "0"))  # Fraction of pushes traced without asking
+TRACE_HISTORY = int(os.environ.get("WEBHOOK_TRACE_HISTORY", "100"))  # Traced messages kept for /api/traces
+TRACE_MAX_DELIVERIES = 100  # Deliveries timed per traced message; the rest are only counted
+PROFILE_TOKEN = os.environ.get("WEBHOOK_PROFILE_TOKEN", "")  # /debug/profile is disabled unless set
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_TOP = 25  # Functions listed in a profile report
+
+# MCP delivery reports
+REPORT_MAX_WAIT = 60  # Longest delivery_report may wait for messages to complete, in seconds
+TOOL_MAX_LISTED_WEBHOOKS = 20  # Confirmed subscribers push_webhook names before summarizing the rest
+REPORT_POLL_INTERVAL = 0.05
+
+# Payload compression
+COMPRESSION_MIN_BYTES = int(os.environ.get("WEBHOOK_COMPRESSION_MIN_BYTES", "1024"))  # Smaller bodies are sent uncompressed
+GZIP_LEVEL = int(os.environ.get("WEBHOOK_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.environ.get("WEBHOOK_ZSTD_LEVEL", "3"))
+
+# Registration limits
+BULK_MAX_WEBHOOKS = int(os.environ.get("WEBHOOK_BULK_MAX", "10000"))  # Webhooks per bulk register/unregister request
+WEBHOOK_PAGE_LIMIT = 1000  # Most webhooks returned by one /api/webhooks page
+MAX_METADATA_KEYS = 20
+MAX_METADATA_BYTES = 1024
+
+# Topic routing limits
+MAX_TOPIC_LENGTH = 200
+MAX_TOPICS_PER_SUBSCRIBER = 100
+MAX_FILTERS_PER_SUBSCRIBER = 20
+
+# Global storage for the web server and registered webhooks
+web_app = None
+web_runner = None
+web_loop = None  # Event loop serving HTTP; owns the client session, push queue and registry
+web_server_ready = threading.Event()  # Set once the web server accepts connections
+startup_ms = {}  # Milliseconds from launch until each interface ("http", "mcp") was serving
+server_session = None  # mcp-only: client session the tools use to reach the web server
+shard_runner = None  # Internal app serving /_shard/* on this worker's Unix socket
+registered_webhooks = {}  # webhook_url -> Subscriber
+message_records = OrderedDict()  # message_id -> MessageRecord, oldest first
+recent_traces = OrderedDict()  # message_id -> PushTrace for traced messages, oldest first
+push_queue = None  # PushQueue of MessageRecords awaiting background delivery
+push_worker_tasks = []
+maintenance_tasks = []  # Periodic background jobs started with the web server
+circuit_breakers = {}  # webhook_url -> CircuitBreaker
+retry_tasks = set()  # Scheduled retry tasks, kept referenced until they finish
+topic_index = {}  # topic -> {webhook_url: Subscriber} for subscribers registered with topics
+catch_all_webhooks = {}  # webhook_url -> Subscriber for subscribers without topics (receive every message)
+lanes = {}  # webhook_url -> DeliveryLane for subscribers with queued or in-flight deliveries
+active_streams = set()  # IngestStreams currently reading from a producer
+stream_subscribers = {}  # subscriber key -> Subscriber attached over a WebSocket or SSE connection
+webhook_order = None  # Sorted registry keys backing /api/webhooks cursors; None once the registry changed
+
+# === SUBSCRIBERS ===
+
+class Subscriber:
+    """A registered webhook, the delivery options it opted into and its delivery counters.
+
+    Streaming subscribers carry the StreamChannel of their open connection and
+    are keyed by ``ws:<id>`` or ``sse:<id>`` instead of a URL. Slots keep each
+    entry small, since registries can hold hundreds of thousands of them.
+    """
+
+    __slots__ = ('url', 'batch_max_messages', 'batch_max_delay_ms', 'topics', 'filters', 'compression',
+                 'channel', 'queue_size', 'overflow', 'metadata', 'claim_check', 'registered_at', 'delivered',
+                 'failed', 'last_delivery_at')
+
+    def __init__(self, webhook_url: str, batch_max_messages: int = 0, batch_max_delay_ms: int = 0,
+                 topics: tuple = (), filters: dict = None, compression: str = None, channel=None,
+                 queue_size: int = 0, overflow: str = None, metadata: dict = None, claim_check: bool = False):
+        self.url = webhook_url
+        self.batch_max_messages = batch_max_messages
+        self.batch_max_delay_ms = batch_max_delay_ms
+        self.topics = topics  # Empty: receives messages on every topic
+        self.filters = filters  # attribute -> allowed values; all must match
+        self.compression = compression  # Content-Encoding for request bodies, None for identity
+        self.channel = channel  # StreamChannel for WebSocket/SSE subscribers, None for webhooks
+        self.queue_size = queue_size  # Lane capacity, 0 for WEBHOOK_LANE_QUEUE_SIZE
+        self.overflow = overflow  # Lane overflow policy, None for WEBHOOK_LANE_OVERFLOW
+        self.metadata = metadata  # Caller-supplied labels, stored and listed but not used for routing
+        self.claim_check = claim_check  # Receives a blob reference instead of the body of large messages
+        self.registered_at = time.time()
+        self.delivered = 0  # Successful requests (a coalesced batch counts once)
+        self.failed = 0
+        self.last_delivery_at = None
+
+    @property
+    def coalesces(self) -> bool:
+        return self.batch_max_messages > 0
+
+    def matches(self, topic: str, attributes: dict) -> bool:
+        """Whether a message with this topic and these attributes is meant for the subscriber."""
+        if self.topics and topic not in self.topics:
+            return False
+        if self.filters:
+            if not attributes:
+                return False
+            for key, allowed in self.filters.items():
+                if attributes.get(key) not in allowed:
+                    return False
+        return True
+
+    def options(self) -> dict:
+        options = {}
+        if self.coalesces:
+            options['batch'] = {'max_messages': self.batch_max_messages, 'max_delay_ms': self.batch_max_delay_ms}
+        if self.topics:
+            options['topics'] = list(self.topics)
+        if self.filters:
+            options['filters'] = {key: list(allowed) for key, allowed in self.filters.items()}
+        if self.compression:
+            options['compression'] = self.compression
+        if self.queue_size or self.overflow:
+            options['queue'] = {'size': self.queue_size or LANE_QUEUE_SIZE, 'overflow': self.overflow or LANE_OVERFLOW}
+        if self.metadata:
+            options['metadata'] = self.metadata
+        if self.claim_check:
+            options['claim_check'] = True
+        if self.channel:
+            options['transport'] = self.channel.transport
+        return options
+
+    def record_delivery(self, ok: bool):
+        if ok:
+            self.delivered += 1
+        else:
+            self.failed += 1
+        self.last_delivery_at = time.time()
+
+    def stats(self) -> dict:
+        return {
+            'registered_at': datetime.fromtimestamp(self.registered_at, timezone.utc).isoformat(),
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'last_delivery_at': (datetime.fromtimestamp(self.last_delivery_at, timezone.utc).isoformat()
+                                 if self.last_delivery_at else None)
+        }
+
+def validate_topic(topic) -> str:
+    if not isinstance(topic, str) or not topic or len(topic) > MAX_TOPIC_LENGTH:
+        raise ValueError(f"Topics must be non-empty strings of at most {MAX_TOPIC_LENGTH} characters")
+    return topic
+
+def is_attribute_value(value) -> bool:
+    return isinstance(value, (str, int, float, bool)) or value is None
+
+def parse_subscriber_options(data: dict) -> dict:
+    """Validate the optional delivery settings of a registration request."""
+    options = {}
+    batch = data.get('batch')
+    if batch is not None:
+        if not isinstance(batch, dict):
+            raise ValueError("batch must be an object")
+        max_messages = batch.get('max_messages', 10)
+        max_delay_ms = batch.get('max_delay_ms', 100)
+        if not isinstance(max_messages, int) or not 1 <= max_messages <= COALESCE_MAX_MESSAGES:
+            raise ValueError(f"batch.max_messages must be an integer between 1 and {COALESCE_MAX_MESSAGES}")
+        if not isinstance(max_delay_ms, int) or not 0 <= max_delay_ms <= COALESCE_MAX_DELAY_MS:
+            raise ValueError(f"batch.max_delay_ms must be an integer between 0 and {COALESCE_MAX_DELAY_MS}")
+        options['batch_max_messages'] = max_messages
+        options['batch_max_delay_ms'] = max_delay_ms
+    
+    topics = data.get('topics')
+    if topics is not None:
+        if isinstance(topics, str):
+            topics = [topics]
+        if not isinstance(topics, list) or len(topics) > MAX_TOPICS_PER_SUBSCRIBER:
+            raise ValueError(f"topics must be an array of at most {MAX_TOPICS_PER_SUBSCRIBER} topics")
+        options['topics'] = tuple(sorted({validate_topic(topic) for topic in topics}))
+    
+    filters = data.get('filters')
+    if filters is not None:
+        if not isinstance(filters, dict) or len(filters) > MAX_FILTERS_PER_SUBSCRIBER:
+            raise ValueError(f"filters must be an object with at most {MAX_FILTERS_PER_SUBSCRIBER} attributes")
+        parsed = {}
+        for key, allowed in filters.items():
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            if not allowed or not all(is_attribute_value(value) for value in allowed):
+                raise ValueError(f"filters.{key} must be a scalar or an array of scalars")
+            parsed[key] = frozenset(allowed)
+        if parsed:
+            options['filters'] = parsed
+    
+    queue = data.get('queue')
+    if queue is not None:
+        if not isinstance(queue, dict):
+            raise ValueError("queue must be an object")
+        size = queue.get('size', LANE_QUEUE_SIZE)
+        overflow = queue.get('overflow', LANE_OVERFLOW)
+        overflow = LANE_POLICY_ALIASES.get(overflow, overflow)
+        if not isinstance(size, int) or not 1 <= size <= MAX_LANE_QUEUE_SIZE:
+            raise ValueError(f"queue.size must be an integer between 1 and {MAX_LANE_QUEUE_SIZE}")
+        if overflow not in LANE_POLICIES:
+            raise ValueError(f"queue.overflow must be one of: {', '.join(LANE_POLICIES)}")
+        options['queue_size'] = size
+        options['overflow'] = overflow
+    
+    metadata = data.get('metadata')
+    if metadata is not None:
+        if (not isinstance(metadata, dict) or len(metadata) > MAX_METADATA_KEYS
+                or not all(isinstance(key, str) and is_attribute_value(value) for key, value in metadata.items())):
+            raise ValueError(f"metadata must be an object with at most {MAX_METADATA_KEYS} scalar values")
+        if len(encode_json(metadata)) > MAX_METADATA_BYTES:
+            raise ValueError(f"metadata must encode to at most {MAX_METADATA_BYTES} bytes")
+        if metadata:
+            options['metadata'] = metadata
+    
+    claim_check = data.get('claim_check')
+    if claim_check is not None:
+        if not isinstance(claim_check, bool):
+            raise ValueError("claim_check must be true or false")
+        if claim_check:
+            options['claim_check'] = True
+    
+    compression = data.get('compression')
+    if compression is not None and compression != 'identity':
+        if compression not in COMPRESSORS:
+            raise ValueError(f"compression must be one of: identity, {', '.join(COMPRESSORS)}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        options['compression'] = compression
+    return options
+
+def index_subscriber(subscriber: Subscriber):
+    if subscriber.topics:
+        for topic in subscriber.topics:
+            topic_index.setdefault(topic, {})[subscriber.url] = subscriber
+    else:
+        catch_all_webhooks[subscriber.url] = subscriber
+
+def unindex_subscriber(subscriber: Subscriber):
+    catch_all_webhooks.pop(subscriber.url, None)
+    for topic in subscriber.topics:
+        subscribers = topic_index.get(topic)
+        if subscribers is not None:
+            subscribers.pop(subscriber.url, None)
+            if not subscribers:
+                del topic_index[topic]
+
+def route_message(topic: str = None, attributes: dict = None) -> list:
+    """Return the URLs of subscribers a message should be delivered to.
+
+    Messages without a topic only go to subscribers registered without topics.
+    Topic messages only touch the topic's index entry plus those catch-all
+    subscribers, so the cost grows with the number of matching subscribers
+    rather than the registry size.
+    """
+    if topic is None:
+        candidates = catch_all_webhooks
+    else:
+        candidates = topic_index.get(topic, {})
+        if catch_all_webhooks:
+            candidates = {**candidates, **catch_all_webhooks}
+    return [
+        webhook_url for webhook_url, subscriber in candidates.items()
+        if subscriber.filters is None or subscriber.matches(topic, attributes)
+    ]
+
+def add_subscriber(subscriber: Subscriber):
+    """Insert or replace a subscriber and record the change in the persistent store."""
+    global webhook_order
+    previous = registered_webhooks.get(subscriber.url)
+    if previous is not None:
+        unindex_subscriber(previous)
+        # Counters describe the endpoint, so they survive re-registration with new options
+        subscriber.registered_at = previous.registered_at
+        subscriber.delivered = previous.delivered
+        subscriber.failed = previous.failed
+        subscriber.last_delivery_at = previous.last_delivery_at
+    else:
+        webhook_order = None
+        registry_changes.record('registered', subscriber.url)
+    registered_webhooks[subscriber.url] = subscriber
+    index_subscriber(subscriber)
+    circuit_breakers.pop(subscriber.url, None)  # Re-registration gets a fresh breaker
+    if subscriber.url in lanes:
+        lanes[subscriber.url].subscriber = subscriber  # Queued deliveries continue under the new options
+    # Streaming subscribers only exist while connected, so they are never persisted
+    if subscriber_store and subscriber.channel is None:
+        subscriber_store.append('add', subscriber.url, subscriber.options())
+
+def remove_subscriber(webhook_url: str) -> bool:
+    """Remove a subscriber; returns False if it wasn't registered."""
+    global webhook_order
+    subscriber = registered_webhooks.pop(webhook_url, None)
+    if subscriber is None:
+        return False
+    webhook_order = None
+    registry_changes.record('unregistered', webhook_url)
+    unindex_subscriber(subscriber)
+    circuit_breakers.pop(webhook_url, None)
+    lane = lanes.pop(webhook_url, None)
+    if lane is not None:
+        lane.close()
+    if subscriber.channel is not None:
+        subscriber.channel.close('unregistered')
+    elif subscriber_store:
+        subscriber_store.append('remove', webhook_url)
+    return True
+
+def register_subscriber(data: dict) -> Subscriber:
+    """Validate one registration request and add (or replace) its subscriber; raises ValueError."""
+    webhook_url = data.get('webhook_url', '')
+    if not webhook_url:
+        raise ValueError('webhook_url is required')
+    if not isinstance(webhook_url, str) or not webhook_url.startswith(('http://', 'https://')):
+        raise ValueError('Invalid webhook URL format')
+    subscriber = Subscriber(webhook_url, **parse_subscriber_options(data))
+    add_subscriber(subscriber)
+    return subscriber
+
+def webhook_page(cursor: str = None, limit: int = 100) -> tuple:
+    """Return (keys, next_cursor) for the registry keys sorting after ``cursor``.
+
+    Keys are paged in sorted order so a cursor stays valid while webhooks come
+    and go. The sorted list is rebuilt lazily after the registry changed.
+    """
+    global webhook_order
+    if webhook_order is None:
+        webhook_order = sorted(registered_webhooks)
+    start = bisect_right(webhook_order, cursor) if cursor else 0
+    page = webhook_order[start:start + limit]
+    return page, page[-1] if start + limit < len(webhook_order) else None
+
+# === PERSISTENT REGISTRY ===
+
+class SubscriberStore:
+    """Persists the registry as a compacted JSON snapshot plus an append-only event log.
+
+    Every registration change appends one line to the log (O(1)). Compaction
+    rotates the log aside, writes a fresh snapshot atomically and then drops
+    the rotated log, so a crash at any point leaves a replayable state:
+    snapshot, then rotated log, then current log. Replaying an operation
+    twice is harmless because add/remove are idempotent.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, 'subscribers.snapshot.json')
+        self.log_path = os.path.join(directory, 'subscribers.log')
+        self.rotated_log_path = self.log_path + '.old'
+        self.log_file = None
+        self.log_entries = 0
+        self.compacting = False
+        self.deferred = False  # Set while a bulk change appends many entries
+
+    def load(self) -> dict:
+        """Rebuild {webhook_url: options} from the snapshot and logs."""
+        entries = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            # Most subscribers use default options, so the snapshot keeps a flat URL list
+            entries = dict.fromkeys(snapshot['webhooks'])
+            entries.update(snapshot['options'])
+        for path in (self.rotated_log_path, self.log_path):
+            if os.path.exists(path):
+                self.log_entries += self._replay(path, entries)
+        return entries
+
+    def _replay(self, path: str, entries: dict) -> int:
+        count = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    op, webhook_url, options = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write; everything before it is intact
+                    logger.warning(f"Ignoring unreadable line in {path}")
+                    continue
+                if op == 'add':
+                    entries[webhook_url] = options or None
+                else:
+                    entries.pop(webhook_url, None)
+                count += 1
+        return count
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.log_file = open(self.log_path, 'a', encoding='utf-8')
+        if self._ends_torn(self.log_path):
+            # End the torn line, so the next entry isn't glued onto it and lost as well
+            self.log_file.write('\n')
+            self.flush()
+
+    @staticmethod
+    def _ends_torn(path: str) -> bool:
+        with open(path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+
+    def append(self, op: str, webhook_url: str, options: dict = None):
+        self.log_file.write(json.dumps([op, webhook_url, options]) + '\n')
+        if not self.deferred:
+            self.flush()
+        self.log_entries += 1
+
+    def flush(self):
+        self.log_file.flush()
+        if REGISTRY_FSYNC:
+            os.fsync(self.log_file.fileno())
+
+    @contextmanager
+    def deferred_writes(self):
+        """Write the entries appended inside the block with one flush (and fsync) at the end."""
+        self.deferred = True
+        try:
+            yield
+        finally:
+            self.deferred = False
+            self.flush()
+
+    async def compact(self, subscribers: dict):
+        """Fold the logs into a new snapshot of the given subscribers, with the file work in a thread."""
+        if self.compacting:
+            return
+        self.compacting = True
+        try:
+            if os.path.exists(self.rotated_log_path):
+                # Left over from an interrupted compaction: fold it in and keep the current log,
+                # whose entries the snapshot then covers as well and replays harmlessly
+                new_log = None
+            else:
+                # Renamed aside while still open, so appends meanwhile land in the rotated log
+                new_log = await asyncio.to_thread(self._rotate)
+            # Capture state and switch logs in one step on the event loop, so the snapshot
+            # covers every entry in the rotated log and appends after it land in the new one
+            subscribers = {url: subscriber for url, subscriber in subscribers.items() if subscriber.channel is None}
+            data = {'version': 1, 'webhooks': list(subscribers), 'options': {}}
+            for url, subscriber in subscribers.items():
+                options = subscriber.options()
+                if options:
+                    data['options'][url] = options
+            if new_log is not None:
+                old_log, self.log_file = self.log_file, new_log
+                self.log_entries = 0
+                await asyncio.to_thread(old_log.close)
+            
+            await asyncio.to_thread(self._write_snapshot, data)
+            await asyncio.to_thread(os.remove, self.rotated_log_path)
+            logger.info(f"Compacted subscriber registry ({len(data['webhooks'])} subscribers)")
+        finally:
+            self.compacting = False
+
+    def _rotate(self):
+        os.replace(self.log_path, self.rotated_log_path)
+        return open(self.log_path, 'a', encoding='utf-8')
+
+    def _write_snapshot(self, data: dict):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+subscriber_store = SubscriberStore(STATE_DIR) if REGISTRY_PERSIST else None
+
+async def load_registry():
+    """Restore registered webhooks from disk and open the event log."""
+    global webhook_order
+    if subscriber_store is None or subscriber_store.log_file is not None:
+        return
+    started = time.perf_counter()
+    entries = subscriber_store.load()
+    for webhook_url, options in entries.items():
+        try:
+            subscriber = Subscriber(webhook_url, **parse_subscriber_options(options)) if options else Subscriber(webhook_url)
+        except ValueError as e:
+            logger.warning(f"Skipping stored webhook {webhook_url}: {e}")
+            continue
+        registered_webhooks[webhook_url] = subscriber
+        index_subscriber(subscriber)
+    webhook_order = None
+    subscriber_store.open()
+    logger.info(f"Loaded {len(entries)} webhooks from {subscriber_store.directory} "
+                f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    if subscriber_store.log_entries:
+        await subscriber_store.compact(registered_webhooks)
+
+async def registry_compactor():
+    """Compact the registry log once it passes the threshold, or periodically if it has any entries."""
+    last_compaction = time.monotonic()
+    while True:
+        await asyncio.sleep(min(REGISTRY_COMPACT_INTERVAL, 30))
+        overdue = time.monotonic() - last_compaction >= REGISTRY_COMPACT_INTERVAL
+        if subscriber_store.log_entries >= REGISTRY_COMPACT_THRESHOLD or (overdue and subscriber_store.log_entries):
+            try:
+                await subscriber_store.compact(registered_webhooks)
+            except Exception as e:
+                logger.error(f"Registry compaction failed: {e}")
+            last_compaction = time.monotonic()
+
+# === PAYLOAD ENCODING ===
+
+def compress_zstd(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+COMPRESSORS = {
+    'gzip': lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL),
+    'zstd': compress_zstd
+}
+
+def encode_json(payload) -> bytes:
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+class EncodedPayload:
+    """A webhook payload serialized once and shared by every delivery of a push.
+
+    ``body`` is encoded on first use and compressed bodies are cached per codec,
+    so a push costs one serialization plus at most one compression per codec no
+    matter how many subscribers receive it.
+    """
+
+    def __init__(self, payload: dict = None, body: bytes = None):
+        self.payload = payload
+        self._body = body
+        self._compressed = {}  # codec -> bytes
+        self.trace = None  # PushTrace of a traced message
+        self.priority = PRIORITIES.index(DEFAULT_PRIORITY)  # Scheduling level, 0 is the most urgent
+        self.blob = None  # Blob reference when the payload is a claim check for a stored message
+        self._expanded = None  # Future of the payload with the blob's content inlined, for subscribers without claim_check
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = encode_json(self.payload)
+        return self._body
+
+    async def for_subscriber(self, subscriber) -> 'EncodedPayload':
+        """The payload to send a subscriber: a claim check, or the stored message inlined unless it opted in.
+
+        The blob is read and encoded once, on the first delivery that needs it;
+        deliveries arriving meanwhile wait for the same read. Raises OSError if
+        the blob can't be read, and the next delivery tries again.
+        """
+        if self.blob is None or subscriber.claim_check:
+            return self
+        if self._expanded is None:
+            self._expanded = asyncio.ensure_future(self._expand())
+        expanded = self._expanded
+        try:
+            return await asyncio.shield(expanded)
+        except OSError:
+            if self._expanded is expanded:
+                self._expanded = None  # Don't let one failed read fail every later delivery
+            raise
+
+    async def _expand(self) -> 'EncodedPayload':
+        expanded = EncodedPayload(await inline_blob(self.payload))
+        expanded.trace = self.trace
+        expanded.priority = self.priority
+        return expanded
+
+    def for_encoding(self, codec: str = None) -> tuple:
+        """Return ``(body, content_encoding)``; small bodies are never compressed."""
+        if codec is None or len(self.body) < COMPRESSION_MIN_BYTES:
+            return self.body, None
+        compressed = self._compressed.get(codec)
+        if compressed is None:
+            compressed = self._compressed[codec] = COMPRESSORS[codec](self.body)
+        return compressed, codec
+
+# === BLOB STORE ===
+
+class BlobStore:
+    """Content-addressed storage for large message bodies, bounded by total size and age.
+
+    A blob is a file named by the SHA-256 of its content. It is written to a
+    temporary file and renamed into place, so readers never see a partial
+    blob and the same body pushed twice is stored once (and its age reset).
+    Its content type sits next to it in ``.<hash>.type``, rewritten by every
+    push of the blob so both age together. The directory is shared by all
+    workers. Each keeps an index of the blobs it knows about and evicts from
+    it as it stores; a periodic sweep rebuilds the index from the directory
+    after deleting blobs older than ``ttl`` and then the oldest beyond
+    ``max_bytes``, which is what bounds the directory as a whole when several
+    workers store into it. Disk work runs in a thread, never on the event loop.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # hash -> (size, stored_at), oldest first
+        self.bytes = 0
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def type_path(self, digest: str) -> str:
+        return os.path.join(self.directory, f".{digest}.type")
+
+    def content_type(self, digest: str) -> str:
+        """The content type a blob was last pushed with; blocking, so callers on the event loop run it in a thread."""
+        try:
+            with open(self.type_path(digest)) as f:
+                return f.read() or 'application/octet-stream'
+        except FileNotFoundError:
+            return 'application/octet-stream'
+
+    def lookup(self, digest: str):
+        """The content type of a stored blob, None if there is none; blocking like content_type()."""
+        if not os.path.isfile(self.path(digest)):
+            return None
+        return self.content_type(digest)
+
+    def open(self):
+        """Create the directory and index what is in it; blocking, so callers on the event loop run it in a thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_all(self._index(self._scan(time.time())))
+
+    async def write(self, chunks, content_type: str, max_size: int) -> dict:
+        """Store a body read from an async iterator of chunks; raises ValueError beyond ``max_size`` bytes.
+
+        Hashing and writing run in a thread, so a large upload never blocks the event loop.
+        """
+        hasher = hashlib.sha256()
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, 'wb')
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError(f"Message bodies are limited to {max_size} bytes")
+                await asyncio.to_thread(self._write_chunk, f, hasher, chunk)
+            await asyncio.to_thread(f.close)
+            digest = hasher.hexdigest()
+            await asyncio.to_thread(self._commit, tmp_path, digest, content_type)
+        except BaseException:
+            # Shielded, so a cancelled upload still cleans up after itself
+            await asyncio.shield(asyncio.to_thread(self._discard, f, tmp_path))
+            raise
+        return await self._added(digest, size, content_type)
+
+    async def store(self, body: bytes, content_type: str) -> dict:
+        """Store a body that is already in memory."""
+        def write() -> str:
+            digest = hashlib.sha256(body).hexdigest()
+            if self._refresh(digest):
+                self._write_type(digest, content_type)
+                self.deduplicated += 1
+            else:
+                tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+                with open(tmp_path, 'wb') as f:
+                    f.write(body)
+                self._commit(tmp_path, digest, content_type)
+            return digest
+        return await self._added(await asyncio.to_thread(write), len(body), content_type)
+
+    async def _added(self, digest: str, size: int, content_type: str) -> dict:
+        evicted = self._add(digest, size)
+        if evicted:
+            await asyncio.to_thread(self._remove_all, evicted)
+        return {'hash': digest, 'size': size, 'content_type': content_type}
+
+    @staticmethod
+    def _write_chunk(f, hasher, chunk: bytes):
+        hasher.update(chunk)
+        f.write(chunk)
+
+    @staticmethod
+    def _discard(f, tmp_path: str):
+        f.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass  # Already committed or never written
+
+    def _refresh(self, digest: str) -> bool:
+        """Restart the age of an existing blob; False if there is none."""
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write_type(self, digest: str, content_type: str):
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(content_type)
+        os.replace(tmp_path, self.type_path(digest))
+
+    def _commit(self, tmp_path: str, digest: str, content_type: str):
+        # The type goes first, so a blob is never served without it
+        self._write_type(digest, content_type)
+        if self._refresh(digest):
+            os.remove(tmp_path)
+            self.deduplicated += 1
+        else:
+            os.replace(tmp_path, self.path(digest))
+            self.stored += 1
+
+    def _add(self, digest: str, size: int) -> list:
+        """Index a stored blob; returns the oldest ones dropped from the index to stay within the size limit."""
+        previous = self.entries.pop(digest, None)
+        if previous is not None:
+            self.bytes -= previous[0]
+        self.entries[digest] = (size, time.time())
+        self.bytes += size
+        return self._over_size()
+
+    def _over_size(self) -> list:
+        evicted = []
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            oldest, (oldest_size, _) = self.entries.popitem(last=False)
+            self.bytes -= oldest_size
+            evicted.append(oldest)
+        return evicted
+
+    def _remove_all(self, digests: list):
+        for digest in digests:
+            self._remove(digest)
+
+    def _remove(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+            self.evicted += 1
+        except FileNotFoundError:
+            pass  # Already evicted by another worker
+        try:
+            os.remove(self.type_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _scan(self, now: float) -> list:
+        """Delete expired blobs, type files and stale temporary files; return [(stored_at, hash, size)] of the rest, oldest first."""
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    if not entry.name.startswith('.'):
+                        self.evicted += 1
+                elif not entry.name.startswith('.'):
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        return found
+
+    def _index(self, found: list, since: float = None) -> list:
+        """Replace the index with a scan's result, keeping blobs added after ``since``; returns those to evict."""
+        added = [(digest, entry) for digest, entry in self.entries.items() if since is not None and entry[1] >= since]
+        self.entries = OrderedDict((digest, (size, stored_at)) for stored_at, digest, size in found)
+        for digest, entry in added:
+            self.entries.pop(digest, None)
+            self.entries[digest] = entry
+        self.bytes = sum(size for size, _ in self.entries.values())
+        return self._over_size()
+
+    async def sweep(self):
+        started = time.time()
+        evicted = self._index(await asyncio.to_thread(self._scan, started), since=started)
+        if evicted:
+            await asyncio.to_thread(self._remove_all, evicted)
+
+    def read(self, digest: str) -> bytes:
+        """A blob's content; blocking, so callers on the event loop run it in a thread."""
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+    def stats(self) -> dict:
+        return {
+            'blobs': len(self.entries),
+            'bytes': self.bytes,
+            'stored': self.stored,
+            'deduplicated': self.deduplicated,
+            'evicted': self.evicted,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl
+        }
+
+blob_store = BlobStore(BLOB_DIR, BLOB_MAX_BYTES, BLOB_TTL)
+
+def is_blob_digest(value: str) -> bool:
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+relative_blob_urls_reported = False
+
+def blob_url(digest: str) -> str:
+    global relative_blob_urls_reported
+    if not PUBLIC_URL and not relative_blob_urls_reported:
+        relative_blob_urls_reported = True
+        if cluster.index == 0:  # Every shard builds the same claim checks; one warning is enough
+            logger.warning("WEBHOOK_PUBLIC_URL is not set, so claim-check URLs are paths remote subscribers can't resolve")
+    return f"{PUBLIC_URL}/api/blobs/{digest}"
+
+def is_text_content_type(content_type: str) -> bool:
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return media_type.startswith('text/') or media_type.endswith(('json', 'xml'))
+
+async def inline_blob(payload: dict) -> dict:
+    """A claim-check payload with its blob's content in ``message``, for subscribers without claim_check.
+
+    Text is inlined as a string. Anything else, or text that isn't valid UTF-8,
+    is inlined as base64 with ``message_encoding`` and the blob's
+    ``content_type`` alongside, so binary content arrives intact. Raises
+    OSError if the blob is gone.
+    """
+    blob = payload['blob']
+    data = await asyncio.to_thread(blob_store.read, blob['hash'])
+    expanded = dict(payload)
+    del expanded['blob']
+    if is_text_content_type(blob['content_type']):
+        try:
+            expanded['message'] = data.decode('utf-8')
+            return expanded
+        except UnicodeDecodeError:
+            pass
+    expanded.update(message=base64.b64encode(data).decode('ascii'), message_encoding='base64',
+                    content_type=blob['content_type'])
+    return expanded
+
+async def inline_blobs(payloads: list) -> list:
+    """Replayed payloads with their blobs inlined; a blob that was already evicted stays a reference."""
+    inlined = []
+    for payload in payloads:
+        if payload.get('blob') is not None:
+            try:
+                payload = await inline_blob(payload)
+            except OSError as e:
+                logger.warning(f"Replaying message {payload['message_id']} as a claim check: {e}")
+        inlined.append(payload)
+    return inlined
+
+async def check_in_large_messages(specs: list):
+    """Move messages of at least BLOB_THRESHOLD bytes into the blob store, leaving a reference in their spec."""
+    if not BLOB_THRESHOLD:
+        return
+    for spec in specs:
+        message = spec.get('message')
+        # A character encodes to at most four bytes, so most messages are ruled out without encoding them
+        if message is None or len(message) * 4 < BLOB_THRESHOLD:
+            continue
+        body = message.encode()
+        if len(body) >= BLOB_THRESHOLD:
+            spec.update(message=None, blob=await blob_store.store(body, 'text/plain; charset=utf-8'))
+
+async def blob_sweeper():
+    """Periodically expire old blobs, pick up those other workers stored or removed and trim the directory to size."""
+    while True:
+        await asyncio.sleep(BLOB_SWEEP_INTERVAL)
+        try:
+            await blob_store.sweep()
+        except Exception as e:
+            logger.error(f"Blob sweep failed: {e}")
+
+# === DELIVERY LANES ===
+
+class Fanout:
+    """Collects the delivery results of one payload across its subscribers."""
+
+    def __init__(self, webhook_urls: list, on_result=None):
+        self.webhook_urls = webhook_urls
+        self.results = ['failed'] * len(webhook_urls)
+        self.remaining = len(webhook_urls)
+        self.on_result = on_result  # Called with (webhook_url, status) as each delivery finishes
+        self.done = asyncio.get_running_loop().create_future()  # Resolves with the results list
+        if not self.remaining:
+            self.done.set_result(self.results)
+
+    def complete(self, index: int, status: str):
+        self.results[index] = status
+        if self.on_result:
+            self.on_result(self.webhook_urls[index], status)
+        self.remaining -= 1
+        if not self.remaining and not self.done.done():
+            self.done.set_result(self.results)
+
+class PriorityQueues:
+    """One FIFO queue per priority level, drained by smooth weighted round-robin.
+
+    Every pop credits each waiting level with its PRIORITY_WEIGHTS entry and
+    serves the level with the most credit, which then gives back the total.
+    While several levels are backlogged they get turns in proportion to their
+    weights: an urgent item waits behind a few lower ones at most, however
+    long their backlog, and a low backlog still drains under steady urgent
+    traffic. Queues only exist for levels that hold items.
+    """
+
+    __slots__ = ('queues', 'credits', 'size')
+
+    def __init__(self):
+        self.queues = {}  # level -> deque
+        self.credits = [0] * len(PRIORITIES)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, item, level: int):
+        queue = self.queues.get(level)
+        if queue is None:
+            queue = self.queues[level] = deque()
+        queue.append(item)
+        self.size += 1
+
+    def appendleft(self, item, level: int):
+        """Put an item back at the head of its level, ahead of everything queued there."""
+        queue = self.queues.get(level)
+        if queue is None:
+            queue = self.queues[level] = deque()
+        queue.appendleft(item)
+        self.size += 1
+
+    def top_level(self) -> int:
+        """The most urgent level with items queued."""
+        return min(self.queues)
+
+    def lowest_level(self) -> int:
+        """The least urgent level with items queued."""
+        return max(self.queues)
+
+    def popleft(self, level: int = None):
+        """Remove the next item by weighted round-robin, or the oldest of ``level``."""
+        if level is None:
+            if len(self.queues) == 1:
+                level = next(iter(self.queues))
+            else:
+                total = 0
+                for candidate in sorted(self.queues):
+                    self.credits[candidate] += PRIORITY_WEIGHTS[candidate]
+                    total += PRIORITY_WEIGHTS[candidate]
+                    if level is None or self.credits[candidate] > self.credits[level]:
+                        level = candidate
+                self.credits[level] -= total
+        queue = self.queues[level]
+        item = queue.popleft()
+        if not queue:
+            del self.queues[level]
+            self.credits[level] = 0
+        self.size -= 1
+        return item
+
+    def pop(self, level: int):
+        """Remove the newest item of ``level``."""
+        queue = self.queues[level]
+        item = queue.pop()
+        if not queue:
+            del self.queues[level]
+            self.credits[level] = 0
+        self.size -= 1
+        return item
+
+class PushQueue(asyncio.Queue):
+    """asyncio.Queue of MessageRecords served by priority like the lanes, not in arrival order."""
+
+    def _init(self, maxsize):
+        self._queue = PriorityQueues()
+
+    def _put(self, record):
+        self._queue.append(record, PRIORITIES.index(record.priority))
+
+    def _get(self):
+        return self._queue.popleft()
+
+class LaneScheduler:
+    """Lanes with a request due, handed to the dispatcher's workers by priority.
+
+    A lane waits at the level of its most urgent delivery. If a more urgent one
+    arrives while it waits, the lane is queued again at that level and the
+    older entry is skipped when it comes up (``lane.ready_level`` says which
+    entry is current). Reserved workers only take high-priority lanes.
+    """
+
+    def __init__(self):
+        self.ready = PriorityQueues()  # (lane, level)
+        self.waiters = deque()  # Futures of idle workers
+        self.urgent_waiters = deque()  # Futures of idle reserved workers
+
+    def put(self, lane, level: int):
+        lane.ready_level = level
+        self.ready.append((lane, level), level)
+        self._wake(self.waiters)
+        if level == 0:
+            self._wake(self.urgent_waiters)
+
+    @staticmethod
+    def _wake(waiters: deque):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def get(self, urgent_only: bool = False):
+        """Wait for the next lane to serve."""
+        while True:
+            if urgent_only:
+                entry = self.ready.popleft(0) if 0 in self.ready.queues else None
+            else:
+                entry = self.ready.popleft() if self.ready else None
+            if entry is None:
+                waiter = asyncio.get_running_loop().create_future()
+                (self.urgent_waiters if urgent_only else self.waiters).append(waiter)
+                await waiter
+                continue
+            lane, level = entry
+            if lane.ready_level == level:
+                lane.ready_level = None
+                return lane
+
+    def stats(self) -> dict:
+        """Lanes waiting per priority, not counting entries left behind by a move up."""
+        return {
+            priority: sum(1 for lane, _ in self.ready.queues.get(level, ()) if lane.ready_level == level)
+            for level, priority in enumerate(PRIORITIES)
+        }
+
+class DeliveryLane:
+    """One subscriber's bounded queue of pending deliveries.
+
+    The dispatcher's workers serve a lane one request at a time, so each
+    subscriber receives messages of one priority in order and a slow one only
+    backs up its own queue. Each priority has its own queue, drained by
+    weighted round-robin, so an urgent message overtakes a low-priority
+    backlog. A full lane applies the subscriber's overflow policy; under
+    ``buffer`` up to LANE_BUFFER_MAX further messages wait on the lane itself
+    until it has room, so neither the publisher nor other subscribers wait for
+    it, and beyond that the least urgent are dropped. Coalescing subscribers
+    get up to ``batch.max_messages`` queued payloads per request, sent once
+    the batch is full or ``batch.max_delay_ms`` after it started. Removing the
+    subscriber fails whatever is still queued; at shutdown it is finished as
+    ``pending`` instead, left in the outbox to resume on restart.
+    """
+
+    def __init__(self, subscriber: Subscriber):
+        self.subscriber = subscriber
+        self.items = PriorityQueues()  # (payload, fanout, index) waiting for delivery
+        self.scheduled = False  # Waiting for or held by a dispatcher worker
+        self.ready_level = None  # Level this lane waits at in the dispatcher's LaneScheduler
+        self.sending = False
+        self.window_start = 0.0  # When the current coalescing window opened
+        self.timer = None
+        self.held = PriorityQueues()  # Items held back by the buffer policy until the queue has room
+        self.closed = False
+
+    @property
+    def capacity(self) -> int:
+        return self.subscriber.queue_size or LANE_QUEUE_SIZE
+
+    @property
+    def overflow(self) -> str:
+        return self.subscriber.overflow or LANE_OVERFLOW
+
+    @property
+    def depth(self) -> int:
+        return len(self.items) + len(self.held)
+
+    def submit(self, item: tuple):
+        """Queue an item under the overflow policy, holding it back on the lane if the policy buffers."""
+        if self.closed:
+            self._finish(item, 'failed')
+            return
+        policy = self.overflow
+        level = item[0].priority
+        if policy == 'latest':
+            # Only the newest message matters to this subscriber: replace anything still queued
+            while self.items:
+                self._drop(self.items.popleft(), 'replaced')
+        elif policy == 'buffer' and (self.held or len(self.items) >= self.capacity):
+            if len(self.held) >= LANE_BUFFER_MAX:
+                # Held-back messages are bounded too: past the limit the least urgent one is dropped
+                if not self.held or level >= self.held.lowest_level():
+                    self._drop(item, 'buffer_full')
+                    return
+                self._drop(self.held.pop(self.held.lowest_level()), 'buffer_full')
+            if len(self.items) < self.capacity or level >= self.items.lowest_level() or level in self.held.queues:
+                # Waiting here rather than in the caller keeps the shared push workers moving
+                self.held.append(item, level)
+                return
+            # A more urgent message takes the place of the newest least urgent one, which waits first in line
+            lowest = self.items.lowest_level()
+            self.held.appendleft(self.items.pop(lowest), lowest)
+        elif len(self.items) >= self.capacity:
+            # Less urgent messages are shed first, whichever end the policy drops from
+            if policy == 'drop_newest' and level >= self.items.lowest_level():
+                self._drop(item, 'queue_full')
+                return
+            self._drop(self.items.popleft(self.items.lowest_level()), 'queue_full')
+        if not self.items:
+            self.window_start = time.monotonic()
+        self.items.append(item, level)
+        self.schedule()
+
+    def schedule(self):
+        """Hand the lane to the dispatcher's workers once its next request is due."""
+        if not self.items:
+            return
+        level = self.items.top_level()
+        if self.scheduled:
+            if self.ready_level is not None and level < self.ready_level:
+                dispatcher.ready_lanes.put(self, level)  # Move up to the more urgent queue
+            return
+        subscriber = self.subscriber
+        # High priority doesn't wait for a coalescing window to fill
+        if subscriber.coalesces and len(self.items) < subscriber.batch_max_messages and level > 0:
+            wait = self.window_start + subscriber.batch_max_delay_ms / 1000 - time.monotonic()
+            if wait > 0:
+                if self.timer is None:
+                    self.timer = asyncio.get_running_loop().call_later(wait, self._window_closed)
+                return
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.scheduled = True
+        dispatcher.ready_lanes.put(self, level)
+
+    def _window_closed(self):
+        self.timer = None
+        self.schedule()
+
+    async def serve(self):
+        """Send the next request of this lane; called by a dispatcher worker."""
+        subscriber = self.subscriber
+        count = subscriber.batch_max_messages if subscriber.coalesces else 1
+        batch = [self.items.popleft() for _ in range(min(count, len(self.items)))]
+        self._admit_held()
+        self.sending = True
+        try:
+            if self.closed or not batch:
+                status = 'failed'
+            elif subscriber.coalesces:
+                # Splice the already-encoded message bodies instead of serializing them again
+                timestamp = json.dumps(datetime.now(timezone.utc).isoformat())
+                bodies = [(await payload.for_subscriber(subscriber)).body for payload, _, _ in batch]
+                body = b''.join((
+                    b'{"messages":[', b','.join(bodies),
+                    b'],"count":%d,"timestamp":%s}' % (len(batch), timestamp.encode())
+                ))
+                status = await dispatcher.deliver_one(subscriber.url, EncodedPayload(body=body), subscriber.compression)
+            else:
+                status = await dispatcher.deliver_one(subscriber.url, await batch[0][0].for_subscriber(subscriber),
+                                                      subscriber.compression)
+        except asyncio.CancelledError:
+            # Stopped mid-request at shutdown: the outcome is unknown, so the deliveries stay pending
+            for item in batch:
+                self._finish(item, 'pending')
+            raise
+        except Exception as e:
+            logger.error(f"Error delivering to {subscriber.url}: {e}")
+            status = 'failed'
+        self.sending = False
+        for item in batch:
+            self._finish(item, status)
+        self.scheduled = False
+        if self.items:
+            self.window_start = 0.0  # A backlog is sent without waiting for another window
+            self.schedule()
+        elif lanes.get(subscriber.url) is self:
+            del lanes[subscriber.url]  # Idle lanes are dropped so memory follows the backlog, not the registry
+
+    def close(self, status: str = 'failed'):
+        """Finish everything queued with ``status``: ``failed`` when the subscriber is removed, ``pending`` at shutdown."""
+        self.closed = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.items:
+            self._finish(self.items.popleft(), status)
+        while self.held:
+            self._finish(self.held.popleft(), status)
+
+    def _admit_held(self):
+        """Move held-back items into the queue as it frees up, most urgent first."""
+        while self.held and len(self.items) < self.capacity:
+            level = self.held.top_level()
+            self.items.append(self.held.popleft(level), level)
+
+    def _drop(self, item: tuple, reason: str):
+        dispatcher.deliveries_dropped += 1
+        deliveries_metric.inc(('dropped',))
+        dropped_metric.inc((subscriber_label(self.subscriber.url), reason))
+        self._finish(item, 'dropped')
+
+    def _finish(self, item: tuple, status: str):
+        _, fanout, index = item
+        fanout.complete(index, status)
+
+    def to_dict(self) -> dict:
+        return {
+            'depth': self.depth,
+            'by_priority': {PRIORITIES[level]: len(queue) for level, queue in sorted(self.items.queues.items())},
+            'held': len(self.held),
+            'capacity': self.capacity,
+            'overflow': self.overflow,
+            'in_flight': self.sending
+        }
+
+def get_lane(subscriber: Subscriber) -> DeliveryLane:
+    lane = lanes.get(subscriber.url)
+    if lane is None:
+        lane = lanes[subscriber.url] = DeliveryLane(subscriber)
+    return lane
+
+async def deliver_to_subscriber(webhook_url: str, payload: EncodedPayload) -> str:
+    """Deliver one payload to a subscriber through its lane and wait for the outcome."""
+    subscriber = registered_webhooks.get(webhook_url)
+    if subscriber is None:
+        return 'failed'
+    if subscriber.channel is not None:
+        return dispatcher.deliver_stream(subscriber, payload)
+    fanout = Fanout([webhook_url])
+    get_lane(subscriber).submit((payload, fanout, 0))
+    return (await asyncio.shield(fanout.done))[0]
+
+# === STREAMING SUBSCRIBERS ===
+
+class StreamChannel(ABC):
+    """A subscriber's open WebSocket or SSE connection.
+
+    Fan-out only queues the encoded payload, and the connection's own handler
+    writes it out, so a slow client never holds up a push. A client that falls
+    STREAM_SUBSCRIBER_QUEUE messages behind is disconnected; it can reconnect
+    and catch up from the replay buffer.
+    """
+
+    transport = None
+
+    def __init__(self, request):
+        self.request = request
+        self.queue = asyncio.Queue(maxsize=STREAM_SUBSCRIBER_QUEUE)  # (seq, EncodedPayload) pairs, None once closed
+        self.closed = False
+        self.close_reason = None
+
+    def send(self, payload: EncodedPayload) -> bool:
+        """Queue a payload for the connection; returns False if it is closed or too far behind."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((payload.payload['seq'], payload))
+        except asyncio.QueueFull:
+            self.close(f"fell {STREAM_SUBSCRIBER_QUEUE} messages behind", abort=True)
+            return False
+        return True
+
+    def close(self, reason: str = None, abort: bool = False):
+        """Stop the connection; ``abort`` also drops the socket in case the writer is stuck on it."""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+        if abort and self.request.transport is not None:
+            self.request.transport.close()
+
+    async def next_batch(self):
+        """Everything queued, [] after STREAM_KEEPALIVE idle seconds, or None once closed."""
+        try:
+            item = await asyncio.wait_for(self.queue.get(), STREAM_KEEPALIVE)
+        except asyncio.TimeoutError:
+            return []
+        items = [item]
+        while not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return None if items[-1] is None else items
+
+    async def serve(self, subscriber: Subscriber, since: int = None):
+        """Register the subscriber, replay what it missed and relay live messages until it disconnects."""
+        previous = registered_webhooks.get(subscriber.url)
+        if previous is not None and previous.channel is not None:
+            previous.channel.close('replaced by a new connection')
+        add_subscriber(subscriber)
+        stream_subscribers[subscriber.url] = subscriber
+        # Routing is fixed when a message is accepted, and nothing is awaited between
+        # registering and taking the snapshot, so each message is either replayed or queued
+        hello = {'type': 'subscribed', 'subscriber': subscriber.url, 'latest_seq': last_seq}
+        missed = []
+        if since is not None:
+            page = catch_up(since, subscriber=subscriber)
+            hello['truncated'] = page['truncated']
+            missed = page['messages']
+            while page['has_more']:
+                page = catch_up(page['next_since'], subscriber=subscriber)
+                missed += page['messages']
+            hello['missed'] = len(missed)
+        logger.info(f"Streaming subscriber connected: {subscriber.url}")
+        try:
+            await self.write_event(hello)
+            if missed:
+                if not subscriber.claim_check:
+                    missed = await inline_blobs(missed)
+                await self.write_messages([(payload['seq'], encode_json(payload)) for payload in missed])
+            while True:
+                items = await self.next_batch()
+                if items is None:
+                    break
+                if items:
+                    await self.write_messages(await self._bodies(subscriber, items))
+                else:
+                    await self.keepalive()
+        except ConnectionError:
+            self.close_reason = self.close_reason or 'connection lost'
+        finally:
+            self.close()
+            if stream_subscribers.get(subscriber.url) is subscriber:
+                del stream_subscribers[subscriber.url]
+            if registered_webhooks.get(subscriber.url) is subscriber:
+                remove_subscriber(subscriber.url)
+            logger.info(f"Streaming subscriber disconnected: {subscriber.url} ({self.close_reason or 'client closed'})")
+
+    async def _bodies(self, subscriber: Subscriber, items: list) -> list:
+        """Encode queued payloads as ``(seq, body)`` pairs, in order; the writer reads any blob, not the fan-out."""
+        bodies = []
+        for seq, payload in items:
+            try:
+                bodies.append((seq, (await payload.for_subscriber(subscriber)).body))
+            except OSError as e:
+                logger.error(f"Error delivering to {subscriber.url}: {e}")  # The message's blob is gone
+        return bodies
+
+    @abstractmethod
+    async def write_event(self, event: dict):
+        """Send a control event such as the ``subscribed`` greeting."""
+
+    @abstractmethod
+    async def write_messages(self, items: list):
+        """Send ``(seq, body)`` pairs of encoded payloads."""
+
+    async def keepalive(self):
+        pass
+
+class SSEChannel(StreamChannel):
+    """Server-Sent Events: every message is an event whose id is its sequence number."""
+
+    transport = 'sse'
+
+    def __init__(self, request, response: web.StreamResponse):
+        super().__init__(request)
+        self.response = response
+
+    async def write_event(self, event: dict):
+        await self.response.write(b'event: %s\ndata: %s\n\n' % (event['type'].encode(), encode_json(event)))
+
+    async def write_messages(self, items: list):
+        # Payloads are compact JSON without raw newlines, so each fits on one data line
+        await self.response.write(b''.join(b'id: %d\ndata: %s\n\n' % item for item in items))
+
+    async def keepalive(self):
+        await self.response.write(b': keepalive\n\n')
+
+class WebSocketChannel(StreamChannel):
+    """WebSocket: every message is a text frame holding the webhook payload."""
+
+    transport = 'ws'
+
+    def __init__(self, request, ws: web.WebSocketResponse):
+        super().__init__(request)
+        self.ws = ws
+
+    async def serve(self, subscriber: Subscriber, since: int = None):
+        # Keep reading so close frames and pongs are processed; clients don't send anything else
+        reader = asyncio.create_task(self._read())
+        try:
+            await super().serve(subscriber, since)
+            await self.ws.close()
+        finally:
+            reader.cancel()
+
+    async def _read(self):
+        async for _ in self.ws:
+            pass
+        self.close()
+
+    async def write_event(self, event: dict):
+        await self.ws.send_json(event)
+
+    async def write_messages(self, items: list):
+        for _, body in items:
+            await self.ws.send_str(body.decode())
+
+# === CIRCUIT BREAKERS ===
+
+class CircuitBreaker:
+    """Per-endpoint breaker: closed -> open after repeated failures -> half-open probe -> closed."""
+
+    def __init__(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Return whether a request may be sent to the endpoint right now."""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = 'half_open'
+        # Half-open: let exactly one probe through
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.total_successes += 1
+        self.cooldown = BREAKER_COOLDOWN
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == 'half_open':
+            # Failed probe: stay open for longer before trying again
+            self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            self._open()
+        elif self.state == 'closed' and self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            self._open()
+        self.probe_in_flight = False
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+
+    def retry_in_seconds(self) -> float:
+        """Seconds until an open breaker lets a probe through; 0 unless open."""
+        if self.state != 'open':
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def to_dict(self) -> dict:
+        retry_in = round(self.retry_in_seconds(), 3) if self.state == 'open' else None
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'total_failures': self.total_failures,
+            'total_successes': self.total_successes,
+            'retry_in_seconds': retry_in
+        }
+
+def get_breaker(webhook_url: str) -> CircuitBreaker:
+    breaker = circuit_breakers.get(webhook_url)
+    if breaker is None:
+        breaker = circuit_breakers[webhook_url] = CircuitBreaker()
+    return breaker
+
+def evict_webhook(webhook_url: str, reason: str):
+    """Remove a dead webhook from the registry."""
+    if remove_subscriber(webhook_url):
+        logger.warning(f"Evicted webhook {webhook_url}: {reason}")
+
+def record_delivery_outcome(webhook_url: str, ok: bool):
+    """Feed a delivery result into the endpoint's counters and breaker, and evict endpoints that stay dead."""
+    subscriber = registered_webhooks.get(webhook_url)
+    if subscriber is None:
+        return  # A late outcome after removal would bring back a breaker for a URL that is gone
+    subscriber.record_delivery(ok)
+    breaker = get_breaker(webhook_url)
+    if ok:
+        if breaker.state != 'closed':
+            registry_changes.record('circuit_closed', webhook_url)
+        breaker.record_success()
+        return
+    was_open = breaker.state == 'open'
+    breaker.record_failure()
+    if breaker.state == 'open' and not was_open:
+        registry_changes.record('circuit_open', webhook_url)
+    if WEBHOOK_EVICT_AFTER and breaker.consecutive_failures >= WEBHOOK_EVICT_AFTER:
+        evict_webhook(webhook_url, f"{breaker.consecutive_failures} consecutive failures")
+
+# === METRICS ===
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FANOUT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class CounterMetric:
+    """A monotonically increasing counter, optionally split by label values."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}  # label values tuple -> count
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name + format_labels(self.labelnames, labels), value
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from existing state at scrape time."""
+
+    def __init__(self, name: str, help_text: str, read, metric_type: str = 'gauge'):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.type = metric_type
+
+    def samples(self):
+        yield self.name, self.read()
+
+class HistogramMetric:
+    """A cumulative histogram; observing is one bisect plus two additions."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self.series = {}  # label values tuple -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, labels: tuple = ()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield self.name + '_bucket' + format_labels(self.labelnames, labels, f'le="{bound}"'), cumulative
+            yield self.name + '_sum' + format_labels(self.labelnames, labels), series[-2]
+            yield self.name + '_count' + format_labels(self.labelnames, labels), series[-1]
+
+subscriber_series = set()  # webhook URLs that have their own label value
+
+def subscriber_label(webhook_url: str) -> str:
+    """Label value for a webhook, capped so the registry size can't explode the series count."""
+    if webhook_url in subscriber_series:
+        return webhook_url
+    if len(subscriber_series) < METRICS_MAX_SUBSCRIBER_SERIES:
+        subscriber_series.add(webhook_url)
+        return webhook_url
+    return 'other'
+
+pushes_metric = CounterMetric('webhook_pushes_total', 'Messages fanned out to subscribers')
+fanout_metric = HistogramMetric('webhook_fanout_duration_seconds', 'Time to fan one message out to all its subscribers', FANOUT_BUCKETS)
+delivery_latency_metric = HistogramMetric(
+    'webhook_delivery_duration_seconds', 'Webhook request latency per subscriber', LATENCY_BUCKETS, ('webhook_url',)
+)
+responses_metric = CounterMetric(
+    'webhook_responses_total', 'Webhook responses by subscriber and HTTP status code', ('webhook_url', 'code')
+)
+timeouts_metric = CounterMetric('webhook_timeouts_total', 'Webhook requests that timed out', ('webhook_url',))
+errors_metric = CounterMetric('webhook_connection_errors_total', 'Webhook requests that failed without a response', ('webhook_url',))
+deliveries_metric = CounterMetric('webhook_deliveries_total', 'Delivery attempts by outcome', ('status',))
+dropped_metric = CounterMetric('webhook_dropped_total', "Deliveries discarded by a subscriber's overflow policy",
+                               ('webhook_url', 'reason'))
+stream_messages_metric = CounterMetric('webhook_stream_messages_total', 'Messages received on ingest streams by outcome', ('status',))
+idempotency_metric = CounterMetric(
+    'webhook_idempotency_requests_total', 'Pushes carrying an Idempotency-Key by cache outcome', ('result',)
+)
+
+METRICS = (
+    pushes_metric,
+    fanout_metric,
+    deliveries_metric,
+    delivery_latency_metric,
+    responses_metric,
+    timeouts_metric,
+    errors_metric,
+    dropped_metric,
+    stream_messages_metric,
+    idempotency_metric,
+    CallbackMetric('webhook_idempotency_keys', 'Push results remembered for Idempotency-Key replays',
+                   lambda: len(idempotency_cache.entries)),
+    CallbackMetric('webhook_active_streams', 'Producer connections streaming messages in', lambda: len(active_streams)),
+    CallbackMetric('webhook_in_flight_requests', 'Webhook requests currently in flight', lambda: dispatcher.in_flight),
+    CallbackMetric('webhook_registered_subscribers', 'Registered webhooks', lambda: len(registered_webhooks)),
+    CallbackMetric('webhook_stream_subscribers', 'Subscribers attached over WebSocket or SSE', lambda: len(stream_subscribers)),
+    CallbackMetric('webhook_topics', 'Topics with at least one subscriber', lambda: len(topic_index)),
+    CallbackMetric('webhook_push_queue_depth', 'Accepted messages waiting for a push worker',
+                   lambda: push_queue.qsize() if push_queue else 0),
+    CallbackMetric('webhook_retries_pending', 'Scheduled delivery retries', lambda: len(retry_tasks)),
+    CallbackMetric('webhook_lane_queued', 'Deliveries waiting in subscriber lanes',
+                   lambda: sum(lane.depth for lane in lanes.values())),
+    CallbackMetric('webhook_active_lanes', 'Subscribers with queued or in-flight deliveries', lambda: len(lanes)),
+    CallbackMetric('webhook_open_circuits', 'Circuit breakers not in the closed state',
+                   lambda: sum(1 for breaker in circuit_breakers.values() if breaker.state != 'closed')),
+    CallbackMetric('webhook_connections_created_total', 'Sockets opened by the connection pool',
+                   lambda: dispatcher.connections_created, 'counter'),
+    CallbackMetric('webhook_connections_reused_total', 'Requests that reused a pooled socket',
+                   lambda: dispatcher.connections_reused, 'counter'),
+)
+
+def metric_families() -> list:
+    """Snapshot every metric as [name, help, type, [[sample, value], ...]]."""
+    return [[metric.name, metric.help, metric.type, list(metric.samples())] for metric in METRICS]
+
+def render_metrics(shard_families: list) -> str:
+    """Render metric families in the Prometheus text exposition format.
+
+    ``shard_families`` holds one metric_families() snapshot per shard; with
+    more than one, every sample gets a ``shard`` label.
+    """
+    lines = []
+    for position, (name, help_text, metric_type, _) in enumerate(shard_families[0]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for shard, families in enumerate(shard_families):
+            for sample, value in families[position][3]:
+                if len(shard_families) > 1:
+                    label = f'shard="{shard}"'
+                    sample = sample.replace('{', '{' + label + ',', 1) if '{' in sample else sample + '{' + label + '}'
+                lines.append(f"{sample} {value}")
+    return '\n'.join(lines) + '\n'
+
+# === TRACING AND PROFILING ===
+
+class DeliveryTrace:
+    """Events of one delivery attempt, in milliseconds since the push arrived."""
+
+    __slots__ = ('push', 'events', 'status')
+
+    def __init__(self, push: 'PushTrace'):
+        self.push = push
+        self.events = []
+        self.status = None
+
+    def mark(self, event: str):
+        self.events.append([event, self.push.elapsed_ms()])
+
+    def finish(self, status: str):
+        self.mark('done')
+        self.status = status
+
+    def to_dict(self) -> dict:
+        return {'status': self.status, 'events': self.events}
+
+class PushTrace:
+    """Timeline of a traced message on this shard.
+
+    ``spans`` are the push stages (parsed, accepted, enqueued, dispatched,
+    done); each delivery attempt adds its own events, from leaving the lane
+    through DNS, connecting and sending to the receiver's first byte.
+    """
+
+    def __init__(self, message_id: str, parse_ms: float = 0.0):
+        self.message_id = message_id
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.origin = time.perf_counter() - parse_ms / 1000  # When the push request arrived
+        self.spans = [['received', 0.0], ['parsed', round(parse_ms, 3)]]
+        self.deliveries = {}  # webhook_url -> [DeliveryTrace per attempt]
+        self.untraced = 0
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.origin) * 1000, 3)
+
+    def mark(self, stage: str):
+        self.spans.append([stage, self.elapsed_ms()])
+
+    def delivery(self, webhook_url: str):
+        """Start timing a delivery attempt; None once TRACE_MAX_DELIVERIES subscribers are traced."""
+        attempts = self.deliveries.get(webhook_url)
+        if attempts is None:
+            if len(self.deliveries) >= TRACE_MAX_DELIVERIES:
+                self.untraced += 1
+                return None
+            attempts = self.deliveries[webhook_url] = []
+        attempt = DeliveryTrace(self)
+        attempt.mark('start')
+        attempts.append(attempt)
+        return attempt
+
+    def summary(self) -> dict:
+        finished = [
+            (attempts[-1].events[-1][1], webhook_url) for webhook_url, attempts in self.deliveries.items()
+            if attempts[-1].status is not None
+        ]
+        slowest = max(finished, default=None)
+        return {
+            'message_id': self.message_id,
+            'started_at': self.started_at,
+            'duration_ms': self.spans[-1][1] if self.spans[-1][0] == 'done' else None,
+            'deliveries': len(self.deliveries) + self.untraced,
+            'slowest': {'webhook_url': slowest[1], 'ms': slowest[0]} if slowest else None
+        }
+
+    def to_dict(self) -> dict:
+        return dict(
+            self.summary(),
+            spans=self.spans,
+            deliveries={
+                webhook_url: [attempt.to_dict() for attempt in attempts] for webhook_url, attempts in self.deliveries.items()
+            },
+            untraced_deliveries=self.untraced
+        )
+
+def start_trace(message_id: str, parse_ms: float) -> PushTrace:
+    trace = recent_traces[message_id] = PushTrace(message_id, parse_ms)
+    while len(recent_traces) > TRACE_HISTORY:
+        recent_traces.popitem(last=False)
+    return trace
+
+def wants_trace(request, data: dict) -> bool:
+    """Trace a push when the producer asks for it (X-Trace header or ``trace``) or it is sampled."""
+    if request.headers.get('X-Trace', '').lower() in ('1', 'true') or data.get('trace') is True:
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+def trace_hook(event: str):
+    """An aiohttp TraceConfig callback that marks ``event`` on the request's DeliveryTrace, if any."""
+    async def hook(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.mark(event)
+    return hook
+
+profile_lock = threading.Lock()  # One profile at a time
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Sample the Python stack of a thread every ``interval`` seconds; returns stack tuples (root first) -> samples.
+
+    Runs on its own thread, so it observes the event loop without pausing it.
+    """
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+def profile_report(stacks: Counter, seconds: float) -> dict:
+    samples = sum(stacks.values())
+    # A loop waiting for I/O sits in the selector; everything else is work
+    idle = sum(count for stack, count in stacks.items() if stack[-1].co_filename.endswith('selectors.py'))
+    self_counts, total_counts = Counter(), Counter()
+    for stack, count in stacks.items():
+        self_counts[frame_label(stack[-1])] += count
+        for label in {frame_label(code) for code in stack}:
+            total_counts[label] += count
+    
+    def top(counts: Counter) -> list:
+        return [
+            {'function': label, 'samples': count, 'pct': round(100 * count / samples, 1)}
+            for label, count in counts.most_common(PROFILE_TOP)
+        ]
+    
+    return {
+        'seconds': seconds,
+        'interval_ms': PROFILE_INTERVAL * 1000,
+        'samples': samples,
+        'busy_pct': round(100 * (samples - idle) / samples, 1) if samples else 0.0,
+        'top_self': top(self_counts),
+        'top_total': top(total_counts)
+    }
+
+def folded_stacks(stacks: Counter) -> str:
+    """Collapsed-stack text (``root;...;leaf count``) for flamegraph.pl or speedscope."""
+    return ''.join(
+        ';'.join(frame_label(code) for code in stack) + f" {count}\n" for stack, count in stacks.most_common()
+    )
+
+# === FAN-OUT DISPATCHER ===
+
+class WebhookDispatcher:
+    """Bounded-concurrency fan-out engine with a pooled, keep-alive HTTP connector.
+
+    A push is queued on each subscriber's DeliveryLane, and a fixed pool of
+    workers serves lanes that have a request due, so the number of coroutines
+    and sockets does not grow with the subscriber count. A semaphore shared by
+    all deliveries enforces the global in-flight cap. Due lanes are picked by
+    priority (see LaneScheduler), and PRIORITY_RESERVED_WORKERS extra workers
+    only serve high priority, so urgent deliveries start even while every
+    regular worker is stuck on a slow subscriber.
+    """
+
+    def __init__(self, max_concurrency: int, max_connections: int,
+                 max_connections_per_host: int, keepalive_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self._semaphore = None
+        self.ready_lanes = None  # LaneScheduler of DeliveryLanes with a request due
+        self.workers = []
+        self.in_flight = 0
+        self.pushes_total = 0
+        self.deliveries_total = 0
+        self.deliveries_failed = 0
+        self.deliveries_dropped = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self._push_buckets = deque()  # [second, count] pairs within STATS_RATE_WINDOW
+
+    async def get_session(self):
+        """Get or create the pooled HTTP client session."""
+        if self.session is None or self.session.closed:
+            trace_config = TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_created)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+            # Traced deliveries pass their DeliveryTrace as trace_request_ctx
+            for hook_signal, event in ((trace_config.on_connection_queued_start, 'pool_wait'),
+                                       (trace_config.on_connection_queued_end, 'pool_acquired'),
+                                       (trace_config.on_connection_create_start, 'connect_start'),
+                                       (trace_config.on_dns_resolvehost_start, 'dns_start'),
+                                       (trace_config.on_dns_resolvehost_end, 'dns_end'),
+                                       (trace_config.on_connection_create_end, 'connected'),
+                                       (trace_config.on_connection_reuseconn, 'connection_reused'),
+                                       (trace_config.on_request_headers_sent, 'request_sent'),
+                                       (trace_config.on_request_end, 'first_byte'),
+                                       (trace_config.on_request_exception, 'error')):
+                hook_signal.append(trace_hook(event))
+            connector = TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self.session = ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(total=WEBHOOK_TIMEOUT),
+                trace_configs=[trace_config]
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency + PRIORITY_RESERVED_WORKERS)
+        if not self.workers:
+            self.ready_lanes = LaneScheduler()
+            self.workers = [asyncio.create_task(self._serve_lanes()) for _ in range(self.max_concurrency)]
+            self.workers += [asyncio.create_task(self._serve_lanes(urgent_only=True))
+                             for _ in range(PRIORITY_RESERVED_WORKERS)]
+        return self.session
+
+    async def _serve_lanes(self, urgent_only: bool = False):
+        while True:
+            lane = await self.ready_lanes.get(urgent_only)
+            await lane.serve()
+
+    async def close(self):
+        """Stop the lane workers, close the pooled session and release all sockets."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        for lane in lanes.values():
+            # Undelivered messages stay pending in the outbox and resume on restart; waiting pushes get that answer now
+            lane.close('pending')
+        lanes.clear()
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def deliver_one(self, webhook_url: str, payload: EncodedPayload, compression: str = None) -> str:
+        """Deliver to a single URL through its circuit breaker.
+
+        Returns ``delivered``, ``failed`` or ``circuit_open`` (skipped without a request).
+        """
+        trace = payload.trace.delivery(webhook_url) if payload.trace else None
+        breaker = get_breaker(webhook_url)
+        if not breaker.allow():
+            deliveries_metric.inc(('circuit_open',))
+            if trace:
+                trace.finish('circuit_open')
+            return 'circuit_open'
+        body, content_encoding = payload.for_encoding(compression)
+        session = await self.get_session()
+        async with self._semaphore:
+            if trace:
+                trace.mark('slot_acquired')
+            self.in_flight += 1
+            try:
+                ok = await send_webhook(session, webhook_url, body, content_encoding, trace)
+            finally:
+                self.in_flight -= 1
+        self.deliveries_total += 1
+        if not ok:
+            self.deliveries_failed += 1
+        record_delivery_outcome(webhook_url, ok)
+        status = 'delivered' if ok else 'failed'
+        deliveries_metric.inc((status,))
+        if trace:
+            trace.finish(status)
+        return status
+
+    def deliver_stream(self, subscriber: Subscriber, payload: EncodedPayload) -> str:
+        """Queue a payload on a streaming subscriber's connection without waiting for the client."""
+        ok = subscriber.channel.send(payload)
+        subscriber.record_delivery(ok)
+        self.deliveries_total += 1
+        if not ok:
+            self.deliveries_failed += 1
+        status = 'delivered' if ok else 'failed'
+        deliveries_metric.inc((status,))
+        return status
+
+    async def dispatch(self, subscribers: list, payload: EncodedPayload, on_result=None) -> Fanout:
+        """Queue a payload for every subscriber; await the returned Fanout's ``done`` for the results.
+
+        ``on_result(webhook_url, status)`` is called as each delivery finishes.
+        Never waits for a subscriber: full ``buffer`` lanes hold the payload
+        back themselves. Streaming subscribers have it queued on their
+        connection right away.
+        """
+        await self.get_session()
+        fanout = Fanout([subscriber.url for subscriber in subscribers], on_result)
+        for index, subscriber in enumerate(subscribers):
+            if subscriber.channel is not None:
+                fanout.complete(index, self.deliver_stream(subscriber, payload))
+            else:
+                get_lane(subscriber).submit((payload, fanout, index))
+        self._record_push()
+        return fanout
+
+    def _record_push(self):
+        now = int(time.monotonic())
+        if self._push_buckets and self._push_buckets[-1][0] == now:
+            self._push_buckets[-1][1] += 1
+        else:
+            self._push_buckets.append([now, 1])
+        while self._push_buckets and self._push_buckets[0][0] <= now - STATS_RATE_WINDOW:
+            self._push_buckets.popleft()
+        self.pushes_total += 1
+
+    async def _on_connection_created(self, session, context, params):
+        self.connections_created += 1
+
+    async def _on_connection_reused(self, session, context, params):
+        self.connections_reused += 1
+
+    def pushes_per_second(self) -> float:
+        cutoff = int(time.monotonic()) - STATS_RATE_WINDOW
+        return sum(count for second, count in self._push_buckets if second > cutoff) / STATS_RATE_WINDOW
+
+    def open_sockets(self) -> dict:
+        """Count sockets currently held by the connector pool."""
+        connector = self.session.connector if self.session and not self.session.closed else None
+        if connector is None:
+            return {'active': 0, 'idle': 0}
+        # aiohttp does not expose pool sizes publicly; fall back to 0 if internals change
+        active = len(getattr(connector, '_acquired', ()))
+        idle = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+        return {'active': active, 'idle': idle}
+
+    def stats(self) -> dict:
+        return {
+            'pushes_total': self.pushes_total,
+            'pushes_per_second': round(self.pushes_per_second(), 3),
+            'deliveries_total': self.deliveries_total,
+            'deliveries_failed': self.deliveries_failed,
+            'deliveries_dropped': self.deliveries_dropped,
+            'in_flight': self.in_flight,
+            'queued': sum(lane.depth for lane in lanes.values()),
+            'active_lanes': len(lanes),
+            'ready_lanes': self.ready_lanes.stats() if self.ready_lanes else None,
+            'open_sockets': self.open_sockets(),
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'retries_pending': len(retry_tasks),
+            'open_circuits': sum(1 for breaker in circuit_breakers.values() if breaker.state != 'closed'),
+            'limits': {
+                'max_concurrency': self.max_concurrency,
+                'priority_reserved_workers': PRIORITY_RESERVED_WORKERS,
+                'priority_weights': dict(zip(PRIORITIES, PRIORITY_WEIGHTS)),
+                'max_connections': self.max_connections,
+                'max_connections_per_host': self.max_connections_per_host,
+                'keepalive_timeout': self.keepalive_timeout
+            }
+        }
+
+dispatcher = WebhookDispatcher(
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_MAX_CONNECTIONS_PER_HOST,
+    WEBHOOK_KEEPALIVE_TIMEOUT
+)
+
+# === DURABLE OUTBOX ===
+
+class Outbox:
+    """SQLite outbox recording each message before fan-out and its per-subscriber delivery state.
+
+    All writes go through one writer thread that drains the op queue and commits
+    everything it found in a single transaction (group commit), so the cost of
+    a commit is shared by every push that arrived while the previous one ran.
+    """
+
+    MESSAGE_COLUMNS = (
+        ('seq', 'INTEGER NOT NULL DEFAULT 0'),
+        ('topic', 'TEXT'),
+        ('attributes', 'TEXT'),
+        ('priority', 'TEXT'),
+        ('blob', 'TEXT')
+    )
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            created REAL NOT NULL,
+            seq INTEGER NOT NULL DEFAULT 0,
+            topic TEXT,
+            attributes TEXT,
+            priority TEXT,
+            blob TEXT
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deliveries (
+            message_id TEXT NOT NULL,
+            webhook_url TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (message_id, webhook_url)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS deliveries_pending ON deliveries (state, message_id);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = None
+        self.ops = queue.SimpleQueue()
+        self.thread = None
+        self.writes = 0
+        self.commits = 0
+
+    def open(self) -> list:
+        """Open the database and return MessageRecords that still have pending deliveries."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={OUTBOX_SYNCHRONOUS}")
+        self.conn.executescript(self.SCHEMA)
+        # Add columns introduced after the outbox was first created
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(messages)")]
+        for column, definition in self.MESSAGE_COLUMNS:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {definition}")
+        
+        unfinished = {}
+        rows = self.conn.execute("""
+            SELECT m.id, m.message, m.timestamp, m.seq, m.topic, m.attributes, m.priority, m.blob, d.webhook_url, d.state
+            FROM messages m JOIN deliveries d ON d.message_id = m.id
+            WHERE m.id IN (SELECT message_id FROM deliveries WHERE state = 'pending')
+            ORDER BY m.seq
+        """)
+        for message_id, message, timestamp, seq, topic, attributes, priority, blob, webhook_url, state in rows:
+            if message_id not in unfinished:
+                record = self._record(message_id, message, timestamp, seq, topic, attributes, priority, blob)
+                unfinished[message_id] = record
+            unfinished[message_id].deliveries[webhook_url] = state
+        
+        self.thread = threading.Thread(target=self._run, name="outbox-writer", daemon=True)
+        self.thread.start()
+        return list(unfinished.values())
+
+    def last_seq(self) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_seq'").fetchone()
+        return row[0] if row else 0
+
+    def recent_messages(self, limit: int) -> list:
+        """Return the newest stored messages as MessageRecords, oldest first."""
+        rows = self.conn.execute(
+            "SELECT id, message, timestamp, seq, topic, attributes, priority, blob FROM messages ORDER BY seq DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [self._record(*row) for row in reversed(rows)]
+
+    @staticmethod
+    def _record(message_id, message, timestamp, seq, topic, attributes, priority, blob) -> 'MessageRecord':
+        # Stored blobs keep only their reference here; the message column is empty
+        return MessageRecord(None if blob else message, message_id, timestamp, seq, topic,
+                             json.loads(attributes or 'null'), priority or DEFAULT_PRIORITY, json.loads(blob or 'null'))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.ops.get()]
+            if OUTBOX_GROUP_COMMIT_MS:
+                time.sleep(OUTBOX_GROUP_COMMIT_MS / 1000)
+            while len(batch) < OUTBOX_MAX_BATCH:
+                try:
+                    batch.append(self.ops.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [op for op in batch if op is not None]
+            if not batch:
+                continue
+            
+            error = None
+            try:
+                self.conn.execute("BEGIN")
+                for write, _, _ in batch:
+                    write(self.conn)
+                self.conn.execute("COMMIT")
+                self.commits += 1
+                self.writes += len(batch)
+            except Exception as e:
+                error = e
+                logger.error(f"Outbox commit failed: {e}")
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+            
+            for _, future, loop in batch:
+                if future is not None:
+                    loop.call_soon_threadsafe(self._resolve, future, error)
+        self.conn.close()
+
+    @staticmethod
+    def _resolve(future, error):
+        if future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def _submit(self, write, wait: bool):
+        if not wait:
+            self.ops.put((write, None, None))
+            return None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.ops.put((write, future, loop))
+        return future
+
+    async def store(self, records: list):
+        """Durably record messages and their target subscribers; returns once committed."""
+        message_rows = [
+            (r.id, r.message if r.blob is None else '', r.timestamp, time.time(), r.seq, r.topic,
+             json.dumps(r.attributes) if r.attributes else None,
+             r.priority if r.priority != DEFAULT_PRIORITY else None,
+             json.dumps(r.blob) if r.blob else None)
+            for r in records
+        ]
+        delivery_rows = [(r.id, url, state) for r in records for url, state in r.deliveries.items()]
+        last_seq = max(r.seq for r in records)
+        
+        def write(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, message, timestamp, created, seq, topic, attributes, priority, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                message_rows
+            )
+            conn.executemany("INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?)", delivery_rows)
+            conn.execute(
+                "INSERT INTO meta VALUES ('last_seq', ?) ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (last_seq,)
+            )
+        await self._submit(write, wait=True)
+
+    def record_delivery(self, message_id: str, webhook_url: str, state: str):
+        """Persist a final delivery state; batched into the next group commit."""
+        self._submit(lambda conn: conn.execute(
+            "UPDATE deliveries SET state = ? WHERE message_id = ? AND webhook_url = ?",
+            (state, message_id, webhook_url)
+        ), wait=False)
+
+    async def prune(self, older_than: float):
+        """Drop messages with no pending deliveries that were created before the cutoff."""
+        def write(conn):
+            finished = """
+                SELECT id FROM messages WHERE created < ?
+                AND id NOT IN (SELECT message_id FROM deliveries WHERE state = 'pending')
+            """
+            conn.execute(f"DELETE FROM deliveries WHERE message_id IN ({finished})", (older_than,))
+            conn.execute(f"DELETE FROM messages WHERE id IN ({finished})", (older_than,))
+        await self._submit(write, wait=True)
+
+    async def close(self):
+        if self.thread is None:
+            return
+        self.ops.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+        self.thread = None
+
+    def stats(self) -> dict:
+        return {
+            'writes': self.writes,
+            'commits': self.commits,
+            'writes_per_commit': round(self.writes / self.commits, 2) if self.commits else 0,
+            'queued_writes': self.ops.qsize()
+        }
+
+outbox = Outbox(os.path.join(STATE_DIR, 'outbox.sqlite3')) if OUTBOX_ENABLED else None
+
+async def outbox_pruner():
+    """Periodically remove finished messages older than the retention period."""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await outbox.prune(time.time() - OUTBOX_RETENTION)
+        except Exception as e:
+            logger.error(f"Outbox prune failed: {e}")
+
+async def resume_outbox(unfinished: list):
+    """Queue messages that were accepted but not fully delivered before the last shutdown."""
+    for record in unfinished:
+        await push_queue.put(remember_record(record))
+    logger.info(f"Resumed {len(unfinished)} unfinished messages from the outbox")
+
+# === REPLAY BUFFER ===
+
+class ReplayBuffer:
+    """Recent message payloads ordered by sequence number, capped by count and encoded bytes."""
+
+    def __init__(self, max_messages: int, max_bytes: int):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.entries = deque()  # (seq, payload, size)
+        self.bytes = 0
+
+    def append(self, seq: int, payload: dict, size: int = None):
+        if size is None:
+            size = len(encode_json(payload))
+        if self.entries and seq < self.entries[-1][0]:
+            # With several workers, concurrent pushes can be accepted slightly out of sequence order
+            self.entries.insert(bisect_right(self.entries, seq, key=lambda entry: entry[0]), (seq, payload, size))
+        else:
+            self.entries.append((seq, payload, size))
+        self.bytes += size
+        while self.entries and (len(self.entries) > self.max_messages or self.bytes > self.max_bytes):
+            self.bytes -= self.entries.popleft()[2]
+
+    def since(self, seq: int, limit: int, subscriber: Subscriber = None) -> list:
+        """Return up to ``limit`` payloads with a sequence number greater than ``seq``.
+
+        With a subscriber, only payloads routed to it are returned.
+        """
+        start = bisect_right(self.entries, seq, key=lambda entry: entry[0])
+        payloads = []
+        for i in range(start, len(self.entries)):
+            payload = self.entries[i][1]
+            if subscriber is None or subscriber.matches(payload.get('topic'), payload.get('attributes')):
+                payloads.append(payload)
+                if len(payloads) >= limit:
+                    break
+        return payloads
+
+    @property
+    def oldest_seq(self):
+        return self.entries[0][0] if self.entries else None
+
+    def stats(self) -> dict:
+        return {
+            'messages': len(self.entries),
+            'bytes': self.bytes,
+            'oldest_seq': self.oldest_seq,
+            'latest_seq': last_seq,
+            'max_messages': self.max_messages,
+            'max_bytes': self.max_bytes
+        }
+
+replay_buffer = ReplayBuffer(REPLAY_MAX_MESSAGES, REPLAY_MAX_BYTES)
+last_seq = 0  # Sequence number of the most recently accepted message
+
+def next_seq() -> int:
+    global last_seq
+    last_seq += 1
+    return last_seq
+
+def reserve_seqs(count: int) -> int:
+    """Take ``count`` consecutive sequence numbers; returns the first."""
+    global last_seq
+    last_seq += count
+    return last_seq - count + 1
+
+def catch_up(since: int, limit: int = REPLAY_PAGE_LIMIT, subscriber: Subscriber = None) -> dict:
+    """Build a catch-up response for a subscriber that last saw message ``since``."""
+    messages = replay_buffer.since(since, limit, subscriber)
+    oldest = replay_buffer.oldest_seq
+    return {
+        'messages': messages,
+        'count': len(messages),
+        'next_since': messages[-1]['seq'] if messages else since,
+        'latest_seq': last_seq,
+        'oldest_seq': oldest,
+        # Messages between `since` and the oldest buffered one were evicted and can't be replayed
+        'truncated': oldest is not None and since < oldest - 1,
+        # A short page means the buffer was exhausted (filtered pages can end before last_seq)
+        'has_more': len(messages) >= limit and messages[-1]['seq'] < last_seq
+    }
+
+def restore_replay_state():
+    """Continue sequence numbers after a restart and refill the buffer from the outbox."""
+    global last_seq
+    if outbox is None:
+        return
+    last_seq = max(last_seq, outbox.last_seq())
+    for record in outbox.recent_messages(REPLAY_MAX_MESSAGES):
+        replay_buffer.append(record.seq, record.payload())
+
+# === MESSAGE TRACKING ===
+
+class MessageRecord:
+    """Delivery state of one pushed message, per subscriber."""
+
+    def __init__(self, message: str, message_id: str = None, timestamp: str = None, seq: int = None,
+                 topic: str = None, attributes: dict = None, priority: str = DEFAULT_PRIORITY, blob: dict = None):
+        self.id = message_id or uuid.uuid4().hex
+        self.seq = seq if seq is not None else next_seq()
+        self.message = message  # None when the body is in the blob store
+        self.blob = blob  # {'hash', 'size', 'content_type'} of a message stored as a blob
+        self.topic = topic
+        self.attributes = attributes
+        self.priority = priority
+        self.timestamp = timestamp or datetime.now(timezone.utc).isoformat()
+        self.state = 'queued'  # queued -> in_progress -> completed
+        self.completed_at = None
+        self.deliveries = {}  # webhook_url -> pending | delivered | failed | retrying | circuit_open | dropped
+        self.delivery_ms = {}  # webhook_url -> milliseconds from acceptance to the final outcome
+        self.accepted = time.monotonic()
+        self.trace = None  # PushTrace when the push was traced
+        self.unsettled = None  # Deliveries not in a terminal state yet, counted once fan-out starts
+        self.delivered = 0  # Successful deliveries since fan-out started, retries included
+        self._waiters = []  # (delivered count or None, future) of pushes waiting on this record
+        self._encoded = None
+
+    def set_delivery(self, webhook_url: str, status: str):
+        previous = self.deliveries.get(webhook_url)
+        self.deliveries[webhook_url] = status
+        if status in DELIVERY_TERMINAL_STATES:
+            self.delivery_ms[webhook_url] = round((time.monotonic() - self.accepted) * 1000, 1)
+            if outbox:
+                outbox.record_delivery(self.id, webhook_url, status)
+            if self.unsettled is not None and previous not in DELIVERY_TERMINAL_STATES:
+                self.unsettled -= 1
+                if status == 'delivered':
+                    self.delivered += 1
+                self._progress()
+
+    def start_fanout(self):
+        """Count the deliveries left to settle; the record completes once each is final, retries included."""
+        self.state = 'in_progress'
+        self.unsettled = sum(1 for status in self.deliveries.values() if status not in DELIVERY_TERMINAL_STATES)
+        self._progress()
+
+    def wait(self, delivered: int = None) -> asyncio.Future:
+        """A future resolved once ``delivered`` deliveries succeeded (if given) or every delivery settled."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((delivered, future))
+        self._progress()
+        return future
+
+    def _progress(self):
+        settled = self.unsettled == 0
+        if settled and self.state != 'completed':
+            self.state = 'completed'
+            self.completed_at = datetime.now(timezone.utc).isoformat()
+            if self.trace:
+                self.trace.mark('done')
+        if not self._waiters:
+            return
+        waiting = []
+        for delivered, future in self._waiters:
+            if settled or (delivered is not None and self.delivered >= delivered):
+                if not future.done():
+                    future.set_result(None)
+            else:
+                waiting.append((delivered, future))
+        self._waiters = waiting
+
+    def payload(self) -> dict:
+        """The JSON body delivered to webhooks; a claim check for messages stored as blobs."""
+        payload = {
+            "message": self.message,
+            "timestamp": self.timestamp,
+            "message_id": self.id,
+            "seq": self.seq
+        }
+        if self.blob is not None:
+            payload["blob"] = dict(self.blob, url=blob_url(self.blob['hash']))
+        if self.topic is not None:
+            payload["topic"] = self.topic
+        if self.attributes:
+            payload["attributes"] = self.attributes
+        if self.priority != DEFAULT_PRIORITY:
+            payload["priority"] = self.priority
+        return payload
+
+    def encoded(self) -> EncodedPayload:
+        """The payload encoded once, kept until the record's fan-out finishes."""
+        if self._encoded is None:
+            self._encoded = EncodedPayload(self.payload())
+            self._encoded.trace = self.trace
+            self._encoded.priority = PRIORITIES.index(self.priority)
+            self._encoded.blob = self.blob
+        return self._encoded
+
+    def to_dict(self) -> dict:
+        counts = Counter(self.deliveries.values())
+        return {
+            'message_id': self.id,
+            'seq': self.seq,
+            'topic': self.topic,
+            'priority': self.priority,
+            'message': self.message,
+            'blob': self.blob,
+            'timestamp': self.timestamp,
+            'state': self.state,
+            'completed_at': self.completed_at,
+            'summary': {
+                'total': len(self.deliveries),
+                'delivered': counts['delivered'],
+                'failed': counts['failed'],
+                'pending': counts['pending'],
+                'retrying': counts['retrying'],
+                'circuit_open': counts['circuit_open'],
+                'dropped': counts['dropped']
+            },
+            'deliveries': self.deliveries,
+            'delivery_ms': self.delivery_ms
+        }
+
+def remember_record(record: MessageRecord) -> MessageRecord:
+    """Keep a delivery record for status lookups, evicting the oldest beyond the history limit."""
+    message_records[record.id] = record
+    while len(message_records) > MESSAGE_HISTORY_LIMIT:
+        message_records.popitem(last=False)
+    return record
+
+def create_message_record(message: str, topic: str = None, attributes: dict = None, priority: str = DEFAULT_PRIORITY,
+                          message_id: str = None, timestamp: str = None, seq: int = None, trace: dict = None,
+                          blob: dict = None) -> MessageRecord:
+    """Create a delivery record targeting every subscriber the message is routed to.
+
+    ``message_id``/``timestamp``/``seq`` are set by the shard that accepted a
+    push (the sequence number comes from shard 0), so every shard delivers the
+    message under the same identity and catch-up cursor. ``trace`` (with
+    the request's ``parse_ms``) starts a PushTrace for the message. A ``blob``
+    reference replaces ``message`` for bodies kept in the blob store; the
+    replay buffer then holds only the claim check.
+    """
+    global last_seq
+    if seq is not None:
+        last_seq = max(last_seq, seq)
+    record = remember_record(MessageRecord(message, message_id, timestamp, seq, topic=topic, attributes=attributes,
+                                           priority=priority, blob=blob))
+    if trace is not None:
+        record.trace = start_trace(record.id, trace.get('parse_ms', 0.0))
+    record.deliveries = dict.fromkeys(route_message(topic, attributes), 'pending')
+    encoded = record.encoded()
+    replay_buffer.append(record.seq, encoded.payload, len(encoded.body))
+    return record
+
+def parse_message_spec(data, defaults: dict = None) -> dict:
+    """Validate one pushed message (a string or an object) into create_message_record arguments."""
+    spec = dict(defaults or {})
+    if isinstance(data, str):
+        data = {'message': data}
+    if not isinstance(data, dict):
+        raise ValueError("Every message must be a string or an object")
+    message = data.get('message', '')
+    if not isinstance(message, str) or not message:
+        raise ValueError("Message is required")
+    spec['message'] = message
+    if data.get('topic') is not None:
+        spec['topic'] = validate_topic(data['topic'])
+    if data.get('attributes') is not None:
+        attributes = data['attributes']
+        if not isinstance(attributes, dict) or not all(is_attribute_value(v) for v in attributes.values()):
+            raise ValueError("attributes must be an object of scalar values")
+        spec['attributes'] = attributes
+    if data.get('priority') is not None:
+        spec['priority'] = validate_priority(data['priority'])
+    return spec
+
+def validate_priority(priority) -> str:
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    return priority
+
+async def accept_messages(specs: list) -> list:
+    """Create delivery records and store them in the outbox before any fan-out starts.
+
+    ``specs`` are keyword arguments for create_message_record, as returned by parse_message_spec.
+    """
+    records = [create_message_record(**spec) for spec in specs]
+    if outbox:
+        await outbox.store(records)
+    for record in records:
+        if record.trace:
+            record.trace.mark('accepted')
+    return records
+
+async def push_worker():
+    """Deliver queued messages in the background."""
+    while True:
+        record = await push_queue.get()
+        try:
+            # Only waits until every lane took the message; lanes deliver it on their own
+            await send_to_all_webhooks(record.message, record, wait=False)
+        except Exception as e:
+            logger.error(f"Error delivering message {record.id}: {e}")
+        finally:
+            push_queue.task_done()
+
+def start_push_workers():
+    """Create the push queue and its workers on the running event loop."""
+    global push_queue
+    if push_queue is not None:
+        return
+    push_queue = PushQueue(maxsize=PUSH_QUEUE_SIZE)
+    for _ in range(PUSH_WORKERS):
+        push_worker_tasks.append(asyncio.create_task(push_worker()))
+    logger.info(f"Started {PUSH_WORKERS} background push workers")
+
+async def enqueue_pushes(specs: list, wait: bool = False) -> list:
+    """Accept messages for background delivery.
+
+    Raises asyncio.QueueFull when they don't fit, unless ``wait`` is set, in
+    which case it waits for the push workers to make room.
+    """
+    if push_queue is None:
+        raise RuntimeError("Push workers are not running")
+    if not wait and PUSH_QUEUE_SIZE - push_queue.qsize() < len(specs):
+        raise asyncio.QueueFull()
+    records = await accept_messages(specs)
+    for record in records:
+        await push_queue.put(record)
+        if record.trace:
+            record.trace.mark('enqueued')
+    return records
+
+async def run_on_web_loop(coro):
+    """Await a coroutine on the web server's event loop.
+
+    In the threaded runtime the MCP server runs on a different loop, and the
+    client session, push queue and registry must only be touched from the
+    loop that created them.
+    """
+    loop = asyncio.get_running_loop()
+    if web_loop is None or web_loop is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, web_loop))
+
+# === RETRY SCHEDULER ===
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: half the capped delay plus a random half."""
+    delay = min(WEBHOOK_RETRY_MAX_DELAY, WEBHOOK_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def schedule_retry(webhook_url: str, payload: EncodedPayload, record: MessageRecord, attempt: int) -> bool:
+    """Schedule another delivery attempt in the background; returns False if none is scheduled."""
+    if webhook_url.partition(':')[0] in STREAM_TRANSPORTS:
+        return False  # A dropped stream catches up from the replay buffer when it reconnects
+    if attempt > WEBHOOK_MAX_RETRIES or len(retry_tasks) >= WEBHOOK_MAX_PENDING_RETRIES:
+        return False
+    record.set_delivery(webhook_url, 'retrying')
+    task = asyncio.create_task(retry_delivery(webhook_url, payload, record, attempt))
+    retry_tasks.add(task)
+    task.add_done_callback(retry_tasks.discard)
+    return True
+
+async def retry_delivery(webhook_url: str, payload: EncodedPayload, record: MessageRecord, attempt: int):
+    """Wait out the backoff delay, and the endpoint's open breaker, then try the webhook again."""
+    await asyncio.sleep(max(retry_delay(attempt), get_breaker(webhook_url).retry_in_seconds()))
+    if webhook_url not in registered_webhooks:
+        record.set_delivery(webhook_url, 'failed')
+        return
+    status = await deliver_to_subscriber(webhook_url, payload)
+    if status == 'delivered':
+        logger.info(f"Retry {attempt} delivered message {record.id} to {webhook_url}")
+    if status in RETRYABLE_STATES and schedule_retry(webhook_url, payload, record, attempt + 1):
+        return
+    record.set_delivery(webhook_url, status)
+
+# === IDEMPOTENCY ===
+
+class IdempotencyEntry:
+    __slots__ = ('fingerprint', 'expires', 'result', 'size')
+
+    def __init__(self, fingerprint: str, expires: float, result: asyncio.Future):
+        self.fingerprint = fingerprint  # Hash of the request, so a reused key with a different body is refused
+        self.expires = expires
+        self.result = result  # Future of (http_status, body)
+        self.size = 0
+
+class IdempotencyCache:
+    """Results of recent pushes by Idempotency-Key, kept in LRU order.
+
+    Bounded by key count and by the encoded size of the results, and each
+    entry expires IDEMPOTENCY_TTL seconds after the first request. A retry
+    that arrives while the original push is still running waits for it
+    instead of fanning out again. Failed pushes aren't remembered, so they
+    can be retried under the same key.
+    """
+
+    def __init__(self, max_keys: int, max_bytes: int, ttl: float):
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> IdempotencyEntry, least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.evictions = 0
+
+    async def run(self, key: str, fingerprint: str, produce) -> tuple:
+        """Return (status, body, replayed): the remembered result of ``key``, or that of ``produce()``."""
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires <= now:
+            self._discard(key)
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                self.conflicts += 1
+                idempotency_metric.inc(('conflict',))
+                return 422, {'error': 'Idempotency-Key was already used for a different request'}, False
+            self.hits += 1
+            idempotency_metric.inc(('hit',))
+            self.entries.move_to_end(key)
+            status, body = await asyncio.shield(entry.result)
+            return status, body, True
+        
+        self.misses += 1
+        idempotency_metric.inc(('miss',))
+        entry = self.entries[key] = IdempotencyEntry(fingerprint, now + self.ttl, asyncio.get_running_loop().create_future())
+        result = (503, {'error': 'The original request did not finish, retry'})
+        try:
+            result = await produce()
+        finally:
+            entry.result.set_result(result)
+            if result[0] != 200:
+                self._discard(key, entry)
+            elif self.entries.get(key) is entry:
+                entry.size = len(encode_json(result[1]))
+                self.bytes += entry.size
+                self._evict()
+        return result[0], result[1], False
+
+    def _discard(self, key: str, entry: IdempotencyEntry = None):
+        if entry is None or self.entries.get(key) is entry:
+            self.bytes -= self.entries.pop(key).size
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.entries:
+            key, oldest = next(iter(self.entries.items()))
+            if len(self.entries) <= self.max_keys and self.bytes <= self.max_bytes and oldest.expires > now:
+                break
+            self._discard(key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'keys': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'conflicts': self.conflicts,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_TTL)
+
+def parse_idempotency_key(request, data: dict):
+    """The Idempotency-Key header (or ``idempotency_key`` body field) of a push, None if absent."""
+    key = request.headers.get('Idempotency-Key', data.get('idempotency_key'))
+    if key is None:
+        return None
+    if not isinstance(key, str) or not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be a non-empty string of at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    return key
+
+# === SHARDING ===
+
+class HashRing:
+    """Consistent-hash ring mapping webhook URLs to shards.
+
+    Each shard owns SHARD_VNODES points on the ring, so changing the worker
+    count only moves about 1/N of the subscribers to another shard.
+    """
+
+    def __init__(self, shards, vnodes: int):
+        points = sorted((self._hash(f"shard-{shard}:{vnode}"), shard) for shard in shards for vnode in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def owner(self, key: str) -> int:
+        return self.shards[bisect_right(self.hashes, self._hash(key)) % len(self.shards)]
+
+class ShardCluster:
+    """This process's view of the worker group.
+
+    Operations addressed to the local shard run in-process; others are POSTed
+    to ``/_shard/<operation>`` on the owning worker's Unix socket.
+    """
+
+    def __init__(self, workers: int, index: int):
+        self.workers = workers
+        self.index = index
+        self.ring = HashRing(range(workers), SHARD_VNODES)
+        self.sessions = {}  # shard -> ClientSession over that shard's Unix socket
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def owner(self, webhook_url: str) -> int:
+        return self.ring.owner(webhook_url) if self.enabled else self.index
+
+    def socket_path(self, shard: int) -> str:
+        return os.path.join(SHARD_SOCKET_DIR, f"shard-{shard}.sock")
+
+    def session(self, shard: int) -> ClientSession:
+        session = self.sessions.get(shard)
+        if session is None or session.closed:
+            # No total timeout: a sync push waits for the remote shard's whole fan-out
+            session = self.sessions[shard] = ClientSession(
+                connector=UnixConnector(path=self.socket_path(shard)),
+                timeout=ClientTimeout(total=None)
+            )
+        return session
+
+    async def call(self, shard: int, operation: str, data: dict = None) -> tuple:
+        """Run a shard operation; returns (http_status, response_body)."""
+        if shard == self.index:
+            return await SHARD_OPERATIONS[operation](data or {})
+        try:
+            async with self.session(shard).post(f"http://shard-{shard}/_shard/{operation}", json=data or {}) as response:
+                return response.status, await response.json()
+        except ClientError as e:
+            logger.error(f"Shard {shard} unavailable for {operation}: {e}")
+            return 503, {'error': f'Shard {shard} is unavailable'}
+
+    async def call_all(self, operation: str, data: dict = None) -> list:
+        """Run an operation on every shard concurrently; results are in shard order."""
+        return await asyncio.gather(*(self.call(shard, operation, data) for shard in range(self.workers)))
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+cluster = ShardCluster(WORKERS, SHARD_INDEX)
+shard_processes = {}  # shard -> Popen of workers spawned by shard 0
+
+def first_error(responses: list):
+    """The first non-success (status, body) pair of a call_all, or None."""
+    return next((response for response in responses if response[0] >= 400), None)
+
+async def shard_register(data: dict) -> tuple:
+    try:
+        since = parse_since(data.get('since'))
+        subscriber = register_subscriber(data)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    webhook_url = subscriber.url
+    logger.info(f"Registered webhook: {webhook_url}")
+
+    response = {
+        'status': 'success',
+        'webhook_url': webhook_url,
+        'options': subscriber.options(),
+        'total_webhooks': len(registered_webhooks),
+        'latest_seq': last_seq
+    }
+    if cluster.enabled:
+        response['shard'] = cluster.index
+    if since is not None:
+        # Hand back everything missed while the subscriber was away
+        response['missed'] = catch_up(since, subscriber=subscriber)
+        if not subscriber.claim_check:
+            response['missed']['messages'] = await inline_blobs(response['missed']['messages'])
+    return 200, response
+
+async def shard_unregister(data: dict) -> tuple:
+    webhook_url = data.get('webhook_url', '')
+
+    if not webhook_url:
+        return 400, {'error': 'webhook_url is required'}
+
+    if remove_subscriber(webhook_url):
+        logger.info(f"Unregistered webhook: {webhook_url}")
+        status = 'success'
+    else:
+        status = 'not_found'
+
+    return 200, {
+        'status': status,
+        'webhook_url': webhook_url,
+        'total_webhooks': len(registered_webhooks)
+    }
+
+async def shard_register_bulk(data: dict) -> tuple:
+    """Register many webhooks with one registry flush; returns an error (or None) per item."""
+    errors = []
+    with subscriber_store.deferred_writes() if subscriber_store else nullcontext():
+        for item in data['webhooks']:
+            try:
+                register_subscriber(item)
+                errors.append(None)
+            except ValueError as e:
+                errors.append(str(e))
+    registered = errors.count(None)
+    if registered:
+        logger.info(f"Registered {registered} webhooks in bulk")
+    return 200, {'errors': errors, 'total_webhooks': len(registered_webhooks)}
+
+async def shard_unregister_bulk(data: dict) -> tuple:
+    with subscriber_store.deferred_writes() if subscriber_store else nullcontext():
+        removed = sum(1 for webhook_url in data['webhook_urls'] if remove_subscriber(webhook_url))
+    if removed:
+        logger.info(f"Unregistered {removed} webhooks in bulk")
+    return 200, {'removed': removed, 'total_webhooks': len(registered_webhooks)}
+
+async def shard_push(data: dict) -> tuple:
+    """Accept validated message specs and deliver them to this shard's subscribers."""
+    specs = data['messages']
+    if data['mode'] == 'async':
+        try:
+            records = await enqueue_pushes(specs, data.get('wait', False))
+        except asyncio.QueueFull:
+            return 503, {'error': 'Push queue is full, retry later'}
+        success_counts = [None] * len(records)
+    else:
+        records = await accept_messages(specs)
+        deadline_ms, quorum = data.get('deadline_ms'), data.get('quorum')
+        # Push all messages concurrently so coalescing subscribers receive them together
+        success_counts = await asyncio.gather(*(
+            send_to_all_webhooks(record.message, record, deadline_ms=deadline_ms, quorum=quorum) for record in records
+        ))
+    results = [
+        {
+            'message_id': record.id,
+            'timestamp': record.timestamp,
+            'topic': record.topic,
+            'webhooks_notified': success_count,
+            'matched_webhooks': len(record.deliveries)
+        }
+        for record, success_count in zip(records, success_counts)
+    ]
+    if data.get('deadline_ms') is not None or data.get('quorum') is not None:
+        # Who had confirmed when the wait ended; the others are still being delivered
+        for result, record in zip(results, records):
+            result['confirmed_webhooks'] = [
+                webhook_url for webhook_url, state in record.deliveries.items() if state == 'delivered'
+            ]
+            result['complete'] = record.state == 'completed'
+    return 200, {'results': results, 'total_webhooks': len(registered_webhooks)}
+
+async def shard_webhooks(data: dict) -> tuple:
+    page, next_cursor = webhook_page(data.get('cursor'), data.get('limit', 100))
+    subscribers = [registered_webhooks[webhook_url] for webhook_url in page]
+    return 200, {
+        'webhooks': page,
+        'total': len(registered_webhooks),
+        'next_cursor': next_cursor,
+        'options': {subscriber.url: options for subscriber in subscribers if (options := subscriber.options())},
+        'stats': {subscriber.url: subscriber.stats() for subscriber in subscribers},
+        'topics': {topic: len(topic_subscribers) for topic, topic_subscribers in topic_index.items()},
+        'circuit_breakers': {
+            webhook_url: circuit_breakers[webhook_url].to_dict()
+            for webhook_url in page if webhook_url in circuit_breakers
+        }
+    }
+
+async def shard_publish_once(data: dict) -> tuple:
+    status, body, replayed = await idempotency_cache.run(
+        data['key'], data['fingerprint'],
+        lambda: publish(data['messages'], data['mode'], deadline_ms=data.get('deadline_ms'), quorum=data.get('quorum'))
+    )
+    return status, dict(body, replayed=True) if replayed else body
+
+async def shard_traces(data: dict) -> tuple:
+    message_id = data.get('message_id')
+    if message_id:
+        trace = recent_traces.get(message_id)
+        if trace is None:
+            return 404, {'error': 'No trace for this message_id'}
+        return 200, trace.to_dict()
+    return 200, {'traces': [trace.summary() for trace in reversed(recent_traces.values())]}
+
+async def shard_stats(data: dict) -> tuple:
+    return 200, {
+        'dispatcher': dispatcher.stats(),
+        'outbox': outbox.stats() if outbox else None,
+        'replay_buffer': replay_buffer.stats(),
+        'total_topics': len(topic_index),
+        'total_webhooks': len(registered_webhooks),
+        'stream_subscribers': len(stream_subscribers),
+        'active_streams': len(active_streams),
+        'idempotency': idempotency_cache.stats(),
+        'blobs': blob_store.stats(),
+        'startup_ms': startup_ms
+    }
+
+async def shard_dashboard(data: dict) -> tuple:
+    changes, complete = registry_changes.since(data.get('since', 0))
+    return 200, {
+        'seq': registry_changes.seq,
+        'changes': changes,
+        'complete': complete,
+        'counters': {
+            'total_webhooks': len(registered_webhooks),
+            'pushes_total': dispatcher.pushes_total,
+            'deliveries_total': dispatcher.deliveries_total,
+            'deliveries_failed': dispatcher.deliveries_failed,
+            'deliveries_dropped': dispatcher.deliveries_dropped,
+            'in_flight': dispatcher.in_flight,
+            'queued': sum(lane.depth for lane in lanes.values()),
+            'open_circuits': sum(1 for breaker in circuit_breakers.values() if breaker.state != 'closed')
+        }
+    }
+
+async def shard_queues(data: dict) -> tuple:
+    webhook_url = data.get('webhook_url')
+    if webhook_url:
+        if webhook_url not in registered_webhooks:
+            return 404, {'error': 'Unknown webhook_url'}
+        lane = lanes.get(webhook_url)
+        return 200, {'lanes': {webhook_url: lane.to_dict() if lane else {'depth': 0, 'in_flight': False}}}
+    # Deepest first; idle subscribers have no lane and aren't listed
+    deepest = sorted(lanes.values(), key=lambda lane: lane.depth, reverse=True)[:data.get('limit', 100)]
+    return 200, {
+        'lanes': {lane.subscriber.url: lane.to_dict() for lane in deepest},
+        'active_lanes': len(lanes),
+        'queued': sum(lane.depth for lane in lanes.values())
+    }
+
+async def shard_metrics(data: dict) -> tuple:
+    return 200, {'families': metric_families()}
+
+async def shard_message_status(data: dict) -> tuple:
+    record = message_records.get(data.get('message_id'))
+    if record is None:
+        return 404, {'error': 'Unknown message_id'}
+    return 200, record.to_dict()
+
+async def shard_catch_up(data: dict) -> tuple:
+    try:
+        since = parse_since(data.get('since', '0')) or 0
+        limit = int(data.get('limit') or REPLAY_PAGE_LIMIT)
+        # Optional topics narrow the replay like a topic subscription would
+        topics = tuple(validate_topic(topic) for topic in data.get('topics', []))
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    subscriber = Subscriber('', topics=topics) if topics else None
+    return 200, catch_up(since, max(1, min(limit, REPLAY_PAGE_LIMIT)), subscriber)
+
+async def shard_counts(data: dict) -> tuple:
+    return 200, {'total_webhooks': len(registered_webhooks), 'latest_seq': last_seq}
+
+async def shard_sequence(data: dict) -> tuple:
+    """Shard 0 numbers every message, so all shards buffer and deliver it under the same ``seq``."""
+    return 200, {'first': reserve_seqs(data['count'])}
+
+SHARD_OPERATIONS = {
+    'register': shard_register,
+    'unregister': shard_unregister,
+    'register_bulk': shard_register_bulk,
+    'unregister_bulk': shard_unregister_bulk,
+    'push': shard_push,
+    'publish_once': shard_publish_once,
+    'traces': shard_traces,
+    'webhooks': shard_webhooks,
+    'stats': shard_stats,
+    'metrics': shard_metrics,
+    'queues': shard_queues,
+    'dashboard': shard_dashboard,
+    'message_status': shard_message_status,
+    'catch_up': shard_catch_up,
+    'counts': shard_counts,
+    'sequence': shard_sequence
+}
+
+async def with_cluster_counts(status: int, response: dict) -> tuple:
+    """Replace the owning shard's own counts in a register/unregister response with cluster-wide ones.
+
+    Each shard only knows its own subscribers, and only shard 0 numbers
+    messages, so ``total_webhooks`` is summed over every shard and
+    ``latest_seq`` is the highest any shard has seen (shard 0's, when it answers).
+    """
+    if status != 200 or not cluster.enabled:
+        return status, response
+    responses = [body for shard_status, body in await cluster.call_all('counts') if shard_status == 200]
+    response['total_webhooks'] = sum(body['total_webhooks'] for body in responses)
+    if 'latest_seq' in response:
+        response['latest_seq'] = max([response['latest_seq']] + [body['latest_seq'] for body in responses])
+    return status, response
+
+
+async def publish(specs: list, mode: str, wait: bool = False, deadline_ms: float = None, quorum: float = None) -> tuple:
+    """Deliver messages to the subscribers of every shard.
+
+    Returns (http_status, {'results': [...], 'total_webhooks': N}). With
+    several workers the accepting shard fixes each message's ID and timestamp
+    and takes its sequence number from shard 0, then every shard fans the
+    message out to the subscribers it owns. In async mode ``wait`` blocks on
+    a full push queue instead of failing with 503.
+    Sync pushes with ``deadline_ms``/``quorum`` return early (see
+    send_to_all_webhooks); each shard applies the quorum to its own
+    subscribers, so together they reach it too. Large messages are moved to
+    the blob store first, so only their reference travels to the other shards.
+    """
+    await check_in_large_messages(specs)
+    data = {'messages': specs, 'mode': mode, 'wait': wait}
+    if deadline_ms is not None or quorum is not None:
+        data.update(deadline_ms=deadline_ms, quorum=quorum)
+    if not cluster.enabled:
+        return await shard_push(data)
+    if cluster.index == 0:
+        first_seq = reserve_seqs(len(specs))
+    else:
+        status, body = await cluster.call(0, 'sequence', {'count': len(specs)})
+        if status != 200:
+            return status, body
+        first_seq = body['first']
+    for offset, spec in enumerate(specs):
+        spec['message_id'] = uuid.uuid4().hex
+        spec['timestamp'] = datetime.now(timezone.utc).isoformat()
+        spec['seq'] = first_seq + offset
+    responses = await cluster.call_all('push', data)
+    error = first_error(responses)
+    if error:
+        return error
+    results = responses[0][1]['results']
+    for _, body in responses[1:]:
+        for merged, result in zip(results, body['results']):
+            merged['matched_webhooks'] += result['matched_webhooks']
+            if merged['webhooks_notified'] is not None:
+                merged['webhooks_notified'] += result['webhooks_notified']
+            if 'confirmed_webhooks' in merged:
+                merged['confirmed_webhooks'] += result['confirmed_webhooks']
+                merged['complete'] = merged['complete'] and result['complete']
+    return 200, {'results': results, 'total_webhooks': sum(body['total_webhooks'] for _, body in responses)}
+
+async def publish_once(key, specs: list, mode: str, deadline_ms: float = None, quorum: float = None) -> tuple:
+    """Like publish(), but a key that was already used returns the first push's result instead of delivering again.
+
+    The key's owner shard holds its cache entry, so retries are deduplicated
+    whichever worker they reach. Replayed bodies carry ``replayed: true``.
+    """
+    if key is None:
+        return await publish(specs, mode, deadline_ms=deadline_ms, quorum=quorum)
+    await check_in_large_messages(specs)
+    # Tracing is an observation of this request, not part of what it asks for
+    untraced = [{field: value for field, value in spec.items() if field != 'trace'} for spec in specs]
+    fingerprint = hashlib.sha256(json.dumps([untraced, mode, deadline_ms, quorum], sort_keys=True).encode()).hexdigest()
+    return await cluster.call(cluster.owner(key), 'publish_once', {
+        'key': key, 'fingerprint': fingerprint, 'messages': specs, 'mode': mode,
+        'deadline_ms': deadline_ms, 'quorum': quorum
+    })
+
+async def shard_operation_handler(request):
+    """Internal endpoint other workers use to run an operation on this shard."""
+    operation = SHARD_OPERATIONS.get(request.match_info['operation'])
+    if operation is None:
+        return web.json_response({'error': 'Unknown operation'}, status=404)
+    try:
+        status, body = await operation(await request.json())
+        return web.json_response(body, status=status)
+    except Exception as e:
+        logger.error(f"Error in shard operation {request.match_info['operation']}: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+async def start_shard_listener():
+    """Serve /_shard/* on this worker's Unix socket (never on the public port)."""
+    global shard_runner
+    os.makedirs(SHARD_SOCKET_DIR, exist_ok=True)
+    shard_app = web.Application()
+    shard_app.router.add_post('/_shard/{operation}', shard_operation_handler)
+    shard_runner = web.AppRunner(shard_app, access_log=None)
+    await shard_runner.setup()
+    await web.UnixSite(shard_runner, cluster.socket_path(cluster.index)).start()
+
+async def wait_for_shards(timeout: float = 15):
+    """Wait until every other shard's socket accepts connections, so early pushes reach all subscribers."""
+    deadline = time.monotonic() + timeout
+    for shard in range(cluster.workers):
+        while shard != cluster.index:
+            try:
+                _, writer = await asyncio.open_unix_connection(cluster.socket_path(shard))
+                writer.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    logger.warning(f"Shard {shard} is not up yet, starting without it")
+                    return
+                await asyncio.sleep(0.1)
+
+def spawn_shard_worker(shard: int):
+    env = dict(os.environ, WEBHOOK_WORKERS=str(WORKERS), WEBHOOK_SHARD_INDEX=str(shard))
+    # stdout carries MCP traffic in shard 0, so workers must not inherit it
+    shard_processes[shard] = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--mode', 'http-only', '--port', str(DEFAULT_PORT), '--host', DEFAULT_HOST],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL
+    )
+    logger.info(f"Started shard worker {shard} (pid {shard_processes[shard].pid})")
+
+async def supervise_shard_workers():
+    """Restart spawned workers that exit unexpectedly."""
+    while True:
+        await asyncio.sleep(1)
+        for shard, process in list(shard_processes.items()):
+            if process.poll() is not None:
+                logger.warning(f"Shard worker {shard} exited with code {process.returncode}, restarting")
+                spawn_shard_worker(shard)
+
+def stop_shard_workers():
+    for process in shard_processes.values():
+        process.terminate()
+    for shard, process in shard_processes.items():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Shard worker {shard} did not stop, killing it")
+            process.kill()
+    shard_processes.clear()
+
+async def hand_off_subscribers(entries: dict) -> tuple:
+    """Register {webhook_url: options} on their owning shards.
+
+    Returns (accepted_urls, complete); ``complete`` is False if some owner
+    stayed unreachable, so the caller can keep its copy and try again later.
+    """
+    accepted = set()
+    complete = True
+    items = list(entries.items())
+    for start in range(0, len(items), 100):
+        chunk = items[start:start + 100]
+        for attempt in range(30):
+            responses = await asyncio.gather(*(
+                cluster.call(cluster.owner(url), 'register', {**(options or {}), 'webhook_url': url})
+                for url, options in chunk
+            ))
+            if not any(status == 503 for status, _ in responses):
+                break
+            await asyncio.sleep(1)  # Owners still starting
+        for (url, _), (status, _) in zip(chunk, responses):
+            if status == 200:
+                accepted.add(url)
+            elif status == 503:
+                complete = False
+            else:
+                logger.warning(f"Dropping subscriber {url} during hand-off: HTTP {status}")
+    return accepted, complete
+
+async def rebalance_subscribers():
+    """Move subscribers whose owner changed with the worker count, and adopt retired shards' registries."""
+    if cluster.enabled:
+        await move_foreign_subscribers()
+    if cluster.index == 0:
+        await adopt_retired_shards()
+
+async def move_foreign_subscribers():
+    moving = {
+        webhook_url: subscriber.options()
+        for webhook_url, subscriber in registered_webhooks.items()
+        if subscriber.channel is None and cluster.owner(webhook_url) != cluster.index
+    }
+    if not moving:
+        return
+    accepted, _ = await hand_off_subscribers(moving)
+    for webhook_url in accepted:
+        remove_subscriber(webhook_url)
+    logger.info(f"Moved {len(accepted)}/{len(moving)} subscribers to their owning shards")
+
+async def adopt_retired_shards():
+    if not os.path.isdir(DATA_DIR):
+        return
+    for name in sorted(os.listdir(DATA_DIR)):
+        if not name.startswith('shard-') or not name[6:].isdigit() or int(name[6:]) < cluster.workers:
+            continue
+        # Left behind by a larger worker group: hand its registry to the current shards
+        directory = os.path.join(DATA_DIR, name)
+        entries = SubscriberStore(directory).load()
+        accepted, complete = await hand_off_subscribers(entries)
+        if not complete:
+            logger.warning(f"Could not hand off all subscribers of {name}, retrying on next start")
+            continue
+        os.replace(directory, f"{directory}.retired-{int(time.time())}")
+        logger.info(f"Adopted {len(accepted)}/{len(entries)} subscribers from retired {name}; "
+                    f"its undelivered outbox messages are not resumed")
+
+# === STREAMING INGEST ===
+
+class IngestStream:
+    """Feeds one long-lived producer connection into the fan-out path.
+
+    Parsed messages wait in a bounded buffer that a publisher task drains in
+    batches through publish(). When the buffer is full feed() blocks, the
+    connection stops being read and TCP flow control slows the producer down.
+    """
+
+    def __init__(self, mode: str, defaults: dict, on_event=None):
+        self.mode = mode
+        self.defaults = defaults
+        self.on_event = on_event  # Awaited with acknowledgements and rejections, if set
+        self.buffer = asyncio.Queue(maxsize=STREAM_BUFFER_SIZE)
+        self.received = 0
+        self.accepted = 0
+        self.errors = []  # (line, error) of rejected messages, the first STREAM_MAX_ERRORS
+        self.rejected = 0
+        self.failure = None  # (http_status, error) once publishing failed; the stream stops reading
+        self.publisher = asyncio.create_task(self.run())
+        active_streams.add(self)
+
+    async def feed(self, line) -> bool:
+        """Parse and buffer one NDJSON line; returns False once the stream has failed."""
+        if self.failure:
+            return False
+        line = line.strip()
+        if not line:
+            return True
+        self.received += 1
+        try:
+            spec = parse_message_spec(json.loads(line), self.defaults)
+        except ValueError as e:  # Also covers invalid JSON and UTF-8
+            await self.reject(str(e))
+            return True
+        await self.buffer.put(spec)
+        return True
+
+    async def reject(self, error: str):
+        self.rejected += 1
+        stream_messages_metric.inc(('rejected',))
+        if len(self.errors) < STREAM_MAX_ERRORS:
+            self.errors.append({'line': self.received, 'error': error})
+        if self.on_event:
+            await self.on_event({'type': 'error', 'line': self.received, 'error': error})
+
+    async def run(self):
+        """Publish buffered messages in order until close() queues the end marker."""
+        done = False
+        while not done:
+            batch = [await self.buffer.get()]
+            while len(batch) < STREAM_BATCH_SIZE and not self.buffer.empty():
+                batch.append(self.buffer.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if not batch or self.failure:
+                continue  # After a failure keep draining so feed() never blocks
+            try:
+                status, response = await publish(batch, self.mode, wait=True)
+            except Exception as e:
+                status, response = 500, {'error': str(e)}
+            if status != 200:
+                logger.error(f"Stream ingest stopped after {self.accepted} messages: {response.get('error')}")
+                self.failure = (status, response.get('error'))
+                stream_messages_metric.inc(('failed',), len(batch))
+                continue
+            self.accepted += len(batch)
+            stream_messages_metric.inc(('accepted',), len(batch))
+            if self.on_event:
+                await self.on_event({
+                    'type': 'ack',
+                    'accepted': self.accepted,
+                    'message_ids': [result['message_id'] for result in response['results']]
+                })
+
+    async def close(self) -> dict:
+        """Publish whatever is still buffered and summarize the stream."""
+        try:
+            if not self.publisher.done():
+                await self.buffer.put(None)
+            await self.publisher
+        finally:
+            active_streams.discard(self)
+        summary = {
+            'status': 'error' if self.failure else 'success',
+            'mode': self.mode,
+            'received': self.received,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
+        if self.failure:
+            summary['error'] = self.failure[1]
+        return summary
+
+def parse_stream_options(query) -> tuple:
+    """Read (mode, defaults) for a stream from its query string; ``?topic=``/``?priority=`` apply to every message."""
+    mode = resolve_push_mode(query.get('mode', ''))
+    defaults = {}
+    if query.get('topic'):
+        defaults['topic'] = validate_topic(query['topic'])
+    if query.get('priority'):
+        defaults['priority'] = validate_priority(query['priority'])
+    return mode, defaults
+
+# === LIVE DASHBOARD ===
+
+class ChangeLog:
+    """Recent registry and circuit breaker changes on this shard, numbered in order.
+
+    Readers keep the number of the last change they saw; if it has already
+    fallen out of the window they reload instead of replaying.
+    """
+
+    def __init__(self, size: int):
+        self.seq = 0
+        self.entries = deque(maxlen=size)  # (seq, kind, webhook_url)
+
+    def record(self, kind: str, webhook_url: str):
+        self.seq += 1
+        self.entries.append((self.seq, kind, webhook_url))
+
+    def since(self, seq: int) -> tuple:
+        """Changes after ``seq`` as [kind, webhook_url] pairs, and whether none were lost."""
+        if seq >= self.seq:
+            return [], True
+        complete = bool(self.entries) and self.entries[0][0] <= seq + 1
+        return [[kind, webhook_url] for change_seq, kind, webhook_url in self.entries if change_seq > seq], complete
+
+registry_changes = ChangeLog(DASHBOARD_CHANGE_HISTORY)
+
+class DashboardFeed:
+    """Pushes registry changes and delivery rates to dashboard viewers as Server-Sent Events.
+
+    One ticker per process polls every shard each DASHBOARD_INTERVAL and
+    broadcasts the same encoded events to all viewers, so the cost doesn't
+    grow with the registry or the number of open dashboards. It only runs
+    while someone is watching.
+    """
+
+    def __init__(self):
+        self.viewers = set()  # asyncio.Queue of encoded events per connected dashboard
+        self.task = None
+        self.cursors = {}  # shard -> last change seq seen
+        self.previous = None  # (monotonic time, summed counters) of the last tick
+
+    def subscribe(self) -> asyncio.Queue:
+        viewer = asyncio.Queue(DASHBOARD_VIEWER_QUEUE)
+        self.viewers.add(viewer)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return viewer
 
-# Configure logging to stderr
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stderr
-)
-logger = logging.getLogger("webhook-server")
+    def unsubscribe(self, viewer: asyncio.Queue):
+        self.viewers.discard(viewer)
+
+    def broadcast(self, event: str, data: dict):
+        chunk = b'event: %s\ndata: %s\n\n' % (event.encode(), encode_json(data))
+        for viewer in self.viewers:
+            if viewer.full():
+                # A viewer this far behind can't apply changes incrementally any more
+                while not viewer.empty():
+                    viewer.get_nowait()
+                viewer.put_nowait(b'event: changes\ndata: {"reload":true}\n\n')
+            else:
+                viewer.put_nowait(chunk)
 
-# Initialize MCP server
-mcp = FastMCP("webhook")
+    async def run(self):
+        try:
+            while self.viewers:
+                await self.tick()
+                await asyncio.sleep(DASHBOARD_INTERVAL)
+        except Exception as e:
+            logger.error(f"Dashboard feed failed: {e}")
+        finally:
+            self.previous = None
 
-# Configuration
-DEFAULT_PORT = 8000
-DEFAULT_HOST = "0.0.0.0"
+    async def tick(self):
+        shards = list(range(cluster.workers)) if cluster.enabled else [cluster.index]
+        responses = await asyncio.gather(*(
+            cluster.call(shard, 'dashboard', {'since': self.cursors.get(shard, 0)}) for shard in shards
+        ))
+        changes, reload = [], False
+        totals = Counter()
+        pushes = 0
+        for shard, (status, body) in zip(shards, responses):
+            if status != 200:
+                continue
+            # A fresh feed starts from the current position; the page loads the list itself
+            if shard in self.cursors:
+                changes.extend(body['changes'])
+                reload = reload or not body['complete']
+            self.cursors[shard] = body['seq']
+            totals.update(body['counters'])
+            pushes = max(pushes, body['counters']['pushes_total'])
+        totals['pushes_total'] = pushes  # Every shard counts every push
+        if changes or reload:
+            self.broadcast('changes', {'reload': True} if reload else {'changes': changes})
+        
+        now = time.monotonic()
+        stats = dict(totals)
+        if self.previous:
+            elapsed = max(now - self.previous[0], 1e-6)
+            for counter, rate in (('pushes_total', 'pushes_per_second'), ('deliveries_total', 'deliveries_per_second'),
+                                  ('deliveries_failed', 'failures_per_second')):
+                stats[rate] = round(max(totals[counter] - self.previous[1][counter], 0) / elapsed, 2)
+        self.previous = (now, totals)
+        self.broadcast('stats', stats)
 
-# Global storage for the web server and registered webhooks
-web_app = None
-web_runner = None
-registered_webhooks = set()  # Set of registered webhook URLs
-client_session = None  # HTTP client session for making webhook calls
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for viewer in self.viewers:
+            while not viewer.empty():
+                viewer.get_nowait()
+            viewer.put_nowait(None)
+        self.viewers.clear()
+        self.cursors.clear()
+
+dashboard_feed = DashboardFeed()
 
 # === UTILITY FUNCTIONS ===
 
 async def get_client_session():
     """Get or create HTTP client session."""
-    global client_session
-    if client_session is None or client_session.closed:
-        client_session = ClientSession()
-    return client_session
-
-async def send_to_all_webhooks(message: str):
-    """Send a message to all registered webhooks via HTTP POST."""
-    if not registered_webhooks:
-        logger.warning("No webhooks registered")
-        return 0
-    
-    session = await get_client_session()
-    failed_webhooks = set()
-    success_count = 0
+    return await dispatcher.get_session()
+
+async def send_to_all_webhooks(message: str, record: MessageRecord = None, wait: bool = True,
+                               deadline_ms: float = None, quorum: float = None):
+    """Send a message to all registered webhooks via HTTP POST.
+
+    Delivers to the record's still-pending targets, so a record resumed from
+    the outbox skips subscribers that already received it. Returns the number
+    of successful first attempts, or None without ``wait``. Either way the
+    record only completes once every delivery is final, background retries
+    included.
+
+    With ``deadline_ms`` and/or ``quorum`` (a fraction of the targets) the
+    wait ends as soon as that many deliveries succeeded, retries included,
+    the deadline passed or every delivery is final; the rest keep going in
+    the background and the count covers the deliveries confirmed so far.
+    """
+    if record is None:
+        record = (await accept_messages([{'message': message}]))[0]
     
-    timestamp = datetime.now(timezone.utc).isoformat()
-    payload = {
-        "message": message,
-        "timestamp": timestamp
-    }
+    subscribers = []
+    for webhook_url, state in list(record.deliveries.items()):
+        if state != 'pending':
+            continue
+        subscriber = registered_webhooks.get(webhook_url)
+        if subscriber is None:
+            record.set_delivery(webhook_url, 'failed')  # Unregistered since the message was accepted
+        else:
+            subscribers.append(subscriber)
+    record.start_fanout()
     
-    # Send to all webhooks in parallel
-    tasks = []
-    for webhook_url in registered_webhooks:
-        tasks.append(send_webhook(session, webhook_url, payload))
+    if not subscribers:
+        if not registered_webhooks:
+            logger.warning("No webhooks registered")
+        elif record.topic is not None:
+            logger.info(f"No webhooks subscribed to topic '{record.topic}'")
+        else:
+            logger.info("No webhooks registered without topics for a message without one")
+        record._encoded = None
+        return 0
     
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    payload = record.encoded()
     
-    for webhook_url, result in zip(list(registered_webhooks), results):
-        if isinstance(result, Exception):
-            logger.error(f"Failed to send to webhook {webhook_url}: {result}")
-            failed_webhooks.add(webhook_url)
-        elif result:
-            success_count += 1
-            logger.info(f"Successfully sent to webhook: {webhook_url}")
-        else:
-            logger.error(f"Failed to send to webhook: {webhook_url}")
-            failed_webhooks.add(webhook_url)
+    def on_result(webhook_url: str, status: str):
+        # Failed or skipped first attempts are retried in the background; a plain sync push doesn't wait for them
+        if status in RETRYABLE_STATES and schedule_retry(webhook_url, payload, record, 1):
+            return
+        record.set_delivery(webhook_url, status)
     
-    # Remove failed webhooks after multiple failures (optional)
-    # For now, we keep them all
+    def on_done(future):
+        results = future.result()
+        fanout_metric.observe(time.perf_counter() - started)
+        skipped = results.count('circuit_open')
+        if skipped:
+            logger.info(f"Skipped {skipped} webhooks with open circuit breakers")
+        dropped = results.count('dropped')
+        if dropped:
+            logger.info(f"Dropped message {record.id} for {dropped} webhooks with full queues")
+        logger.info(f"Sent to {results.count('delivered')}/{len(subscribers)} webhooks")
     
-    logger.info(f"Sent to {success_count}/{len(registered_webhooks)} webhooks")
-    return success_count
+    started = time.perf_counter()
+    fanout = await dispatcher.dispatch(subscribers, payload, on_result=on_result)
+    if record.trace:
+        record.trace.mark('dispatched')
+    fanout.done.add_done_callback(on_done)
+    pushes_metric.inc()
+    record._encoded = None  # Queued deliveries and pending retries keep their own reference
+    if not wait:
+        return None
+    if deadline_ms is None and quorum is None:
+        # Shielded so a caller that gives up doesn't cancel the fan-out's own bookkeeping
+        results = await asyncio.shield(fanout.done)
+        return results.count('delivered')
+    # Retries count toward the quorum, so wait on the record rather than on the first attempts
+    needed = math.ceil(quorum * len(subscribers)) if quorum else None
+    timeout = deadline_ms / 1000 if deadline_ms is not None else None
+    await asyncio.wait((record.wait(needed),), timeout=timeout)
+    return record.delivered
 
-async def send_webhook(session, webhook_url: str, payload: dict):
-    """Send a single webhook request."""
+async def send_webhook(session, webhook_url: str, body: bytes, content_encoding: str = None,
+                       trace: DeliveryTrace = None):
+    """Send a single webhook request with an already encoded JSON body."""
+    headers = {'Content-Type': 'application/json'}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    label = subscriber_label(webhook_url)
+    started = time.perf_counter()
     try:
-        async with session.post(
-            webhook_url,
-            json=payload,
-            timeout=10,
-            headers={'Content-Type': 'application/json'}
-        ) as response:
+        async with session.post(webhook_url, data=body, headers=headers, trace_request_ctx=trace) as response:
+            delivery_latency_metric.observe(time.perf_counter() - started, (label,))
+            responses_metric.inc((label, response.status))
             if response.status == 200:
+                logger.debug(f"Successfully sent to webhook: {webhook_url}")
                 return True
             else:
                 logger.warning(f"Webhook {webhook_url} returned status {response.status}")
                 return False
+    except asyncio.TimeoutError:
+        timeouts_metric.inc((label,))
+        logger.error(f"Timed out sending webhook to {webhook_url}")
+        return False
     except Exception as e:
+        errors_metric.inc((label,))
         logger.error(f"Error sending webhook to {webhook_url}: {e}")
         return False
 
@@ -103,23 +3727,11 @@ async def register_webhook_handler(request):
     """Register a webhook URL to receive push notifications."""
     try:
         data = await request.json()
-        webhook_url = data.get('webhook_url', '')
-        
-        if not webhook_url:
-            return web.json_response({'error': 'webhook_url is required'}, status=400)
-        
-        # Validate URL format
-        if not webhook_url.startswith(('http://', 'https://')):
-            return web.json_response({'error': 'Invalid webhook URL format'}, status=400)
-        
-        registered_webhooks.add(webhook_url)
-        logger.info(f"Registered webhook: {webhook_url}")
-        
-        return web.json_response({
-            'status': 'success',
-            'webhook_url': webhook_url,
-            'total_webhooks': len(registered_webhooks)
-        })
+        # The shard that owns the URL validates and stores it
+        status, response = await with_cluster_counts(
+            *await cluster.call(cluster.owner(str(data.get('webhook_url', ''))), 'register', data)
+        )
+        return web.json_response(response, status=status)
     except Exception as e:
         logger.error(f"Error in register_webhook_handler: {e}")
         return web.json_response({'error': str(e)}, status=500)
@@ -128,205 +3740,938 @@ async def unregister_webhook_handler(request):
     """Unregister a webhook URL."""
     try:
         data = await request.json()
-        webhook_url = data.get('webhook_url', '')
+        webhook_url = str(data.get('webhook_url', ''))
+        if webhook_url.partition(':')[0] in STREAM_TRANSPORTS:
+            # A streaming subscriber lives on the worker holding its connection, not on the key's owner
+            responses = await cluster.call_all('unregister', data)
+            removed = [response for response in responses if response[0] == 200 and response[1]['status'] == 'success']
+            status, response = removed[0] if removed else first_error(responses) or responses[0]
+        else:
+            status, response = await cluster.call(cluster.owner(webhook_url), 'unregister', data)
+        status, response = await with_cluster_counts(status, response)
+        return web.json_response(response, status=status)
+    except Exception as e:
+        logger.error(f"Error in unregister_webhook_handler: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+def parse_bulk_list(data: dict, key: str) -> list:
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{key} must be a non-empty array")
+    if len(items) > BULK_MAX_WEBHOOKS:
+        raise ValueError(f"At most {BULK_MAX_WEBHOOKS} webhooks per request")
+    return items
+
+async def register_bulk_handler(request):
+    """Register many webhooks in one request.
+
+    Items are URLs or registration objects; top-level options (``topics``,
+    ``batch``, ...) apply to items that don't set their own.
+    """
+    try:
+        data = await request.json()
+        try:
+            items = parse_bulk_list(data, 'webhooks')
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        defaults = {key: value for key, value in data.items() if key not in ('webhooks', 'since')}
+        items = [
+            {**defaults, **item} if isinstance(item, dict) else {**defaults, 'webhook_url': item}
+            for item in items
+        ]
+        for item in items:
+            item.pop('since', None)  # Catch-up is only offered to single registrations
         
-        if not webhook_url:
-            return web.json_response({'error': 'webhook_url is required'}, status=400)
+        # Each shard registers the webhooks it owns
+        groups = {shard: [] for shard in range(cluster.workers)} if cluster.enabled else {cluster.index: []}
+        for index, item in enumerate(items):
+            groups[cluster.owner(str(item.get('webhook_url', '')))].append(index)
+        shards = list(groups)
+        responses = await asyncio.gather(*(
+            cluster.call(shard, 'register_bulk', {'webhooks': [items[index] for index in groups[shard]]})
+            for shard in shards
+        ))
         
-        if webhook_url in registered_webhooks:
-            registered_webhooks.remove(webhook_url)
-            logger.info(f"Unregistered webhook: {webhook_url}")
-            status = 'success'
-        else:
-            status = 'not_found'
+        errors = []
+        for shard, (status, body) in zip(shards, responses):
+            indexes = groups[shard]
+            item_errors = body['errors'] if status == 200 else [body.get('error', f'HTTP {status}')] * len(indexes)
+            for index, error in zip(indexes, item_errors):
+                if error:
+                    errors.append({'index': index, 'webhook_url': items[index].get('webhook_url'), 'error': error})
+        errors.sort(key=lambda error: error['index'])
+        logger.info(f"Bulk registration: {len(items) - len(errors)} registered, {len(errors)} rejected")
+        return web.json_response({
+            'status': 'success' if not errors else 'partial' if len(errors) < len(items) else 'error',
+            'registered': len(items) - len(errors),
+            'rejected': len(errors),
+            'errors': errors,
+            'total_webhooks': sum(body['total_webhooks'] for status, body in responses if status == 200)
+        }, status=200 if len(errors) < len(items) else 400)
+    except Exception as e:
+        logger.error(f"Error in register_bulk_handler: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+async def unregister_bulk_handler(request):
+    """Unregister many webhook URLs in one request."""
+    try:
+        data = await request.json()
+        try:
+            webhook_urls = [str(webhook_url) for webhook_url in parse_bulk_list(data, 'webhook_urls')]
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
         
+        groups = {shard: [] for shard in range(cluster.workers)} if cluster.enabled else {cluster.index: []}
+        for webhook_url in webhook_urls:
+            groups[cluster.owner(webhook_url)].append(webhook_url)
+        responses = await asyncio.gather(*(
+            cluster.call(shard, 'unregister_bulk', {'webhook_urls': urls}) for shard, urls in groups.items()
+        ))
+        error = first_error(responses)
+        if error:
+            return web.json_response(error[1], status=error[0])
+        removed = sum(body['removed'] for _, body in responses)
         return web.json_response({
-            'status': status,
-            'webhook_url': webhook_url,
-            'total_webhooks': len(registered_webhooks)
+            'status': 'success',
+            'removed': removed,
+            'not_found': len(webhook_urls) - removed,
+            'total_webhooks': sum(body['total_webhooks'] for _, body in responses)
         })
     except Exception as e:
-        logger.error(f"Error in unregister_webhook_handler: {e}")
+        logger.error(f"Error in unregister_bulk_handler: {e}")
         return web.json_response({'error': str(e)}, status=500)
 
 async def list_webhooks_handler(request):
-    """List all registered webhooks."""
+    """List registered webhooks one page at a time, in URL order."""
+    try:
+        limit = int(request.query.get('limit', '100'))
+    except ValueError:
+        return web.json_response({'error': 'limit must be an integer'}, status=400)
+    data = {'cursor': request.query.get('cursor') or None, 'limit': max(1, min(limit, WEBHOOK_PAGE_LIMIT))}
+    responses = await cluster.call_all('webhooks', data)
+    error = first_error(responses)
+    if error:
+        return web.json_response(error[1], status=error[0])
+    if not cluster.enabled:
+        return web.json_response(responses[0][1])
+    # Every shard returned its first page after the cursor; the merged page is the smallest keys of all
+    candidates = sorted(webhook_url for _, body in responses for webhook_url in body['webhooks'])
+    page = candidates[:data['limit']]
+    more = len(candidates) > len(page) or any(body['next_cursor'] for _, body in responses)
+    merged = {
+        'webhooks': page,
+        'total': 0,
+        'next_cursor': page[-1] if more and page else None,
+        'options': {},
+        'stats': {},
+        'topics': Counter(),
+        'circuit_breakers': {},
+        'shards': []
+    }
+    on_page = set(page)
+    for _, body in responses:
+        merged['total'] += body['total']
+        for key in ('options', 'stats', 'circuit_breakers'):
+            merged[key].update((url, value) for url, value in body[key].items() if url in on_page)
+        merged['topics'].update(body['topics'])
+        merged['shards'].append(body['total'])
+    return web.json_response(merged)
+
+async def queues_handler(request):
+    """Report delivery queue depths, deepest first, or for one ``?webhook_url=``."""
+    try:
+        limit = int(request.query.get('limit', '100'))
+    except ValueError:
+        return web.json_response({'error': 'limit must be an integer'}, status=400)
+    data = {'webhook_url': request.query.get('webhook_url'), 'limit': max(1, min(limit, 1000))}
+    responses = await cluster.call_all('queues', data)
+    found = [body for status, body in responses if status == 200]
+    if not found:
+        return web.json_response(responses[0][1], status=responses[0][0])
+    if len(responses) == 1:
+        return web.json_response(found[0])
+    merged = {'lanes': {}, 'active_lanes': 0, 'queued': 0}
+    for body in found:
+        merged['lanes'].update(body['lanes'])
+        merged['active_lanes'] += body.get('active_lanes', 0)
+        merged['queued'] += body.get('queued', 0)
+    if not data['webhook_url']:
+        deepest = sorted(merged['lanes'].items(), key=lambda item: item[1]['depth'], reverse=True)
+        merged['lanes'] = dict(deepest[:data['limit']])
+    return web.json_response(merged)
+
+async def metrics_handler(request):
+    """Expose delivery metrics in the Prometheus text format."""
+    responses = await cluster.call_all('metrics')
+    error = first_error(responses)
+    if error:
+        return web.json_response(error[1], status=error[0])
+    return web.Response(
+        body=render_metrics([body['families'] for _, body in responses]).encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+async def stats_handler(request):
+    """Report fan-out throughput and connection pool usage."""
+    responses = await cluster.call_all('stats')
+    error = first_error(responses)
+    if error:
+        return web.json_response(error[1], status=error[0])
+    if not cluster.enabled:
+        return web.json_response(responses[0][1])
     return web.json_response({
-        'webhooks': list(registered_webhooks),
-        'total': len(registered_webhooks)
+        'workers': cluster.workers,
+        'total_webhooks': sum(body['total_webhooks'] for _, body in responses),
+        'pushes_per_second': round(sum(body['dispatcher']['pushes_per_second'] for _, body in responses), 3),
+        'shards': [body for _, body in responses]
     })
 
-async def index_handler(request):
-    """Serve a simple HTML page for testing."""
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>WebhookMCP Server</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }
-            .container { max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-            h1 { color: #333; }
-            .section { margin: 20px 0; padding: 15px; background: #f9f9f9; border-radius: 4px; border: 1px solid #ddd; }
-            .status { padding: 10px; background: #e3f2fd; border-radius: 4px; margin-bottom: 20px; }
-            input, button { padding: 8px; margin: 5px; border-radius: 4px; border: 1px solid #ddd; }
-            button { background: #4CAF50; color: white; cursor: pointer; }
-            button:hover { background: #45a049; }
-            .webhook-list { list-style: none; padding: 0; }
-            .webhook-item { padding: 8px; margin: 5px 0; background: white; border-left: 3px solid #2196F3; }
-            pre { background: #f5f5f5; padding: 10px; border-radius: 4px; overflow-x: auto; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🔔 WebhookMCP Server</h1>
-            <div class="status">
-                <strong>Status:</strong> <span style="color: green;">Running ✅</span><br>
-                <strong>Registered Webhooks:</strong> <span id="webhookCount">0</span>
-            </div>
-            
-            <div class="section">
-                <h2>Register Webhook</h2>
-                <input type="text" id="webhookUrl" placeholder="http://localhost:3000/webhook" style="width: 60%;">
-                <button onclick="registerWebhook()">Register</button>
-                <button onclick="refreshWebhooks()">Refresh List</button>
-            </div>
-            
-            <div class="section">
-                <h2>Test Push Message</h2>
-                <input type="text" id="testMessage" placeholder="Enter test message" style="width: 60%;">
-                <button onclick="pushMessage()">Push Message</button>
-            </div>
-            
-            <div class="section">
-                <h2>Registered Webhooks</h2>
-                <ul id="webhookList" class="webhook-list">
-                    <li>Loading...</li>
-                </ul>
-            </div>
-            
-            <div class="section">
-                <h2>API Endpoints</h2>
-                <pre>
+DASHBOARD_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>WebhookMCP Server</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }
+        .container { max-width: 800px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+        h1 { color: #333; }
+        .section { margin: 20px 0; padding: 15px; background: #f9f9f9; border-radius: 4px; border: 1px solid #ddd; }
+        .status { padding: 10px; background: #e3f2fd; border-radius: 4px; margin-bottom: 20px; }
+        input, button { padding: 8px; margin: 5px; border-radius: 4px; border: 1px solid #ddd; }
+        button { background: #4CAF50; color: white; cursor: pointer; }
+        button:hover { background: #45a049; }
+        .webhook-list { list-style: none; padding: 0; }
+        .webhook-item { padding: 8px; margin: 5px 0; background: white; border-left: 3px solid #2196F3; }
+        pre { background: #f5f5f5; padding: 10px; border-radius: 4px; overflow-x: auto; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🔔 WebhookMCP Server</h1>
+        <div class="status">
+            <strong>Status:</strong> <span style="color: green;">Running ✅</span><br>
+            <strong>Registered Webhooks:</strong> <span id="webhookCount">0</span><br>
+            <strong>Pushes/s:</strong> <span id="pushRate">-</span>
+            <strong>Deliveries/s:</strong> <span id="deliveryRate">-</span>
+            <strong>Failures/s:</strong> <span id="failureRate">-</span><br>
+            <strong>Queued:</strong> <span id="queued">-</span>
+            <strong>Open circuits:</strong> <span id="openCircuits">-</span>
+        </div>
+        
+        <div class="section">
+            <h2>Register Webhook</h2>
+            <input type="text" id="webhookUrl" placeholder="http://localhost:3000/webhook" style="width: 60%;">
+            <button onclick="registerWebhook()">Register</button>
+            <button onclick="refreshWebhooks()">Refresh List</button>
+        </div>
+        
+        <div class="section">
+            <h2>Test Push Message</h2>
+            <input type="text" id="testMessage" placeholder="Enter test message" style="width: 60%;">
+            <button onclick="pushMessage()">Push Message</button>
+        </div>
+        
+        <div class="section">
+            <h2>Registered Webhooks</h2>
+            <ul id="webhookList" class="webhook-list">
+                <li>Loading...</li>
+            </ul>
+            <button id="loadMore" onclick="loadMoreWebhooks()" style="display: none;">Load more</button>
+        </div>
+        
+        <div class="section">
+            <h2>API Endpoints</h2>
+            <pre>
 POST /api/register   - Register a webhook
 POST /api/unregister - Unregister a webhook
-GET  /api/webhooks   - List registered webhooks
-POST /api/push       - Push a message to all webhooks
-                </pre>
-            </div>
+POST /api/register/bulk   - Register many webhooks in one request
+POST /api/unregister/bulk - Unregister many webhooks in one request
+GET  /api/webhooks?limit=N&cursor=URL - List registered webhooks, one page at a time
+POST /api/push       - Push a message to all webhooks ({"mode": "async"} returns 202)
+POST /api/push/batch - Push many messages in one request
+POST /api/stream     - Stream NDJSON messages (GET upgrades to a WebSocket)
+GET  /api/subscribe  - Receive messages over SSE or a WebSocket instead of a webhook
+GET  /api/messages?since=N - Messages after sequence number N (catch-up)
+GET  /api/messages/{id} - Per-webhook delivery state of a message
+GET  /api/blobs/{hash} - Body of a large message delivered as a claim check
+GET  /api/traces     - Timelines of traced pushes (send X-Trace: 1 to trace one)
+GET  /api/stats      - Fan-out throughput and socket usage
+GET  /api/queues     - Per-webhook delivery queue depths
+GET  /api/events     - Live registry changes and delivery rates (SSE, used by this page)
+GET  /metrics        - Prometheus metrics
+            </pre>
         </div>
-        <script>
-            async function registerWebhook() {
-                const url = document.getElementById('webhookUrl').value;
-                if (!url) {
-                    alert('Please enter a webhook URL');
-                    return;
-                }
+    </div>
+    <script>
+        async function registerWebhook() {
+            const url = document.getElementById('webhookUrl').value;
+            if (!url) {
+                alert('Please enter a webhook URL');
+                return;
+            }
+            
+            try {
+                const response = await fetch('/api/register', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({webhook_url: url})
+                });
+                const data = await response.json();
+                alert(data.status === 'success' ? 'Webhook registered!' : 'Error: ' + data.error);
+            } catch (e) {
+                alert('Error: ' + e.message);
+            }
+        }
+        
+        let nextCursor = null;
+        const items = new Map();  // webhook_url -> list item
+        
+        function renderItem(url, state) {
+            const item = document.createElement('li');
+            const button = document.createElement('button');
+            item.className = 'webhook-item';
+            item.dataset.url = url;
+            button.textContent = 'Remove';
+            button.onclick = () => unregisterWebhook(url);
+            item.append(url, ' ', document.createElement('strong'), ' ', button);
+            items.set(url, item);
+            setCircuit(url, state);
+            return item;
+        }
+        
+        function setCircuit(url, state) {
+            const item = items.get(url);
+            if (item) {
+                item.querySelector('strong').textContent = state === 'closed' ? '' : `[circuit ${state}]`;
+            }
+        }
+        
+        function showEmpty() {
+            const list = document.getElementById('webhookList');
+            if (items.size === 0) {
+                list.innerHTML = '<li>No webhooks registered</li>';
+            } else if (!list.firstElementChild.classList.contains('webhook-item')) {
+                list.firstElementChild.remove();
+            }
+        }
+        
+        async function loadWebhooks(cursor) {
+            try {
+                const query = cursor ? '&cursor=' + encodeURIComponent(cursor) : '';
+                const response = await fetch('/api/webhooks?limit=50' + query);
+                const data = await response.json();
                 
-                try {
-                    const response = await fetch('/api/register', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({webhook_url: url})
-                    });
-                    const data = await response.json();
-                    alert(data.status === 'success' ? 'Webhook registered!' : 'Error: ' + data.error);
-                    refreshWebhooks();
-                } catch (e) {
-                    alert('Error: ' + e.message);
+                document.getElementById('webhookCount').textContent = data.total;
+                
+                const list = document.getElementById('webhookList');
+                if (!cursor) {
+                    items.clear();
+                    list.replaceChildren();
+                }
+                const breakers = data.circuit_breakers || {};
+                for (const w of data.webhooks) {
+                    list.append(renderItem(w, breakers[w] ? breakers[w].state : 'closed'));
                 }
+                showEmpty();
+                
+                nextCursor = data.next_cursor;
+                document.getElementById('loadMore').style.display = nextCursor ? '' : 'none';
+            } catch (e) {
+                alert('Error: ' + e.message);
             }
-            
-            async function refreshWebhooks() {
-                try {
-                    const response = await fetch('/api/webhooks');
-                    const data = await response.json();
-                    
-                    document.getElementById('webhookCount').textContent = data.total;
-                    
-                    const list = document.getElementById('webhookList');
-                    if (data.webhooks.length === 0) {
-                        list.innerHTML = '<li>No webhooks registered</li>';
-                    } else {
-                        list.innerHTML = data.webhooks.map(w => 
-                            `<li class="webhook-item">${w} <button onclick="unregisterWebhook('${w}')">Remove</button></li>`
-                        ).join('');
+        }
+        
+        function applyChanges(changes) {
+            const list = document.getElementById('webhookList');
+            for (const [kind, url] of changes) {
+                if (kind === 'registered') {
+                    // Only webhooks that sort into the pages loaded so far are shown
+                    if (items.has(url) || (nextCursor && url > nextCursor)) continue;
+                    const next = [...list.children].find(other => other.dataset.url > url);
+                    list.insertBefore(renderItem(url, 'closed'), next || null);
+                } else if (kind === 'unregistered') {
+                    const item = items.get(url);
+                    if (item) {
+                        item.remove();
+                        items.delete(url);
                     }
-                } catch (e) {
-                    alert('Error: ' + e.message);
+                } else {
+                    setCircuit(url, kind === 'circuit_open' ? 'open' : 'closed');
                 }
             }
-            
-            async function unregisterWebhook(url) {
-                try {
-                    const response = await fetch('/api/unregister', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({webhook_url: url})
-                    });
+            showEmpty();
+        }
+        
+        function connectEvents() {
+            const events = new EventSource('/api/events');
+            let connected = false;
+            events.onopen = () => {
+                // Changes made while disconnected were missed, so start over after a reconnect
+                if (connected) refreshWebhooks();
+                connected = true;
+            };
+            events.addEventListener('changes', event => {
+                const data = JSON.parse(event.data);
+                if (data.reload) {
                     refreshWebhooks();
-                } catch (e) {
-                    alert('Error: ' + e.message);
-                }
-            }
-            
-            async function pushMessage() {
-                const message = document.getElementById('testMessage').value;
-                if (!message) {
-                    alert('Please enter a message');
-                    return;
+                } else {
+                    applyChanges(data.changes);
                 }
-                
-                try {
-                    const response = await fetch('/api/push', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({message: message})
-                    });
-                    const data = await response.json();
-                    alert('Message sent to ' + data.webhooks_notified + ' webhook(s)');
-                } catch (e) {
-                    alert('Error: ' + e.message);
+            });
+            events.addEventListener('stats', event => {
+                const stats = JSON.parse(event.data);
+                document.getElementById('webhookCount').textContent = stats.total_webhooks;
+                document.getElementById('queued').textContent = stats.queued;
+                document.getElementById('openCircuits').textContent = stats.open_circuits;
+                if ('pushes_per_second' in stats) {
+                    document.getElementById('pushRate').textContent = stats.pushes_per_second;
+                    document.getElementById('deliveryRate').textContent = stats.deliveries_per_second;
+                    document.getElementById('failureRate').textContent = stats.failures_per_second;
                 }
+            });
+        }
+        
+        function refreshWebhooks() {
+            return loadWebhooks(null);
+        }
+        
+        function loadMoreWebhooks() {
+            return loadWebhooks(nextCursor);
+        }
+        
+        async function unregisterWebhook(url) {
+            try {
+                const response = await fetch('/api/unregister', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({webhook_url: url})
+                });
+            } catch (e) {
+                alert('Error: ' + e.message);
+            }
+        }
+        
+        async function pushMessage() {
+            const message = document.getElementById('testMessage').value;
+            if (!message) {
+                alert('Please enter a message');
+                return;
             }
             
-            // Initial load
-            refreshWebhooks();
-        </script>
-    </body>
-    </html>
+            try {
+                const response = await fetch('/api/push', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({message: message})
+                });
+                const data = await response.json();
+                alert(data.status === 'accepted'
+                    ? 'Message accepted as ' + data.message_id
+                    : 'Message sent to ' + data.webhooks_notified + ' webhook(s)');
+            } catch (e) {
+                alert('Error: ' + e.message);
+            }
+        }
+        
+        // Initial load, then live updates
+        refreshWebhooks();
+        connectEvents();
+    </script>
+</body>
+</html>
+"""
+
+# The page never changes while the process runs, so it is encoded, compressed and hashed once
+DASHBOARD_BODY = DASHBOARD_HTML.encode()
+DASHBOARD_GZIP = gzip.compress(DASHBOARD_BODY, compresslevel=9, mtime=0)
+DASHBOARD_ETAG = '"%s"' % hashlib.sha256(DASHBOARD_BODY).hexdigest()[:16]
+
+async def index_handler(request):
+    """Serve the dashboard page, gzipped when the client accepts it and revalidated by ETag."""
+    headers = {'ETag': DASHBOARD_ETAG, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if DASHBOARD_ETAG in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        return web.Response(body=DASHBOARD_GZIP, content_type='text/html', charset='utf-8', headers=headers)
+    return web.Response(body=DASHBOARD_BODY, content_type='text/html', charset='utf-8', headers=headers)
+
+async def dashboard_events_handler(request):
+    """Stream registry changes and delivery rates to the dashboard as Server-Sent Events."""
+    if len(dashboard_feed.viewers) >= MAX_DASHBOARD_VIEWERS:
+        return web.json_response({'error': 'Too many dashboard viewers'}, status=503)
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    viewer = dashboard_feed.subscribe()
+    try:
+        while True:
+            chunk = await viewer.get()
+            if chunk is None:
+                break
+            await response.write(chunk)
+    except ConnectionResetError:
+        pass
+    finally:
+        dashboard_feed.unsubscribe(viewer)
+    return response
+
+def resolve_push_mode(mode: str) -> str:
+    """Normalize a requested push mode, falling back to the server default."""
+    mode = (mode or PUSH_MODE).strip().lower()
+    if mode not in PUSH_MODES:
+        raise ValueError(f"Invalid mode '{mode}', expected one of: {', '.join(PUSH_MODES)}")
+    return mode
+
+def parse_push_wait(data: dict, query, mode: str) -> tuple:
+    """The optional ``deadline_ms`` and ``quorum`` (fraction of subscribers) a sync push waits for."""
+    deadline_ms = data.get('deadline_ms', query.get('deadline_ms'))
+    quorum = data.get('quorum', query.get('quorum'))
+    try:
+        deadline_ms = None if deadline_ms in (None, '') else float(deadline_ms)
+        quorum = None if quorum in (None, '') else float(quorum)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms and quorum must be numbers")
+    if deadline_ms is not None and not 0 < deadline_ms < math.inf:
+        raise ValueError("deadline_ms must be a positive number of milliseconds")
+    if quorum is not None and not 0 < quorum <= 1:
+        raise ValueError("quorum must be a fraction of subscribers between 0 and 1")
+    if mode == 'async' and (deadline_ms is not None or quorum is not None):
+        raise ValueError("deadline_ms and quorum only apply to sync pushes")
+    return deadline_ms, quorum
+
+def is_raw_message(request) -> bool:
+    """Whether a push body is the message itself rather than a JSON object describing it.
+
+    Only ``application/octet-stream`` or ``?raw=1`` opt in; every other body is
+    parsed as JSON whatever its Content-Type, as producers such as a header-less
+    ``fetch`` (``text/plain``) rely on.
     """
-    return web.Response(text=html, content_type='text/html')
+    if request.query.get('raw') in ('1', 'true'):
+        return True
+    # aiohttp reports octet-stream for a missing header too, and header-less bodies have always been JSON
+    return 'Content-Type' in request.headers and request.content_type == 'application/octet-stream'
+
+def json_body_too_large(request):
+    """Refuse a JSON push over the request size limit, pointing at the raw upload that takes large bodies."""
+    return web.json_response({
+        'error': f"JSON push bodies are limited to {request.client_max_size} bytes; send a large message on its own "
+                 f"as a raw body to /api/push (Content-Type: application/octet-stream or ?raw=1), "
+                 f"up to {BLOB_MAX_SIZE} bytes"
+    }, status=413)
+
+def parse_raw_message_options(query, defaults: dict = None) -> dict:
+    """The message spec of a raw push, from ``topic``, ``attribute.<name>`` and ``priority`` query parameters."""
+    attributes = {key[len('attribute.'):]: query[key] for key in query if key.startswith('attribute.')}
+    spec = parse_message_spec({'message': '-', 'topic': query.get('topic'), 'attributes': attributes or None}, defaults)
+    spec['message'] = None
+    return spec
 
 async def api_push_handler(request):
-    """API endpoint to push messages to registered webhooks."""
+    """API endpoint to push messages to registered webhooks.
+
+    A raw body (see is_raw_message) is the message itself. It is streamed
+    into the blob store without being held in memory, and the message is
+    delivered as a claim check (see EncodedPayload.for_subscriber).
+    """
     try:
-        data = await request.json()
-        message = data.get('message', '')
+        received = time.perf_counter()
+        raw = is_raw_message(request)
+        data = {} if raw else await request.json()
         
-        if not message:
-            return web.json_response({'error': 'Message is required'}, status=400)
+        try:
+            priority = request.query.get('priority')
+            defaults = {'priority': validate_priority(priority)} if priority else None
+            spec = parse_raw_message_options(request.query, defaults) if raw else parse_message_spec(data, defaults)
+            mode = resolve_push_mode(data.get('mode') or request.query.get('mode', ''))
+            deadline_ms, quorum = parse_push_wait(data, request.query, mode)
+            key = parse_idempotency_key(request, data)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        if raw:
+            if request.content_length == 0:
+                return web.json_response({'error': 'Message is required'}, status=400)
+            if (request.content_length or 0) > BLOB_MAX_SIZE:
+                return web.json_response({'error': f"Message bodies are limited to {BLOB_MAX_SIZE} bytes"}, status=413)
+            try:
+                spec['blob'] = await blob_store.write(request.content.iter_chunked(BLOB_CHUNK_SIZE),
+                                                      request.headers.get('Content-Type', 'application/octet-stream'),
+                                                      BLOB_MAX_SIZE)
+            except ValueError as e:
+                return web.json_response({'error': str(e)}, status=413)
+            if not spec['blob']['size']:
+                return web.json_response({'error': 'Message is required'}, status=400)  # A chunked body that was empty
+        if wants_trace(request, data):
+            spec['trace'] = {'parse_ms': (time.perf_counter() - received) * 1000}
         
-        # Send to all webhooks
-        success_count = await send_to_all_webhooks(message)
+        status, response = await publish_once(key, [spec], mode, deadline_ms, quorum)
+        if status != 200:
+            return web.json_response(response, status=status)
+        result = response['results'][0]
+        headers = replay_headers(response)
+        # Large JSON messages were moved to the blob store while publishing; don't echo them back
+        message = spec['message']
+        described = f"'{message}'" if message is not None else f"blob {spec['blob']['hash']} ({spec['blob']['size']} bytes)"
         
-        timestamp = datetime.now(timezone.utc).isoformat()
-        logger.info(f"API push: '{message}' sent to {success_count} webhooks")
+        if mode == 'async':
+            logger.info(f"API push: {described} accepted as {result['message_id']}")
+            return web.json_response({
+                'status': 'accepted',
+                'message_id': result['message_id'],
+                'message': message,
+                'blob': spec.get('blob'),
+                'timestamp': result['timestamp'],
+                'status_url': f"/api/messages/{result['message_id']}",
+                'topic': result['topic'],
+                'priority': spec.get('priority', DEFAULT_PRIORITY),
+                'matched_webhooks': result['matched_webhooks'],
+                'total_webhooks': response['total_webhooks']
+            }, status=202, headers=headers)
         
-        return web.json_response({
+        logger.info(f"API push: {described} sent to {result['webhooks_notified']} webhooks")
+        
+        body = {
             'status': 'success',
+            'message_id': result['message_id'],
             'message': message,
-            'timestamp': timestamp,
-            'webhooks_notified': success_count,
-            'total_webhooks': len(registered_webhooks)
-        })
+            'blob': spec.get('blob'),
+            'timestamp': result['timestamp'],
+            'topic': result['topic'],
+            'priority': spec.get('priority', DEFAULT_PRIORITY),
+            'webhooks_notified': result['webhooks_notified'],
+            'matched_webhooks': result['matched_webhooks'],
+            'total_webhooks': response['total_webhooks']
+        }
+        if 'confirmed_webhooks' in result:
+            body.update(confirmed_webhooks=result['confirmed_webhooks'], complete=result['complete'],
+                        status_url=f"/api/messages/{result['message_id']}")
+        return web.json_response(body, headers=headers)
+    except web.HTTPRequestEntityTooLarge:
+        return json_body_too_large(request)
     except Exception as e:
         logger.error(f"Error in api_push_handler: {e}")
         return web.json_response({'error': str(e)}, status=500)
 
+def replay_headers(response: dict):
+    """Mark a response that repeats an earlier push's result instead of delivering again."""
+    return {'Idempotent-Replayed': 'true'} if response.get('replayed') else None
+
+def parse_batch_messages(data: dict) -> list:
+    """Extract the message specs of a /api/push/batch request.
+
+    A top-level ``topic``/``attributes``/``priority`` applies to items that don't set their own.
+    """
+    messages = data.get('messages')
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("messages must be a non-empty array")
+    if len(messages) > PUSH_BATCH_MAX_MESSAGES:
+        raise ValueError(f"At most {PUSH_BATCH_MAX_MESSAGES} messages per batch")
+    defaults = parse_message_spec({
+        'message': '-', 'topic': data.get('topic'), 'attributes': data.get('attributes'), 'priority': data.get('priority')
+    })
+    del defaults['message']
+    return [parse_message_spec(item, defaults) for item in messages]
+
+async def api_push_batch_handler(request):
+    """API endpoint to push many messages in one request."""
+    try:
+        received = time.perf_counter()
+        data = await request.json()
+        
+        try:
+            messages = parse_batch_messages(data)
+            mode = resolve_push_mode(data.get('mode') or request.query.get('mode', ''))
+            key = parse_idempotency_key(request, data)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        if wants_trace(request, data):
+            trace = {'parse_ms': (time.perf_counter() - received) * 1000}
+            for spec in messages:
+                spec['trace'] = trace
+        
+        status, response = await publish_once(key, messages, mode)
+        if status != 200:
+            return web.json_response(response, status=status)
+        results = response['results']
+        headers = replay_headers(response)
+        
+        if mode == 'async':
+            logger.info(f"API batch push: {len(results)} messages accepted")
+            return web.json_response({
+                'status': 'accepted',
+                'count': len(results),
+                'message_ids': [result['message_id'] for result in results],
+                'total_webhooks': response['total_webhooks']
+            }, status=202, headers=headers)
+        
+        logger.info(f"API batch push: {len(results)} messages sent")
+        return web.json_response({
+            'status': 'success',
+            'count': len(results),
+            'results': results,
+            'total_webhooks': response['total_webhooks']
+        }, headers=headers)
+    except web.HTTPRequestEntityTooLarge:
+        return json_body_too_large(request)
+    except Exception as e:
+        logger.error(f"Error in api_push_batch_handler: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+async def api_stream_handler(request):
+    """Ingest a chunked NDJSON body: one message (a string or an object) per line."""
+    try:
+        mode, defaults = parse_stream_options(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    
+    stream = IngestStream(mode, defaults)
+    status = None
+    try:
+        pending = bytearray()
+        async for chunk in request.content.iter_any():
+            pending += chunk
+            if b'\n' in chunk:
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    if not await stream.feed(line):
+                        break
+            if stream.failure:
+                break
+            if len(pending) > STREAM_MAX_LINE_BYTES:
+                status = 413
+                break
+        else:
+            await stream.feed(pending)
+    except Exception as e:
+        logger.error(f"Error in api_stream_handler: {e}")
+        status = 500
+    finally:
+        # Also when the producer disconnects, so what it already sent is still published
+        summary = await stream.close()
+    
+    if status == 413:
+        summary.update(status='error', error=f"Line {stream.received + 1} exceeds {STREAM_MAX_LINE_BYTES} bytes")
+    elif status == 500:
+        summary.update(status='error', error='Stream read failed')
+    elif stream.failure:
+        status = stream.failure[0]
+    logger.info(f"Stream ingest: {summary['accepted']} messages accepted, {summary['rejected']} rejected")
+    return web.json_response(summary, status=status or 200)
+
+async def api_stream_ws_handler(request):
+    """Ingest messages over a WebSocket: one message per text frame, or several as NDJSON lines."""
+    try:
+        mode, defaults = parse_stream_options(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    
+    async def send_event(event: dict):
+        if not ws.closed:
+            await ws.send_json(event)
+    
+    stream = IngestStream(mode, defaults, send_event)
+    try:
+        # The socket is only read between feed() calls, so a full buffer pauses the producer
+        async for frame in ws:
+            if frame.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+                break
+            # Only newlines separate messages, as on the HTTP stream; feed() skips the empty lines
+            for line in frame.data.split('\n' if frame.type == WSMsgType.TEXT else b'\n'):
+                if not await stream.feed(line):
+                    break
+            if stream.failure:
+                break
+    finally:
+        summary = await stream.close()
+    
+    logger.info(f"WebSocket stream ingest: {summary['accepted']} messages accepted, {summary['rejected']} rejected")
+    await send_event(dict(summary, type='summary'))
+    await ws.close()
+    return ws
+
+async def subscribe_handler(request):
+    """Attach a streaming subscriber: a WebSocket if the request upgrades, Server-Sent Events otherwise."""
+    try:
+        query = request.query
+        filters = {key[len('filter.'):]: query.getall(key) for key in set(query) if key.startswith('filter.')}
+        options = parse_subscriber_options({'topics': query.getall('topic', []) or None, 'filters': filters or None,
+                                            'claim_check': query.get('claim_check') in ('1', 'true') or None})
+        # EventSource sends the id of the last event it saw when it reconnects
+        since = parse_since(request.headers.get('Last-Event-ID', query.get('since')))
+        client_id = query.get('id') or uuid.uuid4().hex
+        if len(client_id) > MAX_CLIENT_ID_LENGTH:
+            raise ValueError(f"id must be at most {MAX_CLIENT_ID_LENGTH} characters")
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    
+    websocket = request.headers.get('Upgrade', '').lower() == 'websocket'
+    key = f"{'ws' if websocket else 'sse'}:{client_id}"
+    if len(stream_subscribers) >= MAX_STREAM_SUBSCRIBERS and key not in stream_subscribers:
+        return web.json_response({'error': 'Too many streaming subscribers'}, status=503)
+    # A reconnect may reach another worker, where the old connection would keep receiving copies
+    await asyncio.gather(*(cluster.call(shard, 'unregister', {'webhook_url': key})
+                           for shard in range(cluster.workers) if shard != cluster.index))
+    
+    if websocket:
+        response = web.WebSocketResponse(heartbeat=STREAM_KEEPALIVE)
+        channel = WebSocketChannel(request, response)
+    else:
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering events
+        })
+        channel = SSEChannel(request, response)
+    await response.prepare(request)
+    await channel.serve(Subscriber(key, channel=channel, **options), since)
+    return response
+
+async def blob_handler(request):
+    """Serve a stored message body; FileResponse answers Range and conditional requests."""
+    digest = request.match_info['digest']
+    content_type = await asyncio.to_thread(blob_store.lookup, digest) if is_blob_digest(digest) else None
+    if content_type is None:
+        return web.json_response({'error': 'Blob not found'}, status=404)
+    # The content never changes under its hash, so clients may cache it for as long as it is kept
+    return web.FileResponse(blob_store.path(digest), chunk_size=BLOB_CHUNK_SIZE, headers={
+        'Content-Type': content_type,
+        'Cache-Control': f'public, max-age={int(BLOB_TTL)}, immutable',
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': 'sandbox'  # Producer-supplied HTML must not run scripts on this origin
+    })
+
+def parse_since(value):
+    """Validate a replay cursor; None means no catch-up was requested."""
+    if value is None or value == '':
+        return None
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("since must be a non-negative integer")
+    if since < 0:
+        raise ValueError("since must be a non-negative integer")
+    return since
+
+async def list_messages_handler(request):
+    """Return buffered messages after a sequence number so subscribers can catch up."""
+    # Every shard buffers every message under the sequence number shard 0 gave it
+    status, response = await cluster.call(0, 'catch_up', {
+        'since': request.query.get('since', '0'),
+        'limit': request.query.get('limit'),
+        'topics': request.query.getall('topic', [])
+    })
+    # The blob directory is shared, so the worker answering reads blobs itself rather than passing them between workers
+    if status == 200 and request.query.get('claim_check') not in ('1', 'true'):
+        response['messages'] = await inline_blobs(response['messages'])
+    return web.json_response(response, status=status)
+
+async def message_status(message_id: str):
+    """Per-subscriber delivery state of a pushed message across all shards, or None if unknown."""
+    responses = await cluster.call_all('message_status', {'message_id': message_id})
+    found = [body for status, body in responses if status == 200]
+    if len(found) <= 1:
+        return found[0] if found else None
+    # Each shard tracks the deliveries to its own subscribers
+    merged = dict(found[0], deliveries={}, delivery_ms={}, summary=Counter())
+    for body in found:
+        merged['deliveries'].update(body['deliveries'])
+        merged['delivery_ms'].update(body['delivery_ms'])
+        merged['summary'].update(body['summary'])
+    states = {body['state'] for body in found}
+    merged['state'] = states.pop() if len(states) == 1 else 'in_progress'
+    merged['completed_at'] = max(body['completed_at'] or '' for body in found) if merged['state'] == 'completed' else None
+    return merged
+
+async def message_status_handler(request):
+    """Report per-subscriber delivery state for a pushed message."""
+    status = await message_status(request.match_info['message_id'])
+    if status is None:
+        return web.json_response({'error': 'Unknown message_id'}, status=404)
+    return web.json_response(status)
+
+async def traces_handler(request):
+    """List recently traced messages, newest first."""
+    try:
+        limit = max(1, min(int(request.query.get('limit', '20')), TRACE_HISTORY))
+    except ValueError:
+        return web.json_response({'error': 'limit must be an integer'}, status=400)
+    responses = await cluster.call_all('traces')
+    error = first_error(responses)
+    if error:
+        return web.json_response(error[1], status=error[0])
+    # Each shard traced the deliveries to its own subscribers
+    merged = {}
+    for _, body in responses:
+        for summary in body['traces']:
+            existing = merged.get(summary['message_id'])
+            if existing is None:
+                merged[summary['message_id']] = summary
+                continue
+            existing['deliveries'] += summary['deliveries']
+            if summary['duration_ms'] is None or existing['duration_ms'] is None:
+                existing['duration_ms'] = None
+            else:
+                existing['duration_ms'] = max(existing['duration_ms'], summary['duration_ms'])
+            if summary['slowest'] and (not existing['slowest'] or summary['slowest']['ms'] > existing['slowest']['ms']):
+                existing['slowest'] = summary['slowest']
+    traces = sorted(merged.values(), key=lambda summary: summary['started_at'], reverse=True)[:limit]
+    return web.json_response({'traces': traces, 'sample_rate': TRACE_SAMPLE_RATE})
+
+async def trace_handler(request):
+    """Timeline of one traced message: push stages and per-delivery HTTP events."""
+    responses = await cluster.call_all('traces', {'message_id': request.match_info['message_id']})
+    found = [body for status, body in responses if status == 200]
+    if not found:
+        return web.json_response({'error': 'No trace for this message_id'}, status=404)
+    trace = found[0]
+    for body in found[1:]:
+        trace['deliveries'].update(body['deliveries'])
+        trace['untraced_deliveries'] += body['untraced_deliveries']
+    if len(found) > 1:
+        trace['shard_spans'] = [body['spans'] for body in found]
+    return web.json_response(trace)
+
+async def profile_handler(request):
+    """Sample the event loop's stacks for ``seconds`` and report where the time went.
+
+    Disabled unless WEBHOOK_PROFILE_TOKEN is set; the token is passed as a
+    bearer token. ``format=folded`` returns collapsed stacks for flame graphs.
+    """
+    if not PROFILE_TOKEN:
+        return web.json_response({'error': 'Profiling is disabled; set WEBHOOK_PROFILE_TOKEN'}, status=404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), PROFILE_TOKEN.encode()):
+        return web.json_response({'error': 'Invalid profiling token'}, status=403)
+    try:
+        seconds = float(request.query.get('seconds', '5'))
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError()
+    except ValueError:
+        return web.json_response({'error': f'seconds must be between 0 and {PROFILE_MAX_SECONDS}'}, status=400)
+    if not profile_lock.acquire(blocking=False):
+        return web.json_response({'error': 'A profile is already running'}, status=409)
+    try:
+        logger.info(f"Profiling the event loop for {seconds}s")
+        # This handler runs on the event loop's thread, which is the one to sample
+        stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds, PROFILE_INTERVAL)
+    finally:
+        profile_lock.release()
+    if request.query.get('format') == 'folded':
+        return web.Response(text=folded_stacks(stacks), content_type='text/plain')
+    report = profile_report(stacks, seconds)
+    if cluster.enabled:
+        report['shard'] = cluster.index
+    return web.json_response(report)
+
 async def setup_web_server(port: int, host: str):
     """Set up and start the web server."""
-    global web_app, web_runner
+    global web_app, web_runner, web_loop, shard_runner
     
     if web_runner:
         logger.info("Web server already running")
@@ -337,76 +4682,371 @@ async def setup_web_server(port: int, host: str):
         web_app.router.add_get('/', index_handler)
         web_app.router.add_post('/api/register', register_webhook_handler)
         web_app.router.add_post('/api/unregister', unregister_webhook_handler)
+        web_app.router.add_post('/api/register/bulk', register_bulk_handler)
+        web_app.router.add_post('/api/unregister/bulk', unregister_bulk_handler)
         web_app.router.add_get('/api/webhooks', list_webhooks_handler)
         web_app.router.add_post('/api/push', api_push_handler)
+        web_app.router.add_post('/api/push/batch', api_push_batch_handler)
+        web_app.router.add_post('/api/stream', api_stream_handler)
+        web_app.router.add_get('/api/stream', api_stream_ws_handler)
+        web_app.router.add_get('/api/subscribe', subscribe_handler)
+        web_app.router.add_get('/api/stats', stats_handler)
+        web_app.router.add_get('/metrics', metrics_handler)
+        web_app.router.add_get('/api/queues', queues_handler)
+        web_app.router.add_get('/api/events', dashboard_events_handler)
+        web_app.router.add_get('/api/messages', list_messages_handler)
+        web_app.router.add_get('/api/messages/{message_id}', message_status_handler)
+        web_app.router.add_get('/api/blobs/{digest}', blob_handler)
+        web_app.router.add_get('/api/traces', traces_handler)
+        web_app.router.add_get('/api/traces/{message_id}', trace_handler)
+        web_app.router.add_get('/debug/profile', profile_handler)
+        
+        await load_registry()
         
         web_runner = web.AppRunner(web_app)
         await web_runner.setup()
+        start_push_workers()
+        await asyncio.to_thread(blob_store.open)
+        maintenance_tasks.append(asyncio.create_task(blob_sweeper()))
+        if subscriber_store:
+            maintenance_tasks.append(asyncio.create_task(registry_compactor()))
+        if outbox and outbox.thread is None:
+            unfinished = outbox.open()
+            restore_replay_state()
+            maintenance_tasks.append(asyncio.create_task(outbox_pruner()))
+            if unfinished:
+                maintenance_tasks.append(asyncio.create_task(resume_outbox(unfinished)))
         
-        site = web.TCPSite(web_runner, host, port)
+        if cluster.enabled:
+            await start_shard_listener()
+            if cluster.index == 0 and not shard_processes:
+                for shard in range(1, cluster.workers):
+                    spawn_shard_worker(shard)
+                maintenance_tasks.append(asyncio.create_task(supervise_shard_workers()))
+            await wait_for_shards()
+        if subscriber_store:
+            maintenance_tasks.append(asyncio.create_task(rebalance_subscribers()))
+        
+        # With several workers the kernel spreads incoming connections over all of them
+        site = web.TCPSite(web_runner, host, port, reuse_port=cluster.enabled or None)
         await site.start()
         
+        web_loop = asyncio.get_running_loop()
+        web_server_ready.set()
         logger.info(f"Web server started on http://{host}:{port}")
+        record_startup('http')
         return True
     except Exception as e:
         logger.error(f"Failed to start web server: {e}")
+        if shard_runner:
+            await shard_runner.cleanup()
+            shard_runner = None
+        if web_runner:
+            await web_runner.cleanup()
+            web_runner = None
         return False
 
+async def shutdown_web_server():
+    """Stop background work, close pooled connections and the web server."""
+    global web_app, web_runner, web_loop, push_queue, shard_runner
+    
+    for subscriber in list(stream_subscribers.values()):
+        subscriber.channel.close('server shutting down')
+    await dashboard_feed.close()
+    
+    tasks = (push_worker_tasks + maintenance_tasks + list(retry_tasks)
+             + [stream.publisher for stream in active_streams])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    push_worker_tasks.clear()
+    maintenance_tasks.clear()
+    push_queue = None
+    
+    if outbox:
+        await outbox.close()
+    
+    if subscriber_store and subscriber_store.log_file:
+        if subscriber_store.log_entries:
+            await subscriber_store.compact(registered_webhooks)
+        subscriber_store.close()
+    
+    await dispatcher.close()
+    await cluster.close()
+    stop_shard_workers()
+    if shard_runner:
+        await shard_runner.cleanup()
+        shard_runner = None
+    if web_runner:
+        await web_runner.cleanup()
+    web_app = web_runner = web_loop = None
+    web_server_ready.clear()
+    logger.info("Web server stopped")
+
 # === MCP TOOLS ===
 
-@mcp.tool()
-async def push_webhook(message: str = "", port: str = "8000", host: str = "0.0.0.0") -> str:
-    """Push a message to all registered webhooks via HTTP POST."""
+async def ensure_web_server(port: str, host: str) -> tuple:
+    """Resolve a tool's port/host arguments, starting the web server on the first call only."""
+    try:
+        port_int = int(port) if port.strip() else DEFAULT_PORT
+    except ValueError:
+        raise ValueError(f"Invalid port number: {port}")
+    host_str = host.strip() if host.strip() else DEFAULT_HOST
+    if not web_server_ready.is_set() and not await setup_web_server(port_int, host_str):
+        raise RuntimeError("Failed to start web server")
+    return port_int, host_str
+
+def get_server_session() -> ClientSession:
+    """mcp-only: the client session used to reach the web server at SERVER_URL."""
+    global server_session
+    if server_session is None:
+        server_session = ClientSession(timeout=ClientTimeout(total=SERVER_TIMEOUT))
+    return server_session
+
+async def forward_publish(key, specs: list, mode: str, deadline_ms: float = None, quorum: float = None) -> tuple:
+    """mcp-only: publish through the web server's push API, shaped like publish_once()'s result.
+
+    ``deadline_ms``/``quorum`` are only supported for a single message, like /api/push.
+    """
+    data = {'mode': mode, 'idempotency_key': key} if key else {'mode': mode}
+    if len(specs) == 1:
+        wait = {'deadline_ms': deadline_ms, 'quorum': quorum}
+        data.update({field: value for field, value in wait.items() if value is not None})
+        async with get_server_session().post(f"{SERVER_URL}/api/push", json=dict(specs[0], **data)) as response:
+            body = await response.json()
+        if response.status in (200, 202):
+            fields = ('message_id', 'timestamp', 'topic', 'matched_webhooks', 'webhooks_notified')
+            result = {field: body.get(field) for field in fields}
+            if 'confirmed_webhooks' in body:
+                result.update(confirmed_webhooks=body['confirmed_webhooks'], complete=body['complete'])
+            body = {'results': [result], 'total_webhooks': body['total_webhooks']}
+    else:
+        async with get_server_session().post(f"{SERVER_URL}/api/push/batch", json=dict(data, messages=specs)) as response:
+            body = await response.json()
+        if response.status == 202:
+            # Accepted batches only report their IDs
+            body['results'] = [{'message_id': message_id} for message_id in body.pop('message_ids')]
+    if response.status not in (200, 202):
+        return response.status, body
+    body['replayed'] = response.headers.get('Idempotent-Replayed') == 'true'
+    return 200, body
+
+async def forward_message_status(message_id: str):
+    """mcp-only: message_status() as reported by the web server."""
+    async with get_server_session().get(f"{SERVER_URL}/api/messages/{quote(message_id, safe='')}") as response:
+        if response.status == 404:
+            return None
+        body = await response.json()
+        if response.status != 200:
+            raise RuntimeError(body.get('error', f"HTTP {response.status}"))
+        return body
+
+async def tool_publish(key, specs: list, mode: str, port: str, host: str,
+                       deadline_ms: float = None, quorum: float = None) -> tuple:
+    """Publish on behalf of an MCP tool: (http_status, body, server_url).
+
+    In mcp-only mode the web server is another process and gets the messages
+    through its push API; otherwise they are published in-process, starting
+    the web server on the first call.
+    """
+    if RUN_MODE == 'mcp-only':
+        status, response = await forward_publish(key, specs, mode, deadline_ms, quorum)
+        return status, response, SERVER_URL
+    port_int, host_str = await ensure_web_server(port, host)
+    status, response = await run_on_web_loop(publish_once(key, specs, mode, deadline_ms, quorum))
+    return status, response, f"http://{host_str}:{port_int}"
+
+async def delivery_reports(message_ids: list, wait_seconds: float, status_of=message_status) -> list:
+    """Delivery status of each message, waiting up to ``wait_seconds`` for all of them to complete."""
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        reports = await asyncio.gather(*(status_of(message_id) for message_id in message_ids))
+        if time.monotonic() >= deadline or all(report is None or report['state'] == 'completed' for report in reports):
+            return reports
+        await asyncio.sleep(REPORT_POLL_INTERVAL)
+
+def summarize_report(message_id: str, report: dict, max_subscribers: int) -> dict:
+    if report is None:
+        return {'message_id': message_id, 'state': 'unknown'}
+    deliveries, delivery_ms = report['deliveries'], report['delivery_ms']
+    # Problems first, so a capped list still shows every subscriber that needs attention
+    urls = sorted(deliveries, key=lambda webhook_url: deliveries[webhook_url] == 'delivered')[:max_subscribers]
+    return {
+        'message_id': message_id,
+        'state': report['state'],
+        'timestamp': report['timestamp'],
+        'topic': report['topic'],
+        'summary': dict(report['summary']),
+        'slowest_ms': max(delivery_ms.values(), default=None),
+        'subscribers': {
+            webhook_url: {'status': deliveries[webhook_url], 'ms': delivery_ms.get(webhook_url)} for webhook_url in urls
+        },
+        'truncated': len(deliveries) > len(urls)
+    }
+
+async def push_webhook(message: str = "", port: str = "8000", host: str = "0.0.0.0", mode: str = "", topic: str = "",
+                       deadline_ms: float = 0, quorum: float = 0, priority: str = "") -> str:
+    """Push a message to all registered webhooks via HTTP POST. Use mode "async" to return immediately with a message ID; set topic to reach only subscribers of that topic. Set priority "high" for urgent messages that should overtake queued ones, or "low" for bulk traffic (default "normal"). In sync mode, deadline_ms and/or quorum (fraction of subscribers, e.g. 0.9) return as soon as that many confirmed or the deadline passed, while the remaining deliveries continue in the background."""
     logger.info(f"Executing push_webhook with message: {message}")
     
     if not message.strip():
         return "❌ Error: Message is required"
     
     try:
-        # Parse port
-        port_int = int(port) if port.strip() else DEFAULT_PORT
-        host_str = host.strip() if host.strip() else DEFAULT_HOST
-        
-        # Ensure web server is running
-        await setup_web_server(port_int, host_str)
+        mode = resolve_push_mode(mode)
+        spec = parse_message_spec({'message': message, 'topic': topic.strip() or None, 'priority': priority.strip() or None})
+        deadline_ms, quorum = parse_push_wait({'deadline_ms': deadline_ms or None, 'quorum': quorum or None}, {}, mode)
+    except ValueError as e:
+        return f"❌ Error: {e}"
+    
+    try:
+        status, response, server = await tool_publish(None, [spec], mode, port, host, deadline_ms, quorum)
+        if status != 200:
+            return f"❌ Error: {response['error']}"
+        result = response['results'][0]
+        total_webhooks = response['total_webhooks']
         
-        # Send to all webhooks
-        success_count = await send_to_all_webhooks(message)
+        if mode == 'async':
+            return f"""✅ Message accepted for delivery!
+
+📊 Details:
+- Message: {message}
+- Message ID: {result['message_id']}
+- Timestamp: {result['timestamp']}
+- Webhooks registered: {total_webhooks}
+- Status: {server}/api/messages/{result['message_id']}"""
         
-        timestamp = datetime.now(timezone.utc).isoformat()
-        total_webhooks = len(registered_webhooks)
+        confirmed = ""
+        if 'confirmed_webhooks' in result:
+            shown = result['confirmed_webhooks'][:TOOL_MAX_LISTED_WEBHOOKS]
+            more = len(result['confirmed_webhooks']) - len(shown)
+            confirmed = f"\n- Confirmed: {', '.join(shown) or 'none'}{f' and {more} more' if more else ''}"
+            if not result['complete']:
+                confirmed += f"\n- Still delivering in the background: {server}/api/messages/{result['message_id']}"
         
         return f"""✅ Message pushed successfully!
 
 📊 Details:
 - Message: {message}
-- Timestamp: {timestamp}
-- Webhooks notified: {success_count}/{total_webhooks}
-- Server: http://{host_str}:{port_int}
+- Message ID: {result['message_id']}
+- Timestamp: {result['timestamp']}
+- Webhooks notified: {result['webhooks_notified']}/{result['matched_webhooks']}{f" (topic '{result['topic']}', {total_webhooks} registered)" if result['topic'] else ""}{confirmed}
+- Server: {server}
 
-💡 To manage webhooks, open http://{host_str}:{port_int} in a browser.
-💡 Register webhooks via POST to http://{host_str}:{port_int}/api/register with {{"webhook_url": "your_url"}}"""
+💡 To manage webhooks, open {server} in a browser.
+💡 Register webhooks via POST to {server}/api/register with {{"webhook_url": "your_url"}}"""
         
-    except ValueError:
-        return f"❌ Error: Invalid port number: {port}"
+    except ValueError as e:
+        return f"❌ Error: {e}"
     except Exception as e:
         logger.error(f"Error in push_webhook: {e}")
         return f"❌ Error: {str(e)}"
 
+async def push_webhook_batch(messages: list[str | dict], mode: str = "", topic: str = "", idempotency_key: str = "",
+                             port: str = "8000", host: str = "0.0.0.0") -> dict[str, Any]:
+    """Push many messages in one call. Each message is a string or an object with "message" and optional "topic"/"attributes"; topic applies to messages without their own. Returns a message ID and delivery counts per message; mode "async" returns as soon as the messages are queued. Repeating a call with the same idempotency_key returns the first call's result without sending again."""
+    logger.info(f"Executing push_webhook_batch with {len(messages)} messages")
+    started = time.perf_counter()
+    try:
+        specs = parse_batch_messages({'messages': messages, 'topic': topic.strip() or None})
+        mode = resolve_push_mode(mode)
+        status, response, _ = await tool_publish(idempotency_key.strip() or None, specs, mode, port, host)
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error in push_webhook_batch: {e}")
+        return {'status': 'error', 'error': str(e)}
+    if status != 200:
+        return {'status': 'error', 'error': response['error']}
+    return {
+        'status': 'accepted' if mode == 'async' else 'success',
+        'mode': mode,
+        'count': len(response['results']),
+        'results': response['results'],
+        'total_webhooks': response['total_webhooks'],
+        'replayed': response.get('replayed', False),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+async def delivery_report(message_ids: list[str], wait_seconds: float = 0, max_subscribers: int = 100,
+                          port: str = "8000", host: str = "0.0.0.0") -> dict[str, Any]:
+    """Report how pushed messages were delivered: state, per-status counts, and each subscriber's outcome and milliseconds from acceptance to that outcome. Set wait_seconds to wait for async pushes to finish. Failed subscribers are listed first, up to max_subscribers per message."""
+    if not message_ids or len(message_ids) > PUSH_BATCH_MAX_MESSAGES:
+        return {'status': 'error', 'error': f"message_ids must list between 1 and {PUSH_BATCH_MAX_MESSAGES} IDs"}
+    try:
+        wait_seconds = max(0.0, min(float(wait_seconds), REPORT_MAX_WAIT))
+        if RUN_MODE == 'mcp-only':
+            reports = await delivery_reports(list(message_ids), wait_seconds, forward_message_status)
+        else:
+            await ensure_web_server(port, host)
+            reports = await run_on_web_loop(delivery_reports(list(message_ids), wait_seconds))
+    except ValueError as e:
+        return {'status': 'error', 'error': str(e)}
+    except Exception as e:
+        logger.error(f"Error in delivery_report: {e}")
+        return {'status': 'error', 'error': str(e)}
+    messages = [
+        summarize_report(message_id, report, max(0, max_subscribers))
+        for message_id, report in zip(message_ids, reports)
+    ]
+    totals = Counter()
+    for message in messages:
+        totals.update(message.get('summary', {}))
+    return {
+        'status': 'success',
+        'completed': all(message['state'] == 'completed' for message in messages),
+        'totals': dict(totals),
+        'messages': messages
+    }
+
+def create_mcp_server():
+    """Build the MCP stdio server. FastMCP is imported here, so http-only processes never load it."""
+    from mcp.server.fastmcp import FastMCP
+    server = FastMCP("webhook")
+    for tool in (push_webhook, push_webhook_batch, delivery_report):
+        server.tool()(tool)
+    return server
+
 # === SERVER STARTUP ===
+def record_startup(interface: str):
+    """Remember how long after launch ``interface`` ("http" or "mcp") started serving."""
+    if interface not in startup_ms:
+        startup_ms[interface] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+        logger.info(f"✓ {interface} serving {startup_ms[interface]} ms after launch")
+
+def log_web_server_ready():
+    logger.info(f"✓ Web server ready at http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    logger.info(f"✓ Webhook management: http://{DEFAULT_HOST}:{DEFAULT_PORT}/api/webhooks")
+    logger.info(f"✓ Dashboard available at http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+
+async def run_single_loop():
+    """Run the web server and the MCP stdio server on one shared event loop."""
+    logger.info(f"Initializing web server on port {DEFAULT_PORT}...")
+    # The MCP import is mostly disk reads, so it overlaps well with loading the registry
+    mcp, started = await asyncio.gather(asyncio.to_thread(create_mcp_server), setup_web_server(DEFAULT_PORT, DEFAULT_HOST))
+    if not started:
+        raise RuntimeError("Failed to start web server")
+    log_web_server_ready()
+    
+    try:
+        record_startup('mcp')
+        logger.info("MCP server ready for commands")
+        await mcp.run_stdio_async()
+    finally:
+        logger.info("Web server shutting down...")
+        await shutdown_web_server()
+
 def run_webserver_in_thread():
     """Run the web server in a separate thread with its own event loop."""
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     
     async def start_server():
-        logger.info("Initializing web server on port 8000...")
+        logger.info(f"Initializing web server on port {DEFAULT_PORT}...")
         success = await setup_web_server(DEFAULT_PORT, DEFAULT_HOST)
         
         if success:
-            logger.info(f"✓ Web server ready at http://{DEFAULT_HOST}:{DEFAULT_PORT}")
-            logger.info(f"✓ Webhook management: http://{DEFAULT_HOST}:{DEFAULT_PORT}/api/webhooks")
-            logger.info(f"✓ Dashboard available at http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+            log_web_server_ready()
         else:
             logger.error("Failed to start web server")
             return
@@ -416,34 +5056,100 @@ def run_webserver_in_thread():
             await asyncio.Event().wait()  # Wait indefinitely
         except asyncio.CancelledError:
             logger.info("Web server shutting down...")
-            if client_session and not client_session.closed:
-                await client_session.close()
+            await shutdown_web_server()
     
     try:
         loop.run_until_complete(start_server())
     finally:
         loop.close()
 
+def run_threaded():
+    """Run the web server in a background thread and the MCP server on the main thread."""
+    # Start web server in a background thread
+    # This ensures it has its own event loop that stays active
+    webserver_thread = threading.Thread(target=run_webserver_in_thread, daemon=True)
+    webserver_thread.start()
+    mcp = create_mcp_server()
+    
+    # Wait until the web server accepts connections (or its thread gave up)
+    deadline = time.monotonic() + WEB_SERVER_READY_TIMEOUT
+    while not web_server_ready.wait(0.05):
+        if not webserver_thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("Failed to start web server")
+    
+    # Start MCP server (blocking call)
+    record_startup('mcp')
+    logger.info("MCP server ready for commands")
+    mcp.run(transport='stdio')
+
+async def run_http_only(parent: int = None):
+    """Serve HTTP (and shard IPC) until SIGTERM/SIGINT, or until the ``parent`` process goes away."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    if not await setup_web_server(DEFAULT_PORT, DEFAULT_HOST):
+        sys.exit(1)
+    if parent is None:
+        log_web_server_ready()
+    try:
+        while not stop.is_set() and (parent is None or os.getppid() == parent):
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await shutdown_web_server()
+
+async def run_mcp_only():
+    """Serve MCP over stdio and hand every tool call to the web server at SERVER_URL."""
+    mcp = create_mcp_server()
+    record_startup('mcp')
+    logger.info(f"MCP server ready for commands (web server: {SERVER_URL})")
+    try:
+        await mcp.run_stdio_async()
+    finally:
+        if server_session:
+            await server_session.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WebhookMCP server: webhook fan-out over HTTP and an MCP stdio server")
+    parser.add_argument('--mode', default=RUN_MODE,
+                        help="combined: web server and MCP in one process (default); http-only: just the web server; "
+                             "mcp-only: MCP tools that forward to a running web server")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="web server port")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="web server bind address")
+    parser.add_argument('--server-url', default=SERVER_URL,
+                        help="web server used in mcp-only mode (default: http://127.0.0.1:PORT)")
+    args = parser.parse_args(argv)
+    # Checked here rather than with choices= so a bad WEBHOOK_MODE is reported too
+    if args.mode not in RUN_MODES:
+        parser.error(f"invalid mode '{args.mode}', expected one of: {', '.join(RUN_MODES)}")
+    return args
+
 if __name__ == "__main__":
-    logger.info("Starting WebhookMCP server (MCP name: 'webhook')...")
+    args = parse_args()
+    RUN_MODE, DEFAULT_PORT, DEFAULT_HOST = args.mode, args.port, args.host
+    SERVER_URL = (args.server_url or f"http://127.0.0.1:{DEFAULT_PORT}").rstrip('/')
+    
+    if SHARD_INDEX > 0:
+        logger.info(f"Starting shard worker {SHARD_INDEX}/{WORKERS}...")
+        asyncio.run(run_http_only(parent=os.getppid()))
+        sys.exit(0)
+    
+    logger.info(f"Starting WebhookMCP server (MCP name: 'webhook', mode: {RUN_MODE}, runtime: {RUNTIME_MODE})...")
     
     try:
-        # Start web server in a background thread
-        # This ensures it has its own event loop that stays active
-        webserver_thread = threading.Thread(target=run_webserver_in_thread, daemon=True)
-        webserver_thread.start()
-        
-        # Give the web server a moment to start
-        import time
-        time.sleep(1)
-        
-        # Start MCP server (blocking call)
-        logger.info("MCP server ready for commands")
-        mcp.run(transport='stdio')
+        if RUN_MODE == "http-only":
+            asyncio.run(run_http_only())
+        elif RUN_MODE == "mcp-only":
+            asyncio.run(run_mcp_only())
+        elif RUNTIME_MODE == "threaded":
+            run_threaded()
+        else:
+            asyncio.run(run_single_loop())
     except KeyboardInterrupt:
         logger.info("Shutting down...")
-        if client_session and not client_session.closed:
-            asyncio.run(client_session.close())
     except Exception as e:
         logger.error(f"Server error: {e}", exc_info=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)